@@ -1,14 +1,252 @@
+import datetime
+
 from django.contrib import admin
-from .models import BloqueHorario, Reserva, Sugerencia
+from django.contrib.admin import helpers
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Count
+from django.http import HttpResponseBadRequest
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils import timezone
+from django.utils.functional import cached_property
+from .models import (
+    BloqueHorario, Reserva, Sugerencia, PreguntaEncuesta, OpcionEncuesta,
+    ReservaArchivada, ResumenDiario, EstadisticaDiaria, Tarea, Asistencia,
+)
+from . import busqueda, estadisticas, exportar, ocupacion
+
+# Exportar a CSV o JSONL sin cargar todo en memoria (ver exportar.py): acciones
+# para las filas seleccionadas y, si la clase define filtrar_exportar (función
+# de exportar.py que arma la consulta desde los parámetros GET), la URL
+# .../exportar/?formato=csv&desde=&hasta=
+class ExportarMixin:
+    columnas_exportar = ()
+    filtrar_exportar = None
+    change_list_template = 'admin/agendamiento/exportar_change_list.html'
+    actions = ['exportar_csv', 'exportar_jsonl']
+
+    def get_urls(self):
+        if self.filtrar_exportar is None:
+            return super().get_urls()
+        nombre = f'{self.model._meta.app_label}_{self.model._meta.model_name}_exportar'
+        return [path('exportar/', self.admin_site.admin_view(self.vista_exportar), name=nombre), *super().get_urls()]
+
+    def nombre_archivo(self):
+        return f'{self.model._meta.model_name}s_{timezone.localdate().isoformat()}'
+
+    def vista_exportar(self, request):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        formato = request.GET.get('formato', 'csv')
+        if formato not in exportar.FORMATOS:
+            return HttpResponseBadRequest("Formato no válido (csv o jsonl).")
+        try:
+            consulta = self.filtrar_exportar(request.GET)
+        except ValueError:
+            return HttpResponseBadRequest("Filtros no válidos: las fechas van como AAAA-MM-DD.")
+        return exportar.respuesta(consulta, self.columnas_exportar, formato, self.nombre_archivo())
+
+    @admin.action(description="Exportar seleccionadas a CSV")
+    def exportar_csv(self, request, queryset):
+        return exportar.respuesta(queryset.order_by('pk'), self.columnas_exportar, 'csv', self.nombre_archivo())
+
+    @admin.action(description="Exportar seleccionadas a JSONL")
+    def exportar_jsonl(self, request, queryset):
+        return exportar.respuesta(queryset.order_by('pk'), self.columnas_exportar, 'jsonl', self.nombre_archivo())
+
+class PaginadorContadores(Paginator):
+    """Total de la lista desde los contadores de OcupacionBloque, sin COUNT(*) sobre Reserva."""
+    # Bajo este total se cuentan las filas de verdad (como mucho estas): si los
+    # contadores se quedaron cortos, el admin no debe creer que cabe todo en
+    # una página y cargar la tabla entera.
+    EXACTO_HASTA = 1000
+
+    @cached_property
+    def count(self):
+        total = ocupacion.contar_reservas(self.object_list)
+        if total is None:
+            return super().count
+        if total < self.EXACTO_HASTA:
+            total = max(total, self.object_list.order_by()[:self.EXACTO_HASTA].count())
+        return total
 
 # Opcional, pero muy recomendado para una mejor vista:
-class ReservaAdmin(admin.ModelAdmin):
+# Pensada para millones de reservas: bloque y usuario vienen en la misma
+# consulta que la página, el total y la navegación por fechas salen de los
+# contadores (una fila por bloque y día) y la página se lee en el orden del
+# índice (fecha, bloque). Si los contadores se desajustan, el total también:
+# python manage.py recalcular_ocupacion los corrige.
+class ReservaAdmin(ExportarMixin, admin.ModelAdmin):
     list_display = ('fecha', 'bloque', 'usuario') # Columnas que se verán en la lista
+    list_select_related = ('bloque', 'usuario')
     list_filter = ('fecha', 'bloque')           # Filtros en la barra lateral
-    search_fields = ('usuario__username', 'bloque__nombre') # Barra de búsqueda
+    # Nombre exacto: usa el índice de auth_user y el único (usuario, bloque, fecha)
+    search_fields = ('usuario__username__exact',) # Barra de búsqueda
+    search_help_text = "Nombre de usuario exacto. Para un bloque, usa el filtro de la derecha."
     date_hierarchy = 'fecha'                    # Navegación por fechas
+    ordering = ('-fecha', '-bloque_id')
+    paginator = PaginadorContadores
+    show_full_result_count = False
+    # Miles de usuarios y series: buscar en vez de cargar un <select> con todos
+    autocomplete_fields = ('usuario',)
+    raw_id_fields = ('serie',)
+    change_list_template = 'admin/agendamiento/reserva_change_list.html'
+    actions = [*ExportarMixin.actions, 'cancelar_reservas']
+    columnas_exportar = exportar.COLUMNAS_RESERVAS
+    filtrar_exportar = staticmethod(exportar.filtrar_reservas)
+
+    def get_actions(self, request):
+        # "Eliminar seleccionados" arma la confirmación con cada reserva y su
+        # __str__ (dos consultas por fila); cancelar_reservas la reemplaza.
+        acciones = super().get_actions(request)
+        acciones.pop('delete_selected', None)
+        return acciones
+
+    @admin.action(description="Cancelar seleccionadas (ej. por cierre)", permissions=['delete'])
+    def cancelar_reservas(self, request, queryset):
+        if request.POST.get('confirmar'):
+            try:
+                canceladas, en_espera = queryset.cancelar(vaciar_espera=bool(request.POST.get('vaciar_espera')))
+            except ValidationError as e:
+                self.message_user(request, '. '.join(e.messages), level='error')
+                return None
+            mensaje = f"Se cancelaron {canceladas} reservas."
+            if en_espera:
+                mensaje += f" Se vaciaron {en_espera} lugares en listas de espera."
+            self.message_user(request, mensaje)
+            return None
+
+        # Confirmación con una fila por bloque y día en vez de una por reserva
+        grupos = list(
+            queryset.order_by('fecha', 'bloque__hora_inicio')
+            .values('fecha', 'bloque__nombre').annotate(total=Count('id'))[:51]
+        )
+        total = ocupacion.contar_reservas(queryset)
+        contexto = {
+            **self.admin_site.each_context(request),
+            'title': "Cancelar reservas",
+            'opts': self.model._meta,
+            'total': queryset.count() if total is None else total,
+            'grupos': grupos[:50],
+            'mas_grupos': len(grupos) > 50,
+            'select_across': request.POST.get('select_across') == '1',
+            'seleccionadas': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+        }
+        return TemplateResponse(request, 'admin/agendamiento/cancelar_reservas.html', contexto)
+
+# La búsqueda usa el índice de texto completo (ver busqueda.py) en vez de
+# LIKE '%...%' sobre toda la tabla; buscar/ ordena por relevancia.
+class SugerenciaAdmin(ExportarMixin, admin.ModelAdmin):
+    list_display = ('__str__', 'fecha_creacion')
+    list_select_related = ('usuario',)
+    search_fields = ('texto',)
+    change_list_template = 'admin/agendamiento/sugerencia_change_list.html'
+    columnas_exportar = exportar.COLUMNAS_SUGERENCIAS
+    filtrar_exportar = staticmethod(exportar.filtrar_sugerencias)
+
+    def get_urls(self):
+        return [
+            path('buscar/', self.admin_site.admin_view(self.vista_buscar), name='agendamiento_sugerencia_buscar'),
+            *super().get_urls(),
+        ]
+
+    def get_search_results(self, request, queryset, search_term):
+        return busqueda.filtrar(queryset, search_term), False
+
+    def vista_buscar(self, request):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        texto = request.GET.get('q', '').strip()
+        contexto = {
+            **self.admin_site.each_context(request),
+            'title': "Buscar sugerencias",
+            'opts': self.model._meta,
+            'texto': texto,
+            'resultados': busqueda.buscar(texto),
+            'terminos': busqueda.terminos_frecuentes(),
+        }
+        return TemplateResponse(request, 'admin/agendamiento/buscar_sugerencias.html', contexto)
+# Historial: solo lectura de lo que movió archivar_reservas
+class ReservaArchivadaAdmin(admin.ModelAdmin):
+    list_display = ('fecha', 'bloque_nombre', 'usuario')
+    list_select_related = ('usuario',)
+    search_fields = ('usuario__username', 'bloque_nombre')
+    date_hierarchy = 'fecha'
+
+class ResumenDiarioAdmin(admin.ModelAdmin):
+    list_display = ('fecha', 'bloque_nombre', 'reservas', 'capacidad')
+    list_filter = ('bloque_nombre',)
+    date_hierarchy = 'fecha'
+
+# Tablero de ocupación: en vez de la lista de filas, "Estadísticas diarias"
+# muestra el mapa de calor, el uso por semana y las cancelaciones.
+class EstadisticaDiariaAdmin(admin.ModelAdmin):
+
+    def has_add_permission(self, request):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        por_defecto = estadisticas.rango_por_defecto(timezone.localdate())
+        try:
+            desde = datetime.date.fromisoformat(request.GET.get('desde') or por_defecto[0].isoformat())
+            hasta = datetime.date.fromisoformat(request.GET.get('hasta') or por_defecto[1].isoformat())
+        except ValueError:
+            self.message_user(request, "Fechas no válidas, se muestran las últimas 26 semanas.", level='error')
+            desde, hasta = por_defecto
+        if (desde, hasta) != estadisticas.ajustar_rango(desde, hasta):
+            desde, hasta = estadisticas.ajustar_rango(desde, hasta)
+            self.message_user(
+                request, f"Se muestran como mucho {estadisticas.MAXIMO_DIAS_TABLERO} días, hasta {hasta:%d-%m-%Y}.",
+                level='warning',
+            )
+
+        contexto = {
+            **self.admin_site.each_context(request),
+            'title': "Ocupación del gimnasio",
+            'opts': self.model._meta,
+            'tablero': estadisticas.tablero(desde, hasta),
+            **(extra_context or {}),
+        }
+        return TemplateResponse(request, 'admin/agendamiento/tablero.html', contexto)
+
+# Cola de tareas (ver tareas.py): para revisar las fallidas y volver a intentarlas
+class TareaAdmin(admin.ModelAdmin):
+    list_display = ('id', 'nombre', 'estado', 'ejecutar_desde', 'intentos')
+    list_filter = ('estado', 'nombre')
+    readonly_fields = ('ultimo_error', 'tomada_en', 'fecha_creacion')
+    actions = ['reintentar']
+
+    @admin.action(description="Reintentar ahora")
+    def reintentar(self, request, queryset):
+        cambiadas = queryset.exclude(estado=Tarea.EN_CURSO).update(
+            estado=Tarea.PENDIENTE, ejecutar_desde=timezone.now(), intentos=0,
+        )
+        self.message_user(request, f"{cambiadas} tareas vuelven a la fila.")
+
+# Entradas registradas por el kiosko (ver asistencia.py): solo para consultar
+class AsistenciaAdmin(admin.ModelAdmin):
+    list_display = ('fecha', 'bloque', 'usuario', 'hora_entrada')
+    list_select_related = ('bloque', 'usuario')
+    search_fields = ('usuario__username__exact',)
+    date_hierarchy = 'fecha'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
 # Registra tus modelos en el admin
 admin.site.register(BloqueHorario)
 admin.site.register(Reserva, ReservaAdmin) # Registra Reservas usando la vista personalizada
-admin.site.register(Sugerencia)
+admin.site.register(Sugerencia, SugerenciaAdmin)
+admin.site.register(PreguntaEncuesta)
+admin.site.register(OpcionEncuesta)
+admin.site.register(ReservaArchivada, ReservaArchivadaAdmin)
+admin.site.register(ResumenDiario, ResumenDiarioAdmin)
+admin.site.register(EstadisticaDiaria, EstadisticaDiariaAdmin)
+admin.site.register(Tarea, TareaAdmin)
+admin.site.register(Asistencia, AsistenciaAdmin)
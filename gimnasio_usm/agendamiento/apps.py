@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class AgendamientoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'agendamiento'
+
+    def ready(self):
+        # Conecta las señales que mantienen el caché de la grilla al día
+        from . import signals  # noqa: F401
+        # Registra las tareas de los correos en la cola (ver tareas.py)
+        from . import notificaciones  # noqa: F401
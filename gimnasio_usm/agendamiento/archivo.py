@@ -0,0 +1,98 @@
+"""
+Archivo de reservas pasadas.
+
+La tabla Reserva la usan todas las reservas, cancelaciones y la grilla, así
+que solo debería tener la semana actual y las que vienen. archivar_lote()
+mueve a ReservaArchivada las reservas anteriores al `horizonte` y rehace el
+ResumenDiario de los días que tocó. Cada lote es una transacción corta, así
+que el comando archivar_reservas puede correr con el sitio funcionando.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .disponibilidad import lunes_de
+from .models import (
+    BloqueHorario, ListaEspera, OcupacionBloque, Reserva, ReservaArchivada,
+    ReservaQuerySet, ResumenDiario,
+)
+
+
+def horizonte(semanas_pasadas=None):
+    """
+    Fecha desde la cual las reservas se quedan en la tabla Reserva.
+
+    Por defecto es el lunes de esta semana menos settings.ARCHIVO_SEMANAS_PASADAS.
+    """
+    if semanas_pasadas is None:
+        semanas_pasadas = getattr(settings, 'ARCHIVO_SEMANAS_PASADAS', 0)
+    return lunes_de(timezone.localdate()) - datetime.timedelta(weeks=semanas_pasadas)
+
+
+def actualizar_resumenes(fechas):
+    """Rehace ResumenDiario de las `fechas` a partir de ReservaArchivada."""
+    capacidades = dict(BloqueHorario.objects.values_list('id', 'capacidad_maxima'))
+    filas = (
+        ReservaArchivada.objects.filter(fecha__in=fechas)
+        .values('bloque_id', 'bloque_nombre', 'fecha')
+        .annotate(reservas=Count('id'))
+        .order_by()
+    )
+    ResumenDiario.objects.bulk_create(
+        [
+            ResumenDiario(
+                bloque_id=f['bloque_id'],
+                bloque_nombre=f['bloque_nombre'],
+                fecha=f['fecha'],
+                reservas=f['reservas'],
+                capacidad=capacidades.get(f['bloque_id'], 0),
+            )
+            for f in filas
+        ],
+        update_conflicts=True,
+        unique_fields=['bloque_nombre', 'fecha'],
+        update_fields=['bloque', 'reservas', 'capacidad'],
+    )
+
+
+def archivar_lote(hasta, tam_lote=500):
+    """
+    Mueve hasta `tam_lote` reservas con fecha anterior a `hasta` (las más
+    antiguas primero). Devuelve cuántas movió; 0 significa que no quedan.
+    """
+    with transaction.atomic():
+        filas = list(
+            Reserva.objects.filter(fecha__lt=hasta)
+            .order_by('fecha', 'id')
+            .values_list('id', 'usuario_id', 'bloque_id', 'bloque__nombre', 'fecha')[:tam_lote]
+        )
+        if not filas:
+            return 0
+
+        # ignore_conflicts: si un lote anterior se cortó a la mitad, no duplicamos
+        ReservaArchivada.objects.bulk_create(
+            [
+                ReservaArchivada(reserva_id=id_, usuario_id=usuario_id, bloque_id=bloque_id,
+                                 bloque_nombre=nombre, fecha=fecha)
+                for id_, usuario_id, bloque_id, nombre, fecha in filas
+            ],
+            ignore_conflicts=True,
+        )
+        # Borrado directo, sin ReservaQuerySet.delete: son días que ya pasaron,
+        # no hay cupos que liberar ni lista de espera que promover (los
+        # contadores de esos días se borran en limpiar_dias_pasados).
+        lote = Reserva.objects.filter(pk__in=[fila[0] for fila in filas])
+        super(ReservaQuerySet, lote).delete()
+
+        actualizar_resumenes({fila[4] for fila in filas})
+    return len(filas)
+
+
+def limpiar_dias_pasados(hasta):
+    """Borra los contadores y listas de espera de los días anteriores a `hasta`."""
+    contadores, _ = OcupacionBloque.objects.filter(fecha__lt=hasta).delete()
+    esperas, _ = ListaEspera.objects.filter(fecha__lt=hasta).delete()
+    return contadores, esperas
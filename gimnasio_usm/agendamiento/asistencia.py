@@ -0,0 +1,181 @@
+"""
+Códigos de entrada y kiosko de asistencia.
+
+Cada reserva tiene un código firmado (django.core.signing, con la
+SECRET_KEY) que lleva todo lo que el kiosko necesita saber: la reserva, el
+socio, el bloque, la fecha y el horario. La página "Código de entrada" lo
+muestra como QR y el lector del kiosko lo escribe en api_checkin, que
+comprueba la firma y el horario sin leer la base de datos: en la hora punta
+la fila de la entrada no espera a SQLite ni compite con las reservas.
+
+Las entradas válidas quedan en memoria y se guardan de a lotes (un SELECT y
+un INSERT por lote, más un UPDATE en EstadisticaDiaria): al juntar
+settings.ASISTENCIA_LOTE o a los settings.ASISTENCIA_ESPERA segundos de la
+primera. Un código escaneado dos veces el mismo día se responde como
+"repetida" sin volver a guardarse. Si el proceso se cae con entradas sin
+guardar, esas se pierden; el tablero solo las usa como estadística.
+
+Como no se consulta la reserva, cancelar una la revoca en el caché:
+Reserva.delete y el borrado masivo anotan "agendamiento:cancelada:<id>"
+hasta el final del día de la reserva (revocar) y verificar rechaza esos
+códigos, aunque se hayan guardado (ej. una captura del QR) antes de
+cancelar. Con varios procesos, el caché debe ser compartido (Redis,
+memcached): con LocMemCache cada proceso solo ve sus propias cancelaciones.
+"""
+import datetime
+import threading
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connections, transaction
+from django.utils import timezone
+
+from . import estadisticas
+from .escrituras import escritura
+from .models import Asistencia
+
+SAL = 'agendamiento.asistencia'
+CLAVE_CANCELADA = 'agendamiento:cancelada:{}'
+
+# Entradas por guardar y reservas ya registradas hoy en este proceso
+_cerrojo = threading.Lock()
+_pendientes = []
+_registradas = {'fecha': None, 'reservas': set()}
+_temporizador = None
+
+
+def token_de(reserva):
+    """Código firmado de la reserva (lo que va en el QR)."""
+    return signing.dumps(
+        {
+            'r': reserva.id,
+            'u': reserva.usuario_id,
+            'n': reserva.usuario.username,
+            'b': reserva.bloque_id,
+            'nb': reserva.bloque.nombre,
+            'f': reserva.fecha.isoformat(),
+            'i': reserva.bloque.hora_inicio.strftime('%H:%M'),
+            't': reserva.bloque.hora_fin.strftime('%H:%M'),
+        },
+        salt=SAL,
+        compress=True,
+    )
+
+
+def verificar(token, ahora=None):
+    """
+    Datos del código si la firma es válida y es la hora de su bloque (desde
+    ASISTENCIA_ANTES antes del inicio hasta el fin). Lanza ValidationError
+    con el mensaje para el kiosko si no. No consulta la base de datos.
+    """
+    try:
+        datos = signing.loads(token.strip(), salt=SAL)
+    except signing.BadSignature:
+        raise ValidationError("Código no válido.")
+    if cache.get(CLAVE_CANCELADA.format(datos['r'])):
+        raise ValidationError(f"La reserva de {datos['n']} para el {datos['nb']} fue cancelada.")
+
+    ahora = timezone.localtime(ahora)
+    if datos['f'] != ahora.date().isoformat():
+        raise ValidationError(f"Este código es para el {datos['f']}, no para hoy.")
+    inicio = datetime.datetime.combine(ahora.date(), datetime.time.fromisoformat(datos['i']), ahora.tzinfo)
+    fin = datetime.datetime.combine(ahora.date(), datetime.time.fromisoformat(datos['t']), ahora.tzinfo)
+    if ahora < inicio - datetime.timedelta(seconds=settings.ASISTENCIA_ANTES):
+        raise ValidationError(f"Todavía no empieza el {datos['nb']} ({datos['i']}).")
+    if ahora > fin:
+        raise ValidationError(f"El {datos['nb']} ya terminó ({datos['t']}).")
+    return datos
+
+
+def revocar(reservas):
+    """
+    Después del COMMIT, marca en el caché `reservas` = [(id, fecha)] como
+    canceladas hasta el final de su día (después el código ya no sirve).
+    """
+    def al_confirmar():
+        ahora = timezone.localtime()
+        por_fecha = {}
+        for reserva_id, fecha in reservas:
+            por_fecha.setdefault(fecha, []).append(reserva_id)
+        for fecha, ids in por_fecha.items():
+            fin = datetime.datetime.combine(fecha + datetime.timedelta(days=1), datetime.time(), ahora.tzinfo)
+            segundos = int((fin - ahora).total_seconds()) + 1
+            if segundos > 0:
+                cache.set_many({CLAVE_CANCELADA.format(reserva_id): True for reserva_id in ids}, segundos)
+    transaction.on_commit(al_confirmar)
+
+
+def registrar(datos, ahora=None):
+    """
+    Anota la entrada de un código ya verificado. Devuelve 'registrada' o
+    'repetida' (ya se había escaneado hoy en este kiosko).
+    """
+    global _temporizador
+    ahora = ahora or timezone.now()
+    with _cerrojo:
+        hoy = timezone.localtime(ahora).date()
+        if _registradas['fecha'] != hoy:
+            _registradas['fecha'], _registradas['reservas'] = hoy, set()
+        if datos['r'] in _registradas['reservas']:
+            return 'repetida'
+        _registradas['reservas'].add(datos['r'])
+        _pendientes.append(Asistencia(
+            reserva_id=datos['r'], usuario_id=datos['u'], bloque_id=datos['b'],
+            fecha=datetime.date.fromisoformat(datos['f']), hora_entrada=ahora,
+        ))
+        lleno = len(_pendientes) >= settings.ASISTENCIA_LOTE
+        if not lleno and _temporizador is None and settings.ASISTENCIA_ESPERA is not None:
+            _temporizador = threading.Timer(settings.ASISTENCIA_ESPERA, _guardar_en_segundo_plano)
+            _temporizador.daemon = True
+            _temporizador.start()
+    if lleno:
+        try:
+            guardar_pendientes()
+        except ValidationError:
+            pass  # quedan en memoria para el próximo lote; la entrada ya está anotada
+    return 'registrada'
+
+
+def _guardar_en_segundo_plano():
+    try:
+        guardar_pendientes()
+    except ValidationError:
+        pass  # se guardan con la próxima entrada
+    finally:
+        # El hilo del temporizador abre su propia conexión
+        connections.close_all()
+
+
+def guardar_pendientes():
+    """Guarda las entradas en memoria. Devuelve cuántas filas nuevas se crearon."""
+    global _temporizador
+    with _cerrojo:
+        lote = list(_pendientes)
+        _pendientes.clear()
+        if _temporizador is not None:
+            _temporizador.cancel()
+            _temporizador = None
+    if not lote:
+        return 0
+
+    try:
+        with escritura():
+            # Otro proceso (u otro kiosko) pudo haber guardado la misma entrada
+            existentes = set(
+                Asistencia.objects.filter(reserva_id__in=[a.reserva_id for a in lote])
+                .values_list('reserva_id', flat=True)
+            )
+            nuevas = [a for a in lote if a.reserva_id not in existentes]
+            Asistencia.objects.bulk_create(nuevas)
+            por_bloque = {}
+            for a in nuevas:
+                por_bloque[(a.bloque_id, a.fecha)] = por_bloque.get((a.bloque_id, a.fecha), 0) + 1
+            estadisticas.sumar_asistencias(por_bloque)
+    except ValidationError:
+        # Base de datos ocupada: vuelven a la fila para el próximo lote
+        with _cerrojo:
+            _pendientes[:0] = lote
+        raise
+    return len(nuevas)
@@ -0,0 +1,139 @@
+"""
+Búsqueda de texto completo en el buzón de sugerencias (para el staff).
+
+En SQLite, Sugerencia.texto tiene un índice FTS5 (migración 0011) que los
+triggers mantienen al día con cada alta, cambio o borrado, incluso los
+masivos. Buscar consulta el índice en vez de recorrer la tabla con
+LIKE '%...%', ordena por relevancia (bm25) y devuelve un fragmento con las
+palabras encontradas. El índice ignora mayúsculas y tildes: "maquina"
+encuentra "Máquinas" (cada palabra se busca también como prefijo).
+
+terminos_frecuentes() lee el vocabulario del índice (fts5vocab): en cuántas
+sugerencias aparece cada término, sin leer las sugerencias.
+
+Si una migración futura cambia el modelo Sugerencia, SQLite rehace la tabla
+y los triggers se pierden: "python manage.py reconstruir_busqueda" los
+vuelve a crear y reindexa todo. En otra base de datos no hay índice y
+buscar() usa icontains.
+"""
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Sugerencia
+
+TABLA = 'agendamiento_sugerencia_fts'
+VOCABULARIO = 'agendamiento_sugerencia_vocab'
+
+# Los mismos de la migración 0011, por si se perdieron
+TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLA}_insert AFTER INSERT ON agendamiento_sugerencia BEGIN
+        INSERT INTO {TABLA}(rowid, texto) VALUES (new.id, new.texto);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLA}_delete AFTER DELETE ON agendamiento_sugerencia BEGIN
+        INSERT INTO {TABLA}({TABLA}, rowid, texto) VALUES ('delete', old.id, old.texto);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLA}_update AFTER UPDATE OF texto ON agendamiento_sugerencia BEGIN
+        INSERT INTO {TABLA}({TABLA}, rowid, texto) VALUES ('delete', old.id, old.texto);
+        INSERT INTO {TABLA}(rowid, texto) VALUES (new.id, new.texto);
+    END""",
+]
+
+# Palabras que no dicen nada sobre el tema de una sugerencia (sin tildes, como en el índice)
+VACIAS = set("""
+    a al algo algun alguna algunas alguno algunos ante antes aqui asi aun bien cada casi como con contra cual
+    cuando de del desde donde dos el ella ellas ellos en entre era eran es esa esas ese eso esos esta estan
+    estar estas este esto estos fue ha hace hacen hacer hay la las le les lo los mas me mi mis mucho muy
+    nada ni no nos o otra otro para pero poco por porque que se sea ser si sin sobre solo son su sus tambien
+    tan te tiene tienen todo todos tu un una uno unos y ya yo
+""".split())
+
+# Marcadores de snippet(): caracteres de control que no aparecen en un texto normal
+_INICIO, _FIN = '\x02', '\x03'
+
+
+def disponible():
+    return connection.vendor == 'sqlite'
+
+
+def consulta_fts(texto):
+    """
+    Consulta FTS5 con las palabras de `texto`: todas deben aparecer, cada una
+    como prefijo. Las comillas y operadores del usuario no llegan a FTS5 (no
+    hay errores de sintaxis). '' si no hay palabras.
+    """
+    return ' '.join(f'"{palabra}"*' for palabra in re.findall(r'\w+', texto.lower()))
+
+
+def filtrar(queryset, texto):
+    """`queryset` de Sugerencia reducido a las que contienen las palabras de `texto` (sin ordenar)."""
+    consulta = consulta_fts(texto)
+    if not consulta:
+        return queryset
+    if not disponible():
+        for palabra in re.findall(r'\w+', texto):
+            queryset = queryset.filter(texto__icontains=palabra)
+        return queryset
+    return queryset.filter(id__in=RawSQL(f'SELECT rowid FROM {TABLA} WHERE {TABLA} MATCH %s', [consulta]))
+
+
+def _fragmento(snippet):
+    return mark_safe(escape(snippet).replace(_INICIO, '<mark>').replace(_FIN, '</mark>'))
+
+
+def buscar(texto, limite=50):
+    """
+    Hasta `limite` sugerencias que contienen las palabras de `texto`, de la
+    más a la menos relevante: [(sugerencia, fragmento HTML con <mark>)].
+    """
+    consulta = consulta_fts(texto)
+    if not consulta:
+        return []
+    if not disponible():
+        sugerencias = filtrar(Sugerencia.objects.select_related('usuario'), texto).order_by('-fecha_creacion')[:limite]
+        return [(sugerencia, escape(sugerencia.texto[:200])) for sugerencia in sugerencias]
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid, snippet({TABLA}, 0, %s, %s, '…', 24) FROM {TABLA} "
+            f"WHERE {TABLA} MATCH %s ORDER BY bm25({TABLA}) LIMIT %s",
+            [_INICIO, _FIN, consulta, limite],
+        )
+        filas = cursor.fetchall()
+    sugerencias = Sugerencia.objects.select_related('usuario').in_bulk([rowid for rowid, _ in filas])
+    return [(sugerencias[rowid], _fragmento(snippet)) for rowid, snippet in filas if rowid in sugerencias]
+
+
+def terminos_frecuentes(cantidad=30, minimo_letras=3):
+    """[(término, sugerencias en que aparece, apariciones)], los más comunes primero, sin palabras vacías."""
+    if not disponible():
+        return []
+    with connection.cursor() as cursor:
+        # El vocabulario tiene una fila por término distinto, no por sugerencia
+        cursor.execute(
+            f"SELECT term, doc, cnt FROM {VOCABULARIO} WHERE length(term) >= %s ORDER BY doc DESC, cnt DESC",
+            [minimo_letras],
+        )
+        terminos = []
+        for termino, sugerencias, apariciones in cursor:
+            if termino in VACIAS or termino.isdigit():
+                continue
+            terminos.append((termino, sugerencias, apariciones))
+            if len(terminos) >= cantidad:
+                break
+    return terminos
+
+
+def reconstruir():
+    """Vuelve a crear los triggers si faltan y reindexa todas las sugerencias. Devuelve cuántas hay."""
+    if not disponible():
+        return 0
+    with connection.cursor() as cursor:
+        for sql in TRIGGERS:
+            cursor.execute(sql)
+        cursor.execute(f"INSERT INTO {TABLA}({TABLA}) VALUES ('rebuild')")
+        cursor.execute(f"INSERT INTO {TABLA}({TABLA}) VALUES ('optimize')")
+    return Sugerencia.objects.count()
@@ -0,0 +1,485 @@
+"""
+Grilla semanal de disponibilidad con caché.
+
+La grilla tiene una parte que es igual para todos los usuarios (bloques,
+cupos por bloque/día y hora de inicio de cada celda) y otra que es de cada
+usuario (sus reservas). La parte compartida se guarda en el caché de Django:
+
+- La "estructura" de la semana (bloques, días, la hora de inicio ya
+  convertida a la zona horaria y qué celdas están cerradas) se calcula una
+  vez por semana. Así reservar y armar la grilla revisan los cierres sin
+  consultar la base de datos.
+- Los cupos ocupados se guardan por celda (bloque, fecha), con la versión
+  de su semana en la clave. Al reservar o cancelar se sube la versión (ver
+  ocupacion.py) y la próxima visita vuelve a leer la semana desde
+  OcupacionBloque con una consulta. Como la versión se lee antes de ir a
+  la base de datos, una lectura que llega tarde guarda su valor viejo bajo
+  la versión anterior, que ya nadie pide: no puede tapar la invalidación.
+
+Cada request solo consulta las reservas del usuario. grilla_rango() arma
+varias semanas seguidas (navegación y vista mensual) con las mismas
+consultas que una sola: una lectura del caché para las versiones, otra
+para todas las celdas y una consulta para lo del usuario.
+
+Además cada semana tiene un contador de versión que sube con cada cambio de
+cupos; la API JSON lo usa como ETag para responder 304 sin ir a la base de
+datos (ver views.api_agenda).
+"""
+import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import BooleanField, Value
+from django.utils import timezone
+
+from .models import BloqueHorario, Cierre, ListaEspera, OcupacionBloque, Reserva
+
+# La estructura solo cambia si se editan los bloques o los cierres (ver signals.py),
+# los cupos se invalidan celda por celda, el TTL es solo un respaldo.
+TTL_ESTRUCTURA = 60 * 60 * 24 * 7
+TTL_CELDA = 60 * 5
+
+NO_SE_OFRECE = "Este bloque no se ofrece ese día"
+
+CLAVE_VERSION_BLOQUES = 'agendamiento:bloques:version'
+
+
+def lunes_de(fecha):
+    """Devuelve el lunes de la semana de `fecha`."""
+    return fecha - datetime.timedelta(days=fecha.weekday())
+
+
+def _version_bloques():
+    # add() no pisa el valor si ya existe. Usamos la hora como valor
+    # inicial para no repetir una versión vieja si el caché se vació.
+    cache.add(CLAVE_VERSION_BLOQUES, int(timezone.now().timestamp()), None)
+    return cache.get(CLAVE_VERSION_BLOQUES)
+
+
+def _clave_version_semana(lunes):
+    return f'agendamiento:semana:{lunes.isoformat()}:version'
+
+
+def version_semana(lunes):
+    """Contador que cambia cada vez que cambia algún cupo de la semana."""
+    clave = _clave_version_semana(lunes)
+    cache.add(clave, int(timezone.now().timestamp()), None)
+    return cache.get(clave)
+
+
+def _versiones_semanas(semanas):
+    """{lunes: version_semana(lunes)} con una sola lectura del caché (salvo las que faltan)."""
+    claves = {lunes: _clave_version_semana(lunes) for lunes in semanas}
+    en_cache = cache.get_many(list(claves.values()))
+    return {lunes: en_cache[clave] if clave in en_cache else version_semana(lunes) for lunes, clave in claves.items()}
+
+
+def subir_version_semana(lunes):
+    try:
+        cache.incr(_clave_version_semana(lunes))
+    except ValueError:
+        version_semana(lunes)
+
+
+def etag_semana(lunes, usuario_id, ahora=None, estructura=None):
+    """
+    ETag de la grilla de un usuario, calculado solo con el caché.
+
+    Incluye la versión de los bloques y de la semana, el usuario (sus
+    reservas son parte de la respuesta) y cuántas celdas ya pasaron, para
+    que la respuesta cambie cuando un bloque pasa a "No disponible".
+    """
+    ahora = ahora or timezone.now()
+    estructura = estructura or estructura_semana(lunes)
+    pasados = sum(
+        1 for bloque in estructura['bloques'] for inicio in bloque['inicios'] if inicio < ahora
+    )
+    return f'{lunes.isoformat()}-{_version_bloques()}-{version_semana(lunes)}-{usuario_id}-{pasados}'
+
+
+def _clave_celda(bloque_id, fecha, version):
+    return f'agendamiento:celda:{bloque_id}:{fecha.isoformat()}:{version}'
+
+
+def _calcular_estructuras(semanas):
+    """Estructura de cada lunes de `semanas`: {lunes: estructura}, con dos consultas en total."""
+    todos_los_dias = {lunes: [lunes + datetime.timedelta(days=i) for i in range(5)] for lunes in semanas}
+    zona = timezone.get_current_timezone()
+
+    # {(bloque_id o None, fecha): motivo}; None es un cierre de todo el día
+    cierres = {
+        (bloque_id, fecha): motivo
+        for bloque_id, fecha, motivo in Cierre.objects.filter(
+            fecha__gte=min(semanas), fecha__lte=max(semanas) + datetime.timedelta(days=4)
+        ).values_list('bloque_id', 'fecha', 'motivo')
+    }
+    bloques_activos = list(BloqueHorario.objects.filter(activo=True).order_by('hora_inicio'))
+
+    estructuras = {}
+    for lunes, dias in todos_los_dias.items():
+        bloques = []
+        for bloque in bloques_activos:
+            ofrecidos = bloque.lista_dias
+            bloques.append({
+                'id': bloque.id,
+                'nombre': bloque.nombre,
+                'hora_inicio': bloque.hora_inicio,
+                'hora_fin': bloque.hora_fin,
+                'capacidad_maxima': bloque.capacidad_maxima,
+                # Hora de inicio de cada celda, ya con zona horaria
+                'inicios': [
+                    timezone.make_aware(datetime.datetime.combine(dia, bloque.hora_inicio), zona)
+                    for dia in dias
+                ],
+                # Motivo por el que cada celda está cerrada, o None si abre
+                'cierres': [
+                    cierres.get((None, dia)) or cierres.get((bloque.id, dia))
+                    or (None if dia.weekday() in ofrecidos else NO_SE_OFRECE)
+                    for dia in dias
+                ],
+            })
+        estructuras[lunes] = {'dias': dias, 'bloques': bloques}
+    return estructuras
+
+
+def _clave_estructura(lunes, version):
+    return f'agendamiento:estructura:{lunes.isoformat()}:{version}'
+
+
+def _estructuras_en_cache(semanas):
+    """(claves, encontradas en caché, lunes que faltan)."""
+    version = _version_bloques()
+    claves = {lunes: _clave_estructura(lunes, version) for lunes in semanas}
+    en_cache = cache.get_many(list(claves.values()))
+    return claves, en_cache, [lunes for lunes in semanas if claves[lunes] not in en_cache]
+
+
+def _completar_estructuras(semanas, claves, en_cache, nuevas):
+    cache.set_many({claves[lunes]: estructura for lunes, estructura in nuevas.items()}, TTL_ESTRUCTURA)
+    en_cache.update({claves[lunes]: estructura for lunes, estructura in nuevas.items()})
+    return [en_cache[claves[lunes]] for lunes in semanas]
+
+
+def estructuras_semanas(semanas):
+    """
+    Estructura de cada lunes de `semanas`, en el mismo orden (desde el caché).
+    Las que faltan se arman juntas con _calcular_estructuras.
+    """
+    claves, en_cache, faltantes = _estructuras_en_cache(semanas)
+    nuevas = _calcular_estructuras(faltantes) if faltantes else {}
+    return _completar_estructuras(semanas, claves, en_cache, nuevas)
+
+
+def estructura_semana(lunes):
+    """Bloques y días de la semana que parte en `lunes` (desde el caché)."""
+    return estructuras_semanas([lunes])[0]
+
+
+def motivo_cierre(bloque_id, fecha):
+    """
+    Por qué el bloque no abre ese día, o None si abre. Se lee de la
+    estructura en caché, sin consultar la base de datos.
+    """
+    if fecha.weekday() > 4:
+        return "El gimnasio no abre los fines de semana"
+    return _motivo_en(estructura_semana(lunes_de(fecha)), bloque_id, fecha)
+
+
+def _motivo_en(estructura, bloque_id, fecha):
+    for bloque in estructura['bloques']:
+        if bloque['id'] == bloque_id:
+            return bloque['cierres'][fecha.weekday()]
+    return "El bloque no está disponible"
+
+
+def fechas_abiertas(bloque_id, fechas):
+    """Las `fechas` en que el bloque abre (lee la estructura una vez por semana)."""
+    motivos = {}
+    abiertas = []
+    for fecha in fechas:
+        if fecha.weekday() > 4:
+            continue
+        lunes = lunes_de(fecha)
+        if lunes not in motivos:
+            motivos[lunes] = next(
+                (b['cierres'] for b in estructura_semana(lunes)['bloques'] if b['id'] == bloque_id),
+                [NO_SE_OFRECE] * 5,
+            )
+        if motivos[lunes][fecha.weekday()] is None:
+            abiertas.append(fecha)
+    return abiertas
+
+
+def ocupacion_semanas(estructuras):
+    """
+    Dict {(bloque_id, fecha): ocupados} de varias semanas.
+
+    Las celdas de todas las semanas se piden al caché de una vez y las que
+    faltan se leen con una sola consulta.
+    """
+    claves, ocupacion, faltantes = _celdas_en_cache(estructuras)
+    if faltantes:
+        _completar_celdas(claves, ocupacion, faltantes, _consulta_celdas(claves, faltantes))
+    return ocupacion
+
+
+def _celdas_en_cache(estructuras):
+    """(claves, {(bloque_id, fecha): ocupados} encontradas en caché, claves que faltan)."""
+    # La versión va antes que la consulta (ver arriba)
+    versiones = _versiones_semanas([estructura['dias'][0] for estructura in estructuras])
+    claves = {
+        _clave_celda(bloque['id'], dia, versiones[estructura['dias'][0]]): (bloque['id'], dia)
+        for estructura in estructuras
+        for bloque in estructura['bloques']
+        for dia in estructura['dias']
+    }
+    en_cache = cache.get_many(list(claves))
+    ocupacion = {claves[clave]: valor for clave, valor in en_cache.items()}
+    return claves, ocupacion, [clave for clave in claves if clave not in en_cache]
+
+
+def _consulta_celdas(claves, faltantes):
+    fechas = sorted({claves[clave][1] for clave in faltantes})
+    return OcupacionBloque.objects.filter(
+        fecha__gte=fechas[0], fecha__lte=fechas[-1]
+    ).values_list('bloque_id', 'fecha', 'ocupados')
+
+
+def _completar_celdas(claves, ocupacion, faltantes, filas):
+    desde_bd = {(bloque_id, fecha): ocupados for bloque_id, fecha, ocupados in filas}
+    nuevos = {clave: desde_bd.get(claves[clave], 0) for clave in faltantes}
+    cache.set_many(nuevos, TTL_CELDA)
+    ocupacion.update({claves[clave]: valor for clave, valor in nuevos.items()})
+
+
+def grilla_json(dias, filas):
+    """Convierte el resultado de grilla_usuario a un dict listo para JsonResponse."""
+    return {
+        'dias': [dia.isoformat() for dia in dias],
+        'bloques': [
+            {
+                'id': bloque['id'],
+                'nombre': bloque['nombre'],
+                'hora_inicio': bloque['hora_inicio'].strftime('%H:%M'),
+                'hora_fin': bloque['hora_fin'].strftime('%H:%M'),
+                'celdas': [
+                    {
+                        'fecha': celda['fecha_str'],
+                        'cupos': celda['cupos'],
+                        'reserva_id': celda['reserva_id'],
+                        'espera_id': celda['espera_id'],
+                        'es_pasado': celda['es_pasado'],
+                        'cerrado': celda['cerrado'],
+                    }
+                    for celda in datos_de_la_fila
+                ],
+            }
+            for bloque, datos_de_la_fila in filas
+        ],
+    }
+
+
+def lunes_entre(desde, hasta):
+    """Los lunes de las semanas que tocan el rango [desde, hasta]."""
+    lunes = lunes_de(desde)
+    semanas = []
+    while lunes <= hasta:
+        semanas.append(lunes)
+        lunes += datetime.timedelta(weeks=1)
+    return semanas
+
+
+def _consulta_usuario(usuario, desde, hasta):
+    """
+    Reservas y lugares en lista de espera del usuario entre dos fechas, en una
+    sola consulta (UNION): filas (id, bloque_id, fecha, es_reserva).
+    """
+    es_reserva = Value(True, output_field=BooleanField())
+    es_espera = Value(False, output_field=BooleanField())
+    reservas = Reserva.objects.filter(usuario=usuario, fecha__gte=desde, fecha__lte=hasta).values_list(
+        'id', 'bloque_id', 'fecha', es_reserva
+    )
+    esperas = ListaEspera.objects.filter(usuario=usuario, fecha__gte=desde, fecha__lte=hasta).values_list(
+        'id', 'bloque_id', 'fecha', es_espera
+    )
+    return reservas.union(esperas, all=True)
+
+
+def _mapas_usuario(filas):
+    """({(bloque_id, fecha): reserva_id}, {(bloque_id, fecha): entrada_id})."""
+    mapa_reservas, mapa_espera = {}, {}
+    for id_, bloque_id, fecha, reserva in filas:
+        (mapa_reservas if reserva else mapa_espera)[(bloque_id, fecha)] = id_
+    return mapa_reservas, mapa_espera
+
+
+def grilla_rango(usuario, desde, hasta, ahora=None):
+    """
+    Arma la grilla de `usuario` para todas las semanas entre `desde` y `hasta`.
+
+    Devuelve una lista con un (dias, filas) por semana, donde cada fila es
+    (bloque, datos_de_la_fila), igual a lo que espera agendar.html. Sin
+    importar cuántas semanas sean, los cupos salen de una lectura del caché
+    (más una consulta si faltan celdas) y lo del usuario de una consulta; las
+    horas de inicio ya vienen convertidas en la estructura de cada semana.
+    """
+    estructuras = estructuras_semanas(lunes_entre(desde, hasta))
+    ocupacion = ocupacion_semanas(estructuras)
+    filas_usuario = _consulta_usuario(usuario, estructuras[0]['dias'][0], estructuras[-1]['dias'][-1])
+    return _armar_semanas(estructuras, ocupacion, _mapas_usuario(filas_usuario), ahora or timezone.now())
+
+
+def _armar_semanas(estructuras, ocupacion, mapas_usuario, ahora):
+    mapa_reservas_usuario, mapa_espera_usuario = mapas_usuario
+    semanas = []
+    for estructura in estructuras:
+        dias = estructura['dias']
+        filas = []
+        for bloque in estructura['bloques']:
+            datos_de_la_fila = []
+            for dia, inicio, cierre in zip(dias, bloque['inicios'], bloque['cierres']):
+                datos_de_la_fila.append({
+                    'cupos': bloque['capacidad_maxima'] - ocupacion.get((bloque['id'], dia), 0),
+                    'reserva_id': mapa_reservas_usuario.get((bloque['id'], dia)),
+                    'espera_id': mapa_espera_usuario.get((bloque['id'], dia)),
+                    'fecha_str': dia.isoformat(),
+                    'es_pasado': inicio < ahora,
+                    'cerrado': cierre,
+                })
+            filas.append((bloque, datos_de_la_fila))
+        semanas.append((dias, filas))
+    return semanas
+
+
+def grilla_usuario(usuario, lunes, ahora=None):
+    """Grilla de una sola semana: (dias, filas), ver grilla_rango."""
+    return grilla_rango(usuario, lunes, lunes, ahora)[0]
+
+
+def resumen_dias(semanas):
+    """
+    Resume la salida de grilla_rango por día, para la vista mensual:
+    {fecha: {'libres', 'reservas', 'abiertos', 'cerrado'}}. Solo cuenta los
+    cupos libres de bloques abiertos que todavía no pasan.
+    """
+    resumen = {}
+    for dias, filas in semanas:
+        for i, dia in enumerate(dias):
+            celdas = [datos_de_la_fila[i] for _, datos_de_la_fila in filas]
+            abiertas = [c for c in celdas if not c['cerrado']]
+            resumen[dia] = {
+                'libres': sum(max(c['cupos'], 0) for c in abiertas if not c['es_pasado']),
+                'reservas': sum(1 for c in celdas if c['reserva_id']),
+                'abiertos': len(abiertas),
+                # Motivo si cierra todo el día (ej. un feriado)
+                'cerrado': celdas[0]['cerrado'] if celdas and not abiertas else None,
+            }
+    return resumen
+
+
+# -----------------------------------------------------------------
+# SEMANAS VISIBLES Y PRECALENTADO
+# -----------------------------------------------------------------
+
+def semanas_visibles(hoy=None):
+    """
+    (primer_lunes, ultimo_lunes) que los alumnos pueden ver y reservar:
+    desde la semana actual hasta settings.AGENDA_SEMANAS_ADELANTE semanas
+    más. Acotarlo evita llenar el caché con semanas que nadie va a usar.
+    """
+    lunes = lunes_de(hoy or timezone.localdate())
+    adelante = getattr(settings, 'AGENDA_SEMANAS_ADELANTE', 8)
+    return lunes, lunes + datetime.timedelta(weeks=adelante)
+
+
+def apertura_de(lunes):
+    """Cuándo se pudo empezar a reservar la semana de `lunes` (un lunes a las 00:00)."""
+    adelante = getattr(settings, 'AGENDA_SEMANAS_ADELANTE', 8)
+    primer_dia = lunes - datetime.timedelta(weeks=adelante)
+    return timezone.make_aware(datetime.datetime.combine(primer_dia, datetime.time.min))
+
+
+def acotar_semana(lunes, hoy=None):
+    """Lleva `lunes` al rango de semanas_visibles."""
+    primera, ultima = semanas_visibles(hoy)
+    return min(max(lunes, primera), ultima)
+
+
+def calentar_semanas(lunes, cantidad=1):
+    """
+    Deja en caché la estructura y los cupos de `cantidad` semanas desde
+    `lunes`, para que la primera visita a esas semanas no vaya a la base de
+    datos. Devuelve cuántas celdas quedaron en caché.
+    """
+    estructuras = estructuras_semanas([lunes + datetime.timedelta(weeks=i) for i in range(cantidad)])
+    return len(ocupacion_semanas(estructuras))
+
+
+def invalidar_celda(bloque_id, fecha):
+    invalidar_celdas([(bloque_id, fecha)])
+
+
+def invalidar_celdas(claves):
+    """
+    Invalida las celdas [(bloque_id, fecha), ...] subiendo la versión de sus
+    semanas: las claves viejas ya no se piden y vencen con TTL_CELDA.
+    """
+    for lunes in {lunes_de(fecha) for _, fecha in claves}:
+        subir_version_semana(lunes)
+
+
+def invalidar_bloques():
+    """Se llama cuando cambian los bloques: todas las estructuras quedan viejas."""
+    try:
+        cache.incr(CLAVE_VERSION_BLOQUES)
+    except ValueError:
+        _version_bloques()
+
+
+# -----------------------------------------------------------------
+# VERSIONES ASÍNCRONAS (ver vistas_async.py)
+# -----------------------------------------------------------------
+# Hacen lo mismo que las de arriba sin bloquear el event loop. Las consultas
+# van por el ORM asíncrono; el caché (con Redis, una ida y vuelta por red)
+# se lee y escribe en un hilo aparte, como en LimitePeticionesMiddleware.
+# Armar una estructura que falta en el caché, que pasa una vez por semana,
+# va con sync_to_async al hilo de la base de datos.
+
+def _fuera_del_loop(funcion):
+    return sync_to_async(funcion, thread_sensitive=False)
+
+
+async def aestructuras_semanas(semanas):
+    claves, en_cache, faltantes = await _fuera_del_loop(_estructuras_en_cache)(semanas)
+    if not faltantes:
+        return [en_cache[claves[lunes]] for lunes in semanas]
+    nuevas = await sync_to_async(_calcular_estructuras)(faltantes)
+    return await _fuera_del_loop(_completar_estructuras)(semanas, claves, en_cache, nuevas)
+
+
+async def amotivo_cierre(bloque_id, fecha):
+    if fecha.weekday() > 4:
+        return "El gimnasio no abre los fines de semana"
+    estructura, = await aestructuras_semanas([lunes_de(fecha)])
+    return _motivo_en(estructura, bloque_id, fecha)
+
+
+async def aetag_semana(lunes, usuario_id):
+    estructura, = await aestructuras_semanas([lunes])
+    return await _fuera_del_loop(etag_semana)(lunes, usuario_id, estructura=estructura)
+
+
+async def agrilla_rango(usuario, desde, hasta, ahora=None):
+    estructuras = await aestructuras_semanas(lunes_entre(desde, hasta))
+    claves, ocupacion, faltantes = await _fuera_del_loop(_celdas_en_cache)(estructuras)
+    if faltantes:
+        filas = [fila async for fila in _consulta_celdas(claves, faltantes)]
+        await _fuera_del_loop(_completar_celdas)(claves, ocupacion, faltantes, filas)
+    consulta = _consulta_usuario(usuario, estructuras[0]['dias'][0], estructuras[-1]['dias'][-1])
+    mapas = _mapas_usuario([fila async for fila in consulta])
+    return _armar_semanas(estructuras, ocupacion, mapas, ahora or timezone.now())
+
+
+async def agrilla_usuario(usuario, lunes, ahora=None):
+    return (await agrilla_rango(usuario, lunes, lunes, ahora))[0]
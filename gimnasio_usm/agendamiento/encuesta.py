@@ -0,0 +1,336 @@
+"""
+Resultados de la encuesta de bienestar, agregados en el servidor.
+
+Junta tres fuentes en conteos por (sección, pregunta, opción):
+
+1. static/data/encuesta_from_excel.json: la lista de preguntas y su sección.
+2. static/data/encuesta_resultados_limpios.csv: conteos ya agregados de la
+   encuesta original.
+3. Las respuestas individuales importadas a la base de datos con
+   `python manage.py importar_encuesta <archivo>` (o descargadas del
+   formulario con `refrescar_encuesta`). La importación es incremental: el
+   formulario solo agrega filas al final, así que las filas del principio
+   que ya se importaron de la misma fuente se saltan sin procesarlas (ver
+   importar_archivo) y OpcionEncuesta.conteo se va sumando. Leer los
+   resultados es leer unas pocas filas ya agregadas.
+
+El resultado se guarda en el caché por settings.ENCUESTA_CACHE_TTL segundos,
+así resultados.html hace una sola petición chica y no procesa nada. La clave
+incluye la fecha de modificación de los archivos y la última respuesta
+importada, así que todos los procesos ven los datos nuevos aunque el caché
+sea local de cada uno.
+"""
+import csv
+import hashlib
+import itertools
+import json
+import unicodedata
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Max
+
+from .models import OpcionEncuesta, PreguntaEncuesta, RespuestaEncuesta
+
+CLAVE_CACHE = 'agendamiento:encuesta:resultados'
+
+
+def _ruta_datos(nombre):
+    return settings.BASE_DIR / 'static' / 'data' / nombre
+
+
+def normalizar(texto):
+    """Quita tildes, signos y mayúsculas para comparar preguntas y respuestas."""
+    if not texto:
+        return ''
+    sin_tildes = ''.join(
+        c for c in unicodedata.normalize('NFD', texto) if unicodedata.category(c) != 'Mn'
+    )
+    return sin_tildes.lower().translate(str.maketrans('', '', '¿?¡!,.')).strip()
+
+
+def cargar_preguntas():
+    """Preguntas de la encuesta: [{'section': ..., 'text': ..., 'options': [...]}, ...]."""
+    with open(_ruta_datos('encuesta_from_excel.json'), encoding='utf-8') as archivo:
+        return json.load(archivo)['questions']
+
+
+def conteos_limpios():
+    """Filas (sección, pregunta, opción, conteo) del CSV ya agregado."""
+    with open(_ruta_datos('encuesta_resultados_limpios.csv'), encoding='utf-8-sig', newline='') as archivo:
+        for fila in csv.DictReader(archivo):
+            yield fila['section'], fila['question'], fila['option'], int(fila['count'])
+
+
+def conteos_importados():
+    """Filas (sección, pregunta, opción, conteo) acumuladas en OpcionEncuesta."""
+    return OpcionEncuesta.objects.filter(conteo__gt=0).order_by('id').values_list(
+        'pregunta__seccion', 'pregunta__texto', 'texto', 'conteo'
+    )
+
+
+# -----------------------------------------------------------------
+# IMPORTACIÓN DE RESPUESTAS INDIVIDUALES
+# -----------------------------------------------------------------
+
+def sincronizar_preguntas():
+    """Crea en la BD las preguntas del JSON que falten. Devuelve {texto: PreguntaEncuesta}."""
+    preguntas = cargar_preguntas()
+    PreguntaEncuesta.objects.bulk_create(
+        [
+            PreguntaEncuesta(seccion=pregunta['section'], texto=pregunta['text'], orden=orden)
+            for orden, pregunta in enumerate(preguntas)
+        ],
+        ignore_conflicts=True,
+    )
+    return {pregunta.texto: pregunta for pregunta in PreguntaEncuesta.objects.all()}
+
+
+def asociar_columnas(encabezados, preguntas):
+    """
+    {encabezado: PreguntaEncuesta} para las columnas que corresponden a una pregunta.
+
+    Una columna se asocia si su encabezado normalizado contiene el texto de
+    la pregunta (ej. "Problemas [Dificil acceso al gimnasio]").
+    """
+    normalizadas = [(normalizar(texto), pregunta) for texto, pregunta in preguntas.items()]
+    columnas = {}
+    for encabezado in encabezados:
+        normalizado = normalizar(encabezado)
+        for texto, pregunta in normalizadas:
+            if texto and texto in normalizado:
+                columnas[encabezado] = pregunta
+                break
+    return columnas
+
+
+def _huella(fila):
+    """Hash del contenido de una fila."""
+    contenido = json.dumps(sorted((str(k), str(v or '').strip()) for k, v in fila.items()), ensure_ascii=False)
+    return hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+
+
+def _claves_de_lote(lote, fuente, vistas, desde):
+    """
+    Clave estable de cada fila del lote [(numero, huella, fila), ...]: la
+    huella más cuántas veces apareció antes ese mismo contenido en el
+    archivo. Así dos personas que respondieron igual no se confunden, y
+    volver a importar el archivo genera las mismas claves.
+
+    `vistas` lleva la cuenta entre lotes. Si se saltaron las primeras
+    `desde` filas, las veces que apareció cada huella en ellas salen de las
+    respuestas ya guardadas de esa fuente.
+    """
+    if desde:
+        sin_contar = {huella for _, huella, _ in lote} - vistas.keys()
+        vistas.update(dict.fromkeys(sin_contar, 0))
+        vistas.update(
+            RespuestaEncuesta.objects.filter(fuente=fuente, fila__lte=desde, huella__in=sin_contar)
+            .values('huella').annotate(veces=Count('id')).values_list('huella', 'veces')
+        )
+    claves = []
+    for _, huella, _ in lote:
+        vistas[huella] = vistas.get(huella, 0) + 1
+        claves.append(hashlib.sha256(f'{huella}#{vistas[huella]}'.encode('ascii')).hexdigest())
+    return claves
+
+
+def _importar_lote(lote, columnas, fuente, opciones, vistas, desde):
+    """Importa un lote [(numero, huella, fila), ...]. Devuelve cuántas respuestas nuevas hubo."""
+    claves = _claves_de_lote(lote, fuente, vistas, desde)
+    ya_importadas = set(RespuestaEncuesta.objects.filter(clave__in=claves).values_list('clave', flat=True))
+    nuevas = [(clave, *fila) for clave, fila in zip(claves, lote) if clave not in ya_importadas]
+    if not nuevas:
+        return 0
+
+    # Respuestas de cada fila nueva: [(respuesta, [(pregunta_id, texto_opcion), ...])]
+    elegidas = []
+    for clave, numero, huella, fila in nuevas:
+        respuestas = []
+        for encabezado, pregunta in columnas.items():
+            texto = str(fila.get(encabezado) or '').strip()
+            if not texto:
+                continue
+            if normalizar(texto) == 'si':
+                texto = 'Si'
+            respuestas.append((pregunta.id, texto[:255]))
+        elegidas.append((RespuestaEncuesta(clave=clave, fuente=fuente, fila=numero, huella=huella), respuestas))
+
+    faltantes = {r for _, respuestas in elegidas for r in respuestas if r not in opciones}
+    if faltantes:
+        OpcionEncuesta.objects.bulk_create(
+            [OpcionEncuesta(pregunta_id=pregunta_id, texto=texto) for pregunta_id, texto in faltantes],
+            ignore_conflicts=True,
+        )
+        opciones.update({
+            (o.pregunta_id, o.texto): o.id
+            for o in OpcionEncuesta.objects.filter(pregunta_id__in={p for p, _ in faltantes})
+        })
+
+    with transaction.atomic():
+        creadas = RespuestaEncuesta.objects.bulk_create([respuesta for respuesta, _ in elegidas])
+        Intermedia = RespuestaEncuesta.opciones.through
+        conteos = {}
+        filas_intermedias = []
+        for respuesta, (_, respuestas) in zip(creadas, elegidas):
+            for r in set(respuestas):
+                opcion_id = opciones[r]
+                filas_intermedias.append(Intermedia(respuestaencuesta_id=respuesta.id, opcionencuesta_id=opcion_id))
+                conteos[opcion_id] = conteos.get(opcion_id, 0) + 1
+        Intermedia.objects.bulk_create(filas_intermedias, batch_size=1000)
+
+        # Un UPDATE por opción que cambió en el lote (son pocas)
+        for opcion_id, cantidad in conteos.items():
+            OpcionEncuesta.objects.filter(id=opcion_id).update(conteo=F('conteo') + cantidad)
+    return len(creadas)
+
+
+def importar_respuestas(filas, encabezados, fuente, tam_lote=1000, desde=0):
+    """
+    Importa un iterable de filas {encabezado: valor} por lotes.
+
+    Devuelve (nuevas, repetidas). Las filas ya importadas antes se saltan.
+    Si `filas` empieza después de las primeras `desde` filas del archivo (ya
+    importadas de esta fuente), la numeración y las claves siguen desde ahí.
+    """
+    columnas = asociar_columnas(encabezados, sincronizar_preguntas())
+    opciones = {(o.pregunta_id, o.texto): o.id for o in OpcionEncuesta.objects.all()}
+
+    vistas = {}
+    nuevas = total = 0
+    lote = []
+    for numero, fila in enumerate(filas, start=desde + 1):
+        lote.append((numero, _huella(fila), fila))
+        if len(lote) >= tam_lote:
+            nuevas += _importar_lote(lote, columnas, fuente, opciones, vistas, desde)
+            total += len(lote)
+            lote = []
+    if lote:
+        nuevas += _importar_lote(lote, columnas, fuente, opciones, vistas, desde)
+        total += len(lote)
+    return nuevas, total - nuevas
+
+
+def _prefijo_importado(fuente):
+    """
+    (filas, huella): cuántas filas del principio del archivo ya están
+    importadas de esta fuente y la huella de la última. (0, None) si no se
+    puede asegurar, por ejemplo si alguna fila del medio ya venía de otra
+    fuente o se importó antes de que existiera RespuestaEncuesta.fila.
+    """
+    guardadas = RespuestaEncuesta.objects.filter(fuente=fuente).aggregate(
+        ultima=Max('fila'), total=Count('id'), distintas=Count('fila', distinct=True),
+    )
+    if not guardadas['ultima'] or not guardadas['ultima'] == guardadas['total'] == guardadas['distintas']:
+        return 0, None
+    huella = RespuestaEncuesta.objects.filter(fuente=fuente, fila=guardadas['ultima']).values_list('huella', flat=True).get()
+    return guardadas['ultima'], huella
+
+
+def importar_archivo(ruta, fuente=None, tam_lote=1000):
+    """
+    Importa las respuestas de un .csv o .xlsx. Devuelve (nuevas, repetidas).
+
+    Si las primeras filas ya se importaron de la misma fuente y la última de
+    ellas no cambió, se leen sin procesarlas (ni hash ni consultas) y solo
+    se importan las que siguen. Si no, se revisa el archivo entero.
+    """
+    fuente = fuente or ruta.name
+    desde, huella = _prefijo_importado(fuente)
+    if desde:
+        encabezados, filas = leer_archivo(ruta)
+        ultima = next(itertools.islice(filas, desde - 1, None), None)
+        if ultima is not None and _huella(ultima) == huella:
+            nuevas, repetidas = importar_respuestas(filas, encabezados, fuente, tam_lote, desde=desde)
+            return nuevas, repetidas + desde
+        filas.close()
+
+    encabezados, filas = leer_archivo(ruta)
+    return importar_respuestas(filas, encabezados, fuente, tam_lote)
+
+
+def leer_archivo(ruta):
+    """
+    Devuelve (encabezados, filas) de un .csv o .xlsx, leyendo de a poco.
+
+    Para .xlsx se necesita openpyxl (pip install openpyxl).
+    """
+    if ruta.suffix.lower() == '.xlsx':
+        try:
+            import openpyxl
+        except ImportError:
+            raise ImportError("Para importar archivos .xlsx instala openpyxl: pip install openpyxl")
+        libro = openpyxl.load_workbook(ruta, read_only=True, data_only=True)
+        hoja = libro.active
+        filas = hoja.iter_rows(values_only=True)
+        encabezados = [str(c) if c is not None else '' for c in next(filas, [])]
+
+        def generar():
+            try:
+                for valores in filas:
+                    if any(v is not None for v in valores):
+                        yield dict(zip(encabezados, valores))
+            finally:
+                libro.close()
+        return encabezados, generar()
+
+    archivo = open(ruta, encoding='utf-8-sig', newline='')
+    lector = csv.DictReader(archivo)
+    encabezados = lector.fieldnames or []
+
+    def generar():
+        with archivo:
+            yield from lector
+    return encabezados, generar()
+
+
+def calcular_resultados():
+    """Arma el JSON de resultados a partir de todas las fuentes."""
+    preguntas = cargar_preguntas()
+
+    # {pregunta: {opción: conteo}}, respetando el orden en que aparecen las opciones
+    por_pregunta = {pregunta['text']: {} for pregunta in preguntas}
+    for fuente in (conteos_limpios(), conteos_importados()):
+        for _, pregunta, opcion, conteo in fuente:
+            opciones = por_pregunta.setdefault(pregunta, {})
+            opciones[opcion] = opciones.get(opcion, 0) + conteo
+
+    resultado = []
+    for pregunta in preguntas:
+        opciones = por_pregunta[pregunta['text']]
+        resultado.append({
+            'seccion': pregunta['section'],
+            'pregunta': pregunta['text'],
+            'opciones': [{'opcion': opcion, 'conteo': conteo} for opcion, conteo in opciones.items()],
+        })
+
+    # El total de encuestados es la suma de respuestas de la primera pregunta
+    total = sum(o['conteo'] for o in resultado[0]['opciones']) if resultado else 0
+    return {'total_respuestas': total, 'preguntas': resultado}
+
+
+def _clave_cache():
+    rutas = [
+        _ruta_datos('encuesta_from_excel.json'),
+        _ruta_datos('encuesta_resultados_limpios.csv'),
+    ]
+    versiones = [str(ruta.stat().st_mtime_ns) if ruta.exists() else '0' for ruta in rutas]
+    # MAX(id) sale del índice de la clave primaria, no recorre la tabla
+    versiones.append(str(RespuestaEncuesta.objects.aggregate(ultima=Max('id'))['ultima'] or 0))
+    return f"{CLAVE_CACHE}:{'-'.join(versiones)}"
+
+
+def resultados():
+    """Resultados desde el caché (se recalculan al vencer el TTL o si cambian los archivos)."""
+    datos = cache.get(_clave_cache())
+    if datos is None:
+        datos = refrescar()
+    return datos
+
+
+def refrescar():
+    """Recalcula los resultados y los deja en el caché."""
+    datos = calcular_resultados()
+    cache.set(_clave_cache(), datos, getattr(settings, 'ENCUESTA_CACHE_TTL', 60 * 60))
+    return datos
@@ -0,0 +1,56 @@
+"""
+Transacciones de escritura de las reservas.
+
+SQLite admite un solo escritor a la vez. Con WAL, busy timeout y
+BEGIN IMMEDIATE (ver SQLITE_OPCIONES_PRODUCCION en settings.py) los demás esperan el lock
+en vez de fallar, pero esa espera es un sondeo con pausas cada vez más
+largas: con muchos hilos a la vez algunas escrituras esperan de más y otras
+se pasan del timeout.
+
+escritura() es transaction.atomic() con una fila dentro del proceso: si
+settings.SQLITE_SERIALIZAR_ESCRITURAS está activo, los hilos del proceso
+esperan su turno en un lock de Python (que los despierta apenas se libera)
+y a SQLite solo llega un escritor por proceso. Si no hay turno dentro de
+settings.SQLITE_ESPERA_ESCRITURA segundos, o si SQLite igual responde
+"database is locked", se lanza un ValidationError con un mensaje para el
+usuario en vez de un error 500.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import OperationalError, connection, transaction
+
+MENSAJE_OCUPADO = "Hay muchas reservas al mismo tiempo. Intenta de nuevo en unos segundos."
+
+# Reentrante: una escritura puede llamar a otra (ej. cancelar una serie borra sus reservas)
+_turno = threading.RLock()
+
+
+def _serializar():
+    # Dentro de un atomic() que ya empezó, la transacción ya tiene (o pide) el
+    # lock de SQLite: esperar además el de Python podría trabar a los dos.
+    return (
+        getattr(settings, 'SQLITE_SERIALIZAR_ESCRITURAS', False)
+        and connection.vendor == 'sqlite'
+        and not connection.in_atomic_block
+    )
+
+
+@contextmanager
+def escritura():
+    """transaction.atomic() que espera su turno en el proceso (ver arriba)."""
+    con_turno = _serializar()
+    if con_turno and not _turno.acquire(timeout=getattr(settings, 'SQLITE_ESPERA_ESCRITURA', 10)):
+        raise ValidationError(MENSAJE_OCUPADO)
+    try:
+        with transaction.atomic():
+            yield
+    except OperationalError as e:
+        if 'locked' not in str(e):
+            raise
+        raise ValidationError(MENSAJE_OCUPADO)
+    finally:
+        if con_turno:
+            _turno.release()
@@ -0,0 +1,294 @@
+"""
+Estadísticas de uso para el tablero del admin.
+
+EstadisticaDiaria guarda, por (bloque, fecha), cuántas reservas se hicieron,
+cuántas se cancelaron y cuántos socios llegaron (sumar_asistencias, desde
+el kiosko). sumar() se llama en la misma transacción que mueve
+los cupos (ocupacion.py, series.py y lista_espera.py), así que los números
+no se desfasan y el tablero solo agrupa unas pocas filas por día, aunque
+haya años de historia (y aunque las reservas viejas ya estén archivadas).
+
+recalcular_estadisticas() rehace las reservas desde Reserva y ResumenDiario
+y las asistencias desde Asistencia si algo se descuadra (ej. borrados en
+cascada). Las cancelaciones no se pueden reconstruir, así que se conservan.
+"""
+import datetime
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from . import metricas
+from .disponibilidad import lunes_de
+from .models import Asistencia, BloqueHorario, Cierre, EstadisticaDiaria, Reserva, ResumenDiario, SerieReserva
+
+TTL_TABLERO = 60
+# Rango más largo que muestra el tablero (las celdas abiertas se arman día a día)
+MAXIMO_DIAS_TABLERO = 366
+
+
+def sumar(cambios):
+    """
+    Suma a las estadísticas `cambios` = {(bloque_id, fecha): (reservas, cancelaciones)}.
+
+    Lo normal es un solo UPDATE. Las filas que faltan se crean la primera vez
+    que se toca cada celda. También suma los contadores de /metrics.
+    """
+    metricas.contar_cambios(cambios)
+    _sumar_campos(cambios, ('reservas', 'cancelaciones'))
+
+
+def sumar_asistencias(asistencias):
+    """Suma `asistencias` = {(bloque_id, fecha): entradas} (ver asistencia.py)."""
+    _sumar_campos({clave: (cantidad,) for clave, cantidad in asistencias.items()}, ('asistencias',))
+
+
+def _sumar_campos(cambios, campos):
+    # Un UPDATE por cada combinación distinta de valores (normalmente una sola)
+    por_valor = {}
+    for clave, valores in cambios.items():
+        por_valor.setdefault(valores, []).append(clave)
+
+    for valores, claves in por_valor.items():
+        incrementos = dict(zip(campos, valores))
+        # Lotes chicos para no pasar el límite de profundidad de expresiones de SQLite
+        for inicio in range(0, len(claves), 200):
+            lote = claves[inicio:inicio + 200]
+            if _sumar_lote(lote, incrementos) < len(lote):
+                existentes = set(
+                    EstadisticaDiaria.objects.filter(_condicion(lote)).values_list('bloque_id', 'fecha')
+                )
+                faltantes = [clave for clave in lote if clave not in existentes]
+                _crear(faltantes)
+                _sumar_lote(faltantes, incrementos)
+
+
+def _condicion(claves):
+    condicion = Q()
+    for bloque_id, fecha in claves:
+        condicion |= Q(bloque_id=bloque_id, fecha=fecha)
+    return condicion
+
+
+def _sumar_lote(claves, incrementos):
+    return EstadisticaDiaria.objects.filter(_condicion(claves)).update(
+        **{campo: F(campo) + cantidad for campo, cantidad in incrementos.items()}
+    )
+
+
+def _crear(claves):
+    """Crea en cero las filas de `claves` (si otra transacción ya las creó, no pasa nada)."""
+    capacidades = dict(
+        BloqueHorario.objects.filter(id__in={b for b, _ in claves}).values_list('id', 'capacidad_maxima')
+    )
+    EstadisticaDiaria.objects.bulk_create(
+        [
+            EstadisticaDiaria(
+                bloque_id=bloque_id,
+                fecha=fecha,
+                semana=lunes_de(fecha),
+                dia_semana=fecha.weekday(),
+                capacidad=capacidades.get(bloque_id, 0),
+            )
+            for bloque_id, fecha in claves
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def recalcular_estadisticas():
+    """Rehace `reservas` y `asistencias` de cada (bloque, fecha) desde las reservas (vigentes y archivadas) y Asistencia."""
+    with transaction.atomic():
+        cancelaciones = {
+            (e['bloque_id'], e['fecha']): e['cancelaciones']
+            for e in EstadisticaDiaria.objects.values('bloque_id', 'fecha', 'cancelaciones')
+        }
+        vigentes = {
+            (c['bloque'], c['fecha']): c['conteo']
+            for c in Reserva.objects.values('bloque', 'fecha').annotate(conteo=Count('id')).order_by()
+        }
+        for bloque_id, fecha, reservas in ResumenDiario.objects.filter(bloque__isnull=False).values_list(
+            'bloque_id', 'fecha', 'reservas'
+        ):
+            vigentes[(bloque_id, fecha)] = vigentes.get((bloque_id, fecha), 0) + reservas
+        asistencias = {
+            (a['bloque'], a['fecha']): a['conteo']
+            for a in Asistencia.objects.filter(bloque__isnull=False)
+            .values('bloque', 'fecha').annotate(conteo=Count('id')).order_by()
+        }
+
+        capacidades = dict(BloqueHorario.objects.values_list('id', 'capacidad_maxima'))
+        EstadisticaDiaria.objects.all().delete()
+        EstadisticaDiaria.objects.bulk_create(
+            [
+                EstadisticaDiaria(
+                    bloque_id=bloque_id,
+                    fecha=fecha,
+                    semana=lunes_de(fecha),
+                    dia_semana=fecha.weekday(),
+                    # Las reservas hechas incluyen las que después se cancelaron
+                    reservas=vigentes.get((bloque_id, fecha), 0) + cancelaciones.get((bloque_id, fecha), 0),
+                    cancelaciones=cancelaciones.get((bloque_id, fecha), 0),
+                    asistencias=asistencias.get((bloque_id, fecha), 0),
+                    capacidad=capacidades.get(bloque_id, 0),
+                )
+                for bloque_id, fecha in set(vigentes) | set(cancelaciones) | set(asistencias)
+                if bloque_id in capacidades
+            ],
+            batch_size=500,
+        )
+    return EstadisticaDiaria.objects.count()
+
+
+# -----------------------------------------------------------------
+# TABLERO
+# -----------------------------------------------------------------
+
+def _porcentaje(parte, total):
+    return round(100 * parte / total, 1) if total else 0.0
+
+
+def _color(uso):
+    """Blanco (vacío) a rojo (lleno) para el mapa de calor."""
+    return f'hsl(0, 75%, {100 - min(uso, 100) * 0.5:.0f}%)'
+
+
+def _celdas_abiertas(bloques, desde, hasta):
+    """
+    {(bloque_id, fecha): capacidad} de las celdas que abren entre `desde` y
+    `hasta` según el horario actual: bloques activos, en sus días de la
+    semana y sin cierre del gimnasio ni del bloque.
+    """
+    cierres = set(Cierre.objects.filter(fecha__gte=desde, fecha__lte=hasta).values_list('bloque_id', 'fecha'))
+    abiertas = {}
+    # Por cantidad de días: sumarle uno a `hasta` se pasa de date.max
+    for dias in range((hasta - desde).days + 1):
+        fecha = desde + datetime.timedelta(days=dias)
+        if fecha.weekday() <= 4 and (None, fecha) not in cierres:
+            for bloque in bloques:
+                if bloque.activo and fecha.weekday() in bloque.lista_dias and (bloque.id, fecha) not in cierres:
+                    abiertas[(bloque.id, fecha)] = bloque.capacidad_maxima
+    return abiertas
+
+
+def calcular_tablero(desde, hasta):
+    """
+    Datos del tablero entre dos fechas (incluidas). Lee las filas de
+    EstadisticaDiaria del rango (una por bloque y día) y las agrupa aquí.
+
+    La capacidad es la de las celdas que abren según el horario, tengan o no
+    reservas: un bloque abierto que nadie reservó baja el uso. Las celdas con
+    fila usan la capacidad guardada en ella (la del bloque en ese momento);
+    las que no tienen, la capacidad actual.
+
+    Las inasistencias solo se cuentan en los días pasados en que el kiosko
+    registró al menos una entrada en el bloque: si no se usó, no se sabe
+    quién vino.
+    """
+    bloques = list(BloqueHorario.objects.order_by('hora_inicio'))
+    celdas = {
+        (f['bloque_id'], f['fecha']): f
+        for f in EstadisticaDiaria.objects.filter(fecha__gte=desde, fecha__lte=hasta).values(
+            'bloque_id', 'fecha', 'reservas', 'cancelaciones', 'asistencias', 'capacidad',
+        )
+    }
+    for (bloque_id, fecha), capacidad in _celdas_abiertas(bloques, desde, hasta).items():
+        if (bloque_id, fecha) not in celdas:
+            celdas[(bloque_id, fecha)] = {
+                'bloque_id': bloque_id, 'fecha': fecha,
+                'reservas': 0, 'cancelaciones': 0, 'asistencias': 0, 'capacidad': capacidad,
+            }
+
+    # Sumas por bloque x día de la semana, por semana y por bloque
+    hoy = timezone.localdate()
+    por_dia, por_semana, por_bloque = {}, {}, {}
+    for c in celdas.values():
+        vigentes = c['reservas'] - c['cancelaciones']
+        for suma in (
+            por_dia.setdefault((c['bloque_id'], c['fecha'].weekday()), {'vigentes': 0, 'capacidad': 0}),
+            por_semana.setdefault(lunes_de(c['fecha']), {'vigentes': 0, 'capacidad': 0}),
+        ):
+            suma['vigentes'] += vigentes
+            suma['capacidad'] += c['capacidad']
+        suma = por_bloque.setdefault(
+            c['bloque_id'], {'hechas': 0, 'canceladas': 0, 'capacidad': 0, 'esperadas': 0, 'asistieron': 0}
+        )
+        suma['hechas'] += c['reservas']
+        suma['canceladas'] += c['cancelaciones']
+        suma['capacidad'] += c['capacidad']
+        if c['fecha'] < hoy and c['asistencias'] > 0:
+            suma['esperadas'] += vigentes
+            suma['asistieron'] += c['asistencias']
+
+    # Mapa de calor bloque x día de la semana
+    usos = {clave: _porcentaje(s['vigentes'], s['capacidad']) for clave, s in por_dia.items()}
+    mapa_calor = [
+        {
+            'bloque': b.nombre,
+            'celdas': [
+                {'uso': usos[(b.id, dia)], 'color': _color(usos[(b.id, dia)])}
+                if (b.id, dia) in usos else None
+                for dia in range(5)
+            ],
+        }
+        for b in bloques
+    ]
+
+    # Uso semana a semana
+    semanas = [
+        {'semana': lunes, **s, 'uso': _porcentaje(s['vigentes'], s['capacidad'])}
+        for lunes, s in sorted(por_semana.items())
+    ]
+
+    # Cancelaciones e inasistencias por bloque
+    cancelaciones = []
+    for b in bloques:
+        c = por_bloque.get(b.id, {'hechas': 0, 'canceladas': 0, 'capacidad': 0, 'esperadas': 0, 'asistieron': 0})
+        # Una reserva cancelada después de entrar cuenta como asistencia
+        faltaron = max(c['esperadas'] - c['asistieron'], 0)
+        cancelaciones.append({
+            'bloque': b.nombre,
+            'hechas': c['hechas'],
+            'canceladas': c['canceladas'],
+            'tasa': _porcentaje(c['canceladas'], c['hechas']),
+            'uso': _porcentaje(c['hechas'] - c['canceladas'], c['capacidad']),
+            'asistieron': c['asistieron'],
+            'faltaron': faltaron,
+            'tasa_inasistencia': _porcentaje(faltaron, c['esperadas']),
+        })
+
+    return {
+        'desde': desde,
+        'hasta': hasta,
+        'dias': SerieReserva.DIAS,
+        'mapa_calor': mapa_calor,
+        'por_semana': semanas,
+        'cancelaciones': cancelaciones,
+    }
+
+
+def tablero(desde, hasta):
+    """calcular_tablero con caché corto: el admin puede recargar sin volver a calcular."""
+    clave = f'agendamiento:tablero:{desde.isoformat()}:{hasta.isoformat()}'
+    datos = cache.get(clave)
+    if datos is None:
+        datos = calcular_tablero(desde, hasta)
+        cache.set(clave, datos, TTL_TABLERO)
+    return datos
+
+
+def ajustar_rango(desde, hasta):
+    """
+    (desde, hasta) en orden y de como mucho MAXIMO_DIAS_TABLERO días: si el
+    rango pedido es más largo se muestran los últimos días hasta `hasta`.
+    """
+    if desde > hasta:
+        desde, hasta = hasta, desde
+    return max(desde, hasta - datetime.timedelta(days=MAXIMO_DIAS_TABLERO - 1)), hasta
+
+
+def rango_por_defecto(hoy, semanas=26):
+    """Las últimas `semanas` semanas hasta el viernes de la semana actual."""
+    lunes = lunes_de(hoy)
+    return lunes - datetime.timedelta(weeks=semanas - 1), lunes + datetime.timedelta(days=4)
@@ -0,0 +1,129 @@
+"""
+Archivos estáticos propios en vez de CDN.
+
+"python manage.py construir_estaticos" (después de "npm install") genera
+static/css/app.css con la CLI de Tailwind, solo con las clases que usan las
+plantillas, y copia a static/vendor/ Chart.js, su plugin de etiquetas y la
+fuente Inter desde node_modules (versiones fijas en package.json). Después
+corre collectstatic.
+
+En producción (DEBUG = False) collectstatic usa EstaticosComprimidos: le
+agrega un hash del contenido al nombre de cada archivo (manifest) y deja al
+lado una versión .gz (y .br si está instalado el paquete brotli) de los que
+se comprimen bien. servir() entrega esos archivos: la versión comprimida si
+el navegador la acepta y, para los nombres con hash, caché de un año
+("immutable"): si el archivo cambia, cambia su nombre.
+
+Con nginx delante se puede servir /static/ directo desde STATIC_ROOT con
+`gzip_static on; brotli_static on; expires max;` y servir() no se usa.
+
+Mientras no se haya corrido construir_estaticos (ej. recién clonado el
+repositorio), las plantillas siguen usando los CDN (ver templatetags/recursos.py).
+"""
+import gzip
+import mimetypes
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:  # Opcional: sin brotli solo se generan los .gz
+    brotli = None
+
+# Archivo generado en static/ -> archivo de node_modules
+VENDOR = {
+    'vendor/chart.umd.js': 'chart.js/dist/chart.umd.js',
+    'vendor/chartjs-plugin-datalabels.min.js': 'chartjs-plugin-datalabels/dist/chartjs-plugin-datalabels.min.js',
+    'vendor/qrcode.js': 'qrcode-generator/qrcode.js',
+    **{
+        f'vendor/inter/inter-latin-{peso}-normal.woff2': f'@fontsource/inter/files/inter-latin-{peso}-normal.woff2'
+        for peso in (400, 500, 600, 700)
+    },
+}
+
+COMPRIMIBLES = {'.css', '.js', '.json', '.csv', '.svg', '.txt', '.map', '.html'}
+# ManifestStaticFilesStorage agrega 12 caracteres hexadecimales antes de la extensión
+CON_HASH = re.compile(r'\.[0-9a-f]{12}\.[^./]+$')
+UN_ANO = 60 * 60 * 24 * 365
+
+
+def comprimir(ruta):
+    """Escribe ruta.gz (y ruta.br) si el archivo se comprime al menos un 5 %. Devuelve las creadas."""
+    ruta = Path(ruta)
+    if ruta.suffix not in COMPRIMIBLES:
+        return []
+    datos = ruta.read_bytes()
+    versiones = [('.gz', lambda: gzip.compress(datos, 9, mtime=0))]
+    if brotli is not None:
+        versiones.append(('.br', lambda: brotli.compress(datos, quality=11)))
+
+    creadas = []
+    for extension, compresor in versiones:
+        comprimido = compresor()
+        if len(comprimido) < len(datos) * 0.95:
+            destino = ruta.with_name(ruta.name + extension)
+            destino.write_bytes(comprimido)
+            creadas.append(destino)
+    return creadas
+
+
+class EstaticosComprimidos(ManifestStaticFilesStorage):
+    """Manifest (nombres con hash) más versiones .gz/.br al lado de cada archivo."""
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for nombre in {*paths, *self.hashed_files.values()}:
+            comprimir(self.path(nombre))
+
+
+def _codificaciones(request):
+    aceptadas = {
+        parte.split(';')[0].strip().lower()
+        for parte in request.headers.get('Accept-Encoding', '').split(',')
+    }
+    return [(extension, nombre) for extension, nombre in (('.br', 'br'), ('.gz', 'gzip')) if nombre in aceptadas]
+
+
+@require_safe
+def servir(request, ruta):
+    """Un archivo de STATIC_ROOT, comprimido si se puede y con caché larga si el nombre tiene hash."""
+    try:
+        archivo = Path(safe_join(settings.STATIC_ROOT, ruta))
+    except SuspiciousFileOperation:
+        raise Http404
+    if archivo.suffix in ('.gz', '.br') or not archivo.is_file():
+        raise Http404
+
+    servido, codificacion = archivo, None
+    for extension, nombre in _codificaciones(request):
+        alternativo = archivo.with_name(archivo.name + extension)
+        if alternativo.is_file():
+            servido, codificacion = alternativo, nombre
+            break
+
+    modificado = servido.stat().st_mtime
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), modificado):
+        return HttpResponseNotModified()
+
+    tipo, _ = mimetypes.guess_type(archivo.name)
+    respuesta = FileResponse(servido.open('rb'), content_type=tipo or 'application/octet-stream', filename=archivo.name)
+    respuesta['Last-Modified'] = http_date(modificado)
+    respuesta['Vary'] = 'Accept-Encoding'
+    if codificacion:
+        respuesta['Content-Encoding'] = codificacion
+    if CON_HASH.search(archivo.name):
+        respuesta['Cache-Control'] = f'public, max-age={UN_ANO}, immutable'
+    else:
+        respuesta['Cache-Control'] = 'public, max-age=3600'
+    return respuesta
@@ -0,0 +1,119 @@
+"""
+Avisos en vivo de cambios de cupos (Server-Sent Events).
+
+Cada navegador que mira la grilla abre una sola conexión a
+/api/agenda/eventos/ y recibe un evento cada vez que cambia un cupo de la
+semana que está viendo, en vez de recargar la página.
+
+El reparto es dentro del proceso: cada conexión tiene una asyncio.Queue y
+publicar_cambios() (llamado después del COMMIT de una reserva o
+cancelación, ver ocupacion.py) deja el evento en las colas de la semana.
+No usa un broker externo, así que cada cliente solo recibe los cambios
+hechos en el mismo proceso ASGI en el que está conectado.
+"""
+import asyncio
+import json
+import threading
+
+from .disponibilidad import lunes_de
+from .models import OcupacionBloque
+
+# Cada cuánto se manda un comentario para que proxies no corten la conexión
+SEGUNDOS_PING = 20
+
+# Si un cliente lento acumula más eventos que esto, se le pide recargar
+MAXIMO_EN_COLA = 100
+
+
+class CanalSemanas:
+    """Suscriptores agrupados por semana: {lunes: {(loop, cola), ...}}."""
+
+    def __init__(self):
+        self._suscriptores = {}
+        self._lock = threading.Lock()
+
+    def suscribir(self, lunes):
+        """Crea la cola de un cliente. Se llama desde el event loop."""
+        cola = asyncio.Queue(maxsize=MAXIMO_EN_COLA)
+        with self._lock:
+            self._suscriptores.setdefault(lunes, set()).add((asyncio.get_running_loop(), cola))
+        return cola
+
+    def desuscribir(self, lunes, cola):
+        with self._lock:
+            suscriptores = self._suscriptores.get(lunes, set())
+            suscriptores.difference_update({s for s in suscriptores if s[1] is cola})
+            if not suscriptores:
+                self._suscriptores.pop(lunes, None)
+
+    def hay_suscriptores(self, lunes):
+        return lunes in self._suscriptores
+
+    def publicar(self, lunes, evento):
+        """Entrega `evento` a todos los clientes de la semana (se puede llamar desde cualquier hilo)."""
+        with self._lock:
+            suscriptores = list(self._suscriptores.get(lunes, ()))
+        for loop, cola in suscriptores:
+            loop.call_soon_threadsafe(_encolar, cola, evento)
+
+
+def _encolar(cola, evento):
+    try:
+        cola.put_nowait(evento)
+    except asyncio.QueueFull:
+        # El cliente no alcanza a leer: descartamos lo pendiente y le pedimos recargar
+        while not cola.empty():
+            cola.get_nowait()
+        cola.put_nowait({'tipo': 'recargar'})
+
+
+canal = CanalSemanas()
+
+
+def publicar_cambios(claves):
+    """
+    Publica los cupos actuales de las celdas [(bloque_id, fecha), ...].
+
+    Solo consulta la base de datos si alguien está mirando esa semana.
+    """
+    por_semana = {}
+    for bloque_id, fecha in claves:
+        lunes = lunes_de(fecha)
+        if canal.hay_suscriptores(lunes):
+            por_semana.setdefault(lunes, []).append((bloque_id, fecha))
+    if not por_semana:
+        return
+
+    fechas = {fecha for celdas in por_semana.values() for _, fecha in celdas}
+    ocupacion = {
+        (bloque_id, fecha): capacidad - ocupados
+        for bloque_id, fecha, ocupados, capacidad in OcupacionBloque.objects.filter(
+            fecha__in=fechas
+        ).values_list('bloque_id', 'fecha', 'ocupados', 'bloque__capacidad_maxima')
+    }
+    for lunes, celdas in por_semana.items():
+        for bloque_id, fecha in celdas:
+            if (bloque_id, fecha) in ocupacion:
+                canal.publicar(lunes, {
+                    'tipo': 'cupos',
+                    'bloque_id': bloque_id,
+                    'fecha': fecha.isoformat(),
+                    'cupos': ocupacion[(bloque_id, fecha)],
+                })
+
+
+async def flujo_semana(lunes):
+    """Generador asíncrono con el texto SSE para una conexión."""
+    cola = canal.suscribir(lunes)
+    try:
+        yield 'retry: 5000\n\n'
+        while True:
+            try:
+                evento = await asyncio.wait_for(cola.get(), timeout=SEGUNDOS_PING)
+            except asyncio.TimeoutError:
+                yield ': ping\n\n'
+                continue
+            yield f"event: {evento['tipo']}\ndata: {json.dumps(evento)}\n\n"
+    finally:
+        # Django cancela el generador cuando el cliente se desconecta
+        canal.desuscribir(lunes, cola)
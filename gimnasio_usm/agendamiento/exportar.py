@@ -0,0 +1,143 @@
+"""
+Exportación de reservas y sugerencias para el staff, en CSV o JSON Lines
+(ver las acciones y la URL exportar/ de ReservaAdmin y SugerenciaAdmin).
+
+La respuesta es un StreamingHttpResponse que va escribiendo las filas a
+medida que las lee de la base de datos con values_list(...).iterator(): solo
+hay un lote de filas en memoria a la vez, así que un semestre completo se
+exporta con memoria constante, y la descarga empieza de inmediato en vez de
+esperar a que se arme el archivo entero.
+
+En el CSV, los textos que empiezan con = + - @, tabulación o retorno de
+carro llevan un apóstrofo adelante: Excel y LibreOffice los tomarían como
+fórmulas, y el texto de una sugerencia lo escribe cualquier socio.
+"""
+import csv
+import datetime
+import json
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import Reserva, Sugerencia
+
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+# Filas que se leen por consulta (iterator) y que se envían juntas al navegador
+TAMANO_LOTE = 2000
+# Inicios de celda que una planilla interpreta como fórmula
+INICIOS_FORMULA = ('=', '+', '-', '@', '\t', '\r')
+
+# (nombre de la columna, campo para values_list)
+COLUMNAS_RESERVAS = [
+    ('id', 'id'),
+    ('fecha', 'fecha'),
+    ('bloque', 'bloque__nombre'),
+    ('hora_inicio', 'bloque__hora_inicio'),
+    ('usuario', 'usuario__username'),
+    ('serie_id', 'serie_id'),
+]
+COLUMNAS_SUGERENCIAS = [
+    ('id', 'id'),
+    ('fecha_creacion', 'fecha_creacion'),
+    ('usuario', 'usuario__username'),
+    ('texto', 'texto'),
+]
+
+
+class _Eco:
+    """csv.writer escribe aquí y writerow() devuelve la línea en vez de guardarla."""
+
+    def write(self, valor):
+        return valor
+
+
+def _valor(valor):
+    # Fechas y horas en ISO 8601; las de creación, en la hora local del gimnasio
+    if isinstance(valor, datetime.datetime):
+        return timezone.localtime(valor).isoformat() if timezone.is_aware(valor) else valor.isoformat()
+    if isinstance(valor, (datetime.date, datetime.time)):
+        return valor.isoformat()
+    return valor
+
+
+def _celda_csv(valor):
+    valor = _valor(valor)
+    if isinstance(valor, str) and valor.startswith(INICIOS_FORMULA):
+        return "'" + valor
+    return valor
+
+
+def _en_lotes(lineas):
+    lote = []
+    for linea in lineas:
+        lote.append(linea)
+        if len(lote) >= TAMANO_LOTE:
+            yield ''.join(lote)
+            lote = []
+    if lote:
+        yield ''.join(lote)
+
+
+def _lineas_csv(nombres, filas):
+    escritor = csv.writer(_Eco())
+    # Con el BOM, Excel abre el archivo como UTF-8 (tildes y ñ)
+    yield '\ufeff' + escritor.writerow(nombres)
+    for fila in filas:
+        yield escritor.writerow([_celda_csv(valor) for valor in fila])
+
+
+def _lineas_jsonl(nombres, filas):
+    for fila in filas:
+        yield json.dumps(dict(zip(nombres, map(_valor, fila))), ensure_ascii=False) + '\n'
+
+
+def respuesta(queryset, columnas, formato, nombre_archivo):
+    """Descarga de las `columnas` de cada fila de `queryset` en `formato` ('csv' o 'jsonl')."""
+    nombres = [nombre for nombre, _ in columnas]
+    filas = queryset.values_list(*[campo for _, campo in columnas]).iterator(chunk_size=TAMANO_LOTE)
+    lineas = _lineas_csv(nombres, filas) if formato == 'csv' else _lineas_jsonl(nombres, filas)
+    descarga = StreamingHttpResponse(_en_lotes(lineas), content_type=FORMATOS[formato])
+    descarga['Content-Disposition'] = f'attachment; filename="{nombre_archivo}.{formato}"'
+    return descarga
+
+
+def rango(datos):
+    """(desde, hasta) de los parámetros 'desde' y 'hasta' (AAAA-MM-DD, opcionales). ValueError si no son válidos."""
+    return tuple(
+        datetime.date.fromisoformat(datos[nombre]) if datos.get(nombre) else None
+        for nombre in ('desde', 'hasta')
+    )
+
+
+def filtrar_reservas(datos):
+    """reservas() con los parámetros de exportar/: desde, hasta y bloque (id). ValueError si no son válidos."""
+    desde, hasta = rango(datos)
+    return reservas(desde, hasta, int(datos['bloque']) if datos.get('bloque') else None)
+
+
+def filtrar_sugerencias(datos):
+    """sugerencias() con los parámetros de exportar/: desde y hasta."""
+    return sugerencias(*rango(datos))
+
+
+def reservas(desde=None, hasta=None, bloque_id=None):
+    consulta = Reserva.objects.all()
+    if desde:
+        consulta = consulta.filter(fecha__gte=desde)
+    if hasta:
+        consulta = consulta.filter(fecha__lte=hasta)
+    if bloque_id:
+        consulta = consulta.filter(bloque_id=bloque_id)
+    return consulta.order_by('fecha', 'bloque__hora_inicio', 'id')
+
+
+def sugerencias(desde=None, hasta=None):
+    consulta = Sugerencia.objects.all()
+    if desde:
+        consulta = consulta.filter(fecha_creacion__date__gte=desde)
+    if hasta:
+        consulta = consulta.filter(fecha_creacion__date__lte=hasta)
+    return consulta.order_by('fecha_creacion', 'id')
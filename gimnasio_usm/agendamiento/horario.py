@@ -0,0 +1,235 @@
+"""
+Sincronización del horario del gimnasio.
+
+El horario se define en un archivo JSON (settings.HORARIO_GIMNASIO):
+
+    {
+        "capacidad": 10,                          # capacidad de todos los bloques
+        "capacidades": {"Bloque 1-2": 15},        # excepciones por bloque
+        "bloques": [
+            {"nombre": "Bloque 1-2", "hora_inicio": "08:15", "hora_fin": "09:25",
+             "dias": [0, 1, 2, 3, 4]}             # 0 = lunes
+        ],
+        "cierres": [
+            {"fecha": "2026-12-25", "motivo": "Feriado: Navidad"},             # todo el día
+            {"fecha": "2026-11-03", "bloque": "Bloque 5-6", "motivo": "Mantención"}
+        ]
+    }
+
+sincronizar() compara el archivo con la base de datos y aplica solo las
+diferencias con bulk_create / bulk_update. Nunca borra bloques (eso borraría
+sus reservas en cascada): los que salen del archivo quedan inactivos. Los
+cierres desde hoy en adelante quedan iguales al archivo; los pasados se
+conservan como historia.
+
+Antes de aplicar, revisa qué reservas desde hoy quedarían fuera del horario:
+en bloques que se desactivan, en días que un bloque deja de ofrecer o en
+celdas con más ocupados que la capacidad nueva. Si hay alguna, no aplica
+nada salvo con forzar=True (crear_bloques --forzar); esas reservas no se
+cancelan solas, quedan para que el staff avise a los socios.
+
+Como bulk_create y bulk_update no mandan señales, al terminar se sube la
+versión de los bloques para que la grilla en caché se vuelva a armar con
+los días y cierres nuevos (ver disponibilidad.py).
+"""
+import datetime
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import disponibilidad
+from .models import BloqueHorario, Cierre, OcupacionBloque, Reserva
+
+CAMPOS_BLOQUE = ['hora_inicio', 'hora_fin', 'capacidad_maxima', 'dias_semana', 'activo']
+
+
+def cargar_definicion(ruta=None):
+    """Lee el archivo de horario y devuelve (bloques, cierres) ya validados."""
+    ruta = ruta or settings.HORARIO_GIMNASIO
+    try:
+        with open(ruta, encoding='utf-8') as archivo:
+            datos = json.load(archivo)
+    except (OSError, ValueError) as e:
+        raise ValidationError(f"No se pudo leer el horario {ruta}: {e}")
+    return interpretar(datos)
+
+
+def interpretar(datos):
+    """
+    Convierte el JSON del horario a:
+    - bloques: {nombre: {hora_inicio, hora_fin, capacidad_maxima, dias_semana, activo}}
+    - cierres: {(fecha, nombre_bloque o None): motivo}
+    """
+    capacidad = datos.get('capacidad', 10)
+    excepciones = datos.get('capacidades', {})
+    bloques = {}
+    try:
+        for bloque in datos['bloques']:
+            dias = sorted(set(bloque.get('dias', [0, 1, 2, 3, 4])))
+            if any(dia not in range(5) for dia in dias):
+                raise ValidationError(f"{bloque['nombre']}: los días van de 0 (lunes) a 4 (viernes).")
+            inicio = datetime.time.fromisoformat(bloque['hora_inicio'])
+            fin = datetime.time.fromisoformat(bloque['hora_fin'])
+            if fin <= inicio:
+                raise ValidationError(f"{bloque['nombre']}: la hora de fin debe ser posterior a la de inicio.")
+            bloques[bloque['nombre']] = {
+                'hora_inicio': inicio,
+                'hora_fin': fin,
+                'capacidad_maxima': excepciones.get(bloque['nombre'], capacidad),
+                'dias_semana': ','.join(str(dia) for dia in dias),
+                'activo': True,
+            }
+
+        desconocidos = set(excepciones) - set(bloques)
+        if desconocidos:
+            raise ValidationError(f"Capacidad para bloques que no existen: {', '.join(sorted(desconocidos))}")
+
+        cierres = {}
+        for cierre in datos.get('cierres', []):
+            nombre = cierre.get('bloque')
+            if nombre is not None and nombre not in bloques:
+                raise ValidationError(f"Cierre del {cierre['fecha']} para un bloque que no existe: {nombre}")
+            cierres[(datetime.date.fromisoformat(cierre['fecha']), nombre)] = cierre.get('motivo', 'Cerrado')
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValidationError(f"El horario no tiene el formato esperado: {e}")
+    return bloques, cierres
+
+
+def sincronizar(bloques, cierres, simular=False, forzar=False):
+    """
+    Aplica la definición a la base de datos. Devuelve un dict con lo que
+    cambió (o cambiaría, con simular=True): creados, actualizados,
+    desactivados, cierres_nuevos, cierres_borrados, reservas_en_cierres y
+    afectadas (ver reservas_afectadas).
+
+    Si el cambio deja reservas fuera del horario, lanza ValidationError sin
+    aplicar nada, salvo con forzar=True.
+    """
+    with transaction.atomic():
+        existentes = {b.nombre: b for b in BloqueHorario.objects.select_for_update()}
+        hoy = timezone.localdate()
+
+        nuevos, cambiados = [], []
+        for nombre, campos in bloques.items():
+            bloque = existentes.get(nombre)
+            if bloque is None:
+                nuevos.append(BloqueHorario(nombre=nombre, **campos))
+            elif any(getattr(bloque, campo) != valor for campo, valor in campos.items()):
+                cambiados.append(bloque)
+        desactivar = [b for nombre, b in existentes.items() if nombre not in bloques and b.activo]
+        # Antes de cambiar los bloques: hay que comparar los días y capacidades de ahora con los nuevos
+        afectadas = reservas_afectadas(cambiados, desactivar, bloques, hoy)
+        for bloque in cambiados:
+            for campo, valor in bloques[bloque.nombre].items():
+                setattr(bloque, campo, valor)
+
+        # Cierres: se comparan desde hoy; los pasados no se tocan
+        actuales = {
+            (c.fecha, c.bloque.nombre if c.bloque_id else None): c
+            for c in Cierre.objects.filter(fecha__gte=hoy).select_related('bloque')
+        }
+        deseados = {clave: motivo for clave, motivo in cierres.items() if clave[0] >= hoy}
+        cierres_nuevos = [clave for clave in deseados if clave not in actuales]
+        cierres_borrados = [c for clave, c in actuales.items() if clave not in deseados]
+        motivos_cambiados = [
+            c for clave, c in actuales.items() if clave in deseados and c.motivo != deseados[clave]
+        ]
+
+        resumen = {
+            'creados': [b.nombre for b in nuevos],
+            'actualizados': [b.nombre for b in cambiados],
+            'desactivados': [b.nombre for b in desactivar],
+            'cierres_nuevos': len(cierres_nuevos),
+            'cierres_borrados': len(cierres_borrados),
+            'reservas_en_cierres': 0,
+            'afectadas': afectadas,
+        }
+        if simular:
+            return resumen
+        if not forzar and any(afectadas.values()):
+            raise ValidationError(
+                [f"{texto}." for texto in describir_afectadas(afectadas)]
+                + ["No se aplicó ningún cambio; usa --forzar para aplicarlo igual."]
+            )
+
+        BloqueHorario.objects.bulk_create(nuevos)
+        if cambiados:
+            BloqueHorario.objects.bulk_update(cambiados, CAMPOS_BLOQUE)
+        if desactivar:
+            BloqueHorario.objects.filter(id__in=[b.id for b in desactivar]).update(activo=False)
+
+        ids = dict(BloqueHorario.objects.values_list('nombre', 'id'))
+        Cierre.objects.bulk_create([
+            Cierre(fecha=fecha, bloque_id=ids[nombre] if nombre else None, motivo=deseados[(fecha, nombre)])
+            for fecha, nombre in cierres_nuevos
+        ])
+        for cierre in motivos_cambiados:
+            cierre.motivo = deseados[(cierre.fecha, cierre.bloque.nombre if cierre.bloque_id else None)]
+        if motivos_cambiados:
+            Cierre.objects.bulk_update(motivos_cambiados, ['motivo'])
+        if cierres_borrados:
+            Cierre.objects.filter(id__in=[c.id for c in cierres_borrados]).delete()
+
+        resumen['reservas_en_cierres'] = reservas_en_cierres(hoy).count()
+        transaction.on_commit(disponibilidad.invalidar_bloques)
+    return resumen
+
+
+def reservas_afectadas(cambiados, desactivar, bloques, desde):
+    """
+    Reservas desde `desde` que el cambio de horario deja fuera:
+    - desactivados: cuántas hay en los bloques que se desactivan.
+    - dias_quitados: cuántas caen en un día que su bloque deja de ofrecer.
+    - sobre_capacidad: [(bloque, fecha, ocupados, capacidad nueva)] de las
+      celdas con más ocupados que la capacidad que van a tener.
+    `cambiados` todavía tiene los valores actuales; `bloques` es la definición nueva.
+    """
+    quitados, achicados = Q(), Q()
+    capacidades = {}
+    for bloque in cambiados:
+        nuevo = bloques[bloque.nombre]
+        dias = set(bloque.lista_dias) - {int(dia) for dia in nuevo['dias_semana'].split(',') if dia}
+        if dias:
+            # iso_week_day: 1 = lunes
+            quitados |= Q(bloque_id=bloque.id, fecha__iso_week_day__in=[dia + 1 for dia in dias])
+        if nuevo['capacidad_maxima'] < bloque.capacidad_maxima:
+            capacidades[bloque.id] = nuevo['capacidad_maxima']
+            achicados |= Q(bloque_id=bloque.id, ocupados__gt=nuevo['capacidad_maxima'])
+
+    futuras = Reserva.objects.filter(fecha__gte=desde)
+    nombres = {bloque.id: bloque.nombre for bloque in cambiados}
+    return {
+        'desactivados': futuras.filter(bloque__in=desactivar).count() if desactivar else 0,
+        'dias_quitados': futuras.filter(quitados).count() if quitados else 0,
+        'sobre_capacidad': [
+            (nombres[bloque_id], fecha, ocupados, capacidades[bloque_id])
+            for bloque_id, fecha, ocupados in OcupacionBloque.objects.filter(achicados, fecha__gte=desde)
+            .order_by('fecha').values_list('bloque_id', 'fecha', 'ocupados')
+        ] if achicados else [],
+    }
+
+
+def describir_afectadas(afectadas):
+    """Líneas para el staff con las reservas que el cambio deja fuera del horario."""
+    lineas = []
+    if afectadas['desactivados']:
+        lineas.append(f"Hay {afectadas['desactivados']} reservas futuras en bloques que se desactivan")
+    if afectadas['dias_quitados']:
+        lineas.append(f"Hay {afectadas['dias_quitados']} reservas futuras en días que su bloque deja de ofrecer")
+    for nombre, fecha, ocupados, capacidad in afectadas['sobre_capacidad']:
+        lineas.append(f"{nombre} el {fecha}: {ocupados} reservas y la capacidad nueva es {capacidad}")
+    return lineas
+
+
+def reservas_en_cierres(desde):
+    """Reservas desde `desde` que caen en un cierre (se avisan, no se cancelan solas)."""
+    condicion = Q()
+    for fecha, bloque_id in Cierre.objects.filter(fecha__gte=desde).values_list('fecha', 'bloque_id'):
+        condicion |= Q(fecha=fecha) if bloque_id is None else Q(fecha=fecha, bloque_id=bloque_id)
+    if not condicion:
+        return Reserva.objects.none()
+    return Reserva.objects.filter(condicion)
@@ -0,0 +1,140 @@
+"""
+Control de admisión para las peticiones que escriben (reservar, cancelar,
+registro y login).
+
+Límite por cubeta de fichas (token bucket): cada usuario, cada IP y, en el
+login, cada nombre de cuenta intentado tiene una cubeta por grupo de vistas
+(settings.LIMITES_PETICIONES). Cada POST saca una ficha y las fichas se
+recuperan a ritmo constante, así se permite una ráfaga corta pero no un
+script reservando sin parar. Las cubetas viven en el caché
+de Django: con LocMemCache son memoria del proceso; con un caché compartido
+(Redis, Memcached) valen para todos los procesos. Leer y escribir la cubeta
+no es atómico entre procesos, así que con varios procesos el límite es
+aproximado (puede pasar alguna petición de más, nunca se bloquea de menos).
+
+Sala de espera (settings.AGENDA_SALA_ESPERA, opcional, para los grupos con
+'sala_espera'): los lunes a las 00:00 se abre una semana nueva para reservar
+(ver disponibilidad.semanas_visibles). Durante los primeros minutos cada usuario
+recibe un número la primera vez que intenta reservar y se admiten
+`por_segundo` números por segundo, en orden de llegada. Los demás reciben
+un 429 inmediato con Retry-After en vez de quedar esperando el lock de
+SQLite.
+
+La IP del cliente sale de REMOTE_ADDR, o de X-Forwarded-For si hay proxies
+de confianza delante (settings.LIMITES_PROXIES, ver ip_cliente): detrás de
+nginx REMOTE_ADDR es 127.0.0.1 para todos y la cubeta por IP sería una sola
+para todo el mundo.
+"""
+import datetime
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+# Dentro de un proceso, leer y escribir la cubeta va con lock
+_lock = threading.Lock()
+
+
+def tomar_ficha(clave, capacidad, por_minuto, ahora=None):
+    """
+    Saca una ficha de la cubeta `clave`. Devuelve 0 si había, o los segundos
+    que faltan para que haya una.
+    """
+    ahora = time.time() if ahora is None else ahora
+    por_segundo = por_minuto / 60
+    clave = f'agendamiento:limite:{clave}'
+    with _lock:
+        fichas, ultima = cache.get(clave, (capacidad, ahora))
+        fichas = min(capacidad, fichas + (ahora - ultima) * por_segundo)
+        if fichas < 1:
+            return math.ceil((1 - fichas) / por_segundo)
+        # La cubeta se olvida cuando se habría vuelto a llenar sola
+        cache.set(clave, (fichas - 1, ahora), math.ceil(capacidad / por_segundo) + 1)
+    return 0
+
+
+def ip_cliente(request):
+    """
+    IP del cliente. Con settings.LIMITES_PROXIES = N proxies de confianza
+    delante (nginx = 1), cada uno agrega a X-Forwarded-For la dirección de
+    quien le habló: el cliente es la N-ésima desde la derecha. Lo que está
+    más a la izquierda lo puede inventar el cliente, así que no se usa.
+    """
+    proxies = getattr(settings, 'LIMITES_PROXIES', 0)
+    if proxies:
+        reenviadas = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+        if len(reenviadas) >= proxies:
+            return reenviadas[-proxies]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _cuenta(request):
+    """Nombre de cuenta del formulario de login o registro (resumido: puede traer cualquier cosa)."""
+    nombre = request.POST.get('username', '').strip().lower()
+    return hashlib.sha256(nombre.encode()).hexdigest()[:16] if nombre else None
+
+
+def grupo_de(nombre_url):
+    """El grupo de settings.LIMITES_PETICIONES al que pertenece la vista, o None."""
+    for grupo, regla in getattr(settings, 'LIMITES_PETICIONES', {}).items():
+        if nombre_url in regla['vistas']:
+            return grupo, regla
+    return None, None
+
+
+def revisar_limite(request, usuario, grupo, regla, ahora=None):
+    """Segundos que debe esperar la petición (0 si pasa), revisando las cubetas de la IP, el usuario y la cuenta."""
+    espera = 0
+    if 'ip' in regla:
+        espera = tomar_ficha(f'{grupo}:ip:{ip_cliente(request)}', *regla['ip'], ahora=ahora)
+    if not espera and 'usuario' in regla and usuario.is_authenticated:
+        espera = tomar_ficha(f'{grupo}:usuario:{usuario.pk}', *regla['usuario'], ahora=ahora)
+    if not espera and 'cuenta' in regla and _cuenta(request):
+        espera = tomar_ficha(f'{grupo}:cuenta:{_cuenta(request)}', *regla['cuenta'], ahora=ahora)
+    return espera
+
+
+# -----------------------------------------------------------------
+# SALA DE ESPERA
+# -----------------------------------------------------------------
+
+def apertura_semana(ahora=None):
+    """Cuándo se abrió la última semana para reservar: el lunes de esta semana a las 00:00."""
+    hoy = timezone.localtime(ahora).date()
+    lunes = hoy - datetime.timedelta(days=hoy.weekday())
+    return timezone.make_aware(datetime.datetime.combine(lunes, datetime.time.min))
+
+
+def turno_sala(usuario_id, ahora=None):
+    """
+    Segundos que debe esperar el usuario para entrar (0 si puede reservar).
+    Fuera de los primeros minutos de la apertura siempre es 0.
+    """
+    sala = getattr(settings, 'AGENDA_SALA_ESPERA', None)
+    if not sala:
+        return 0
+    ahora = ahora or timezone.now()
+    apertura = apertura_semana(ahora)
+    transcurrido = (ahora - apertura).total_seconds()
+    if transcurrido >= sala['minutos'] * 60:
+        return 0
+
+    prefijo = f'agendamiento:sala:{apertura.date().isoformat()}'
+    duracion = sala['minutos'] * 60
+    # El número se entrega una sola vez por usuario: quien llegó primero entra primero
+    cache.add(f'{prefijo}:siguiente', 0, duracion)
+    if cache.add(f'{prefijo}:usuario:{usuario_id}', 0, duracion):
+        cache.set(f'{prefijo}:usuario:{usuario_id}', cache.incr(f'{prefijo}:siguiente'), duracion)
+    numero = cache.get(f'{prefijo}:usuario:{usuario_id}', 0)
+    if not numero:
+        # Otra petición del mismo usuario está sacando su número en este momento
+        return 1
+
+    admitidos = sala['por_segundo'] * (transcurrido + 1)
+    if numero <= admitidos:
+        return 0
+    return math.ceil((numero - admitidos) / sala['por_segundo'])
@@ -0,0 +1,174 @@
+"""
+Lista de espera para bloques llenos.
+
+Cada (bloque, fecha) tiene una fila FIFO en ListaEspera. Cuando se cancela
+una reserva, Reserva.delete llama a promover_siguiente() dentro de la misma
+transacción del DELETE: el primero de la fila recibe el cupo directamente,
+sin pasar por OcupacionBloque (el cupo cambia de dueño, no se libera).
+
+Buscar al primero es una lectura por el índice (bloque, fecha, id), así que
+cuesta lo mismo sin importar el largo de la fila. Con cancelaciones
+simultáneas, en un servidor de base de datos cada una bloquea a "su"
+primero (SELECT ... FOR UPDATE SKIP LOCKED); en SQLite las escrituras ya
+van de a una, así que el DELETE de la reserva ordena a las transacciones.
+
+Si el bloque ya empezó, nadie recibe el cupo: se libera como cualquier otro.
+"""
+import datetime
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import disponibilidad, estadisticas, notificaciones
+from .escrituras import escritura
+from .models import BloqueHorario, ListaEspera, Reserva
+from .ocupacion import avisar_cambio, cupos_ocupados, validar_bloque_y_fecha
+
+
+def _ya_empezo(bloque_id, fecha):
+    """True si el bloque ya empezó ese día (solo consulta la hora si la fecha es hoy)."""
+    hoy = timezone.localdate()
+    if fecha != hoy:
+        return fecha < hoy
+    hora = BloqueHorario.objects.filter(id=bloque_id).values_list('hora_inicio', flat=True).first()
+    if hora is None:
+        return True
+    inicio = timezone.make_aware(datetime.datetime.combine(fecha, hora), timezone.get_current_timezone())
+    return inicio <= timezone.now()
+
+
+def promover(bloque_id, fecha, cupos=1):
+    """
+    Entrega hasta `cupos` cupos a los primeros de la fila. Debe llamarse
+    dentro de la transacción que liberó los cupos. Devuelve las reservas
+    creadas (ninguna si el bloque ya empezó).
+    """
+    promovidas = []
+    if _ya_empezo(bloque_id, fecha):
+        return promovidas
+    while len(promovidas) < cupos:
+        primero = (
+            ListaEspera.objects.select_for_update(skip_locked=True)
+            .filter(bloque_id=bloque_id, fecha=fecha)
+            .order_by('id')
+            .first()
+        )
+        if primero is None:
+            break
+
+        # Lo sacamos de la fila; si otra transacción se adelantó, seguimos con el siguiente
+        if not ListaEspera.objects.filter(pk=primero.pk).delete()[0]:
+            continue
+
+        # bulk_create no pasa por Reserva.save: el cupo ya está contado
+        try:
+            with transaction.atomic():
+                promovidas += Reserva.objects.bulk_create(
+                    [Reserva(usuario_id=primero.usuario_id, bloque_id=bloque_id, fecha=fecha)]
+                )
+        except IntegrityError:
+            # Ya tenía una reserva en ese bloque, le toca al siguiente
+            continue
+
+    if promovidas:
+        # Los cupos no cambian, pero sí la grilla de quienes subieron. Para
+        # las estadísticas cuenta como una cancelación y una reserva nueva.
+        estadisticas.sumar({(bloque_id, fecha): (len(promovidas), len(promovidas))})
+        avisar_cambio([(bloque_id, fecha)])
+        notificaciones.al_promover(promovidas)
+    return promovidas
+
+
+def promover_siguiente(bloque_id, fecha):
+    """Da un cupo liberado al primero de la fila. Devuelve True si alguien lo tomó."""
+    return bool(promover(bloque_id, fecha, 1))
+
+
+def promover_grupos(grupos):
+    """
+    Versión para borrados masivos: `grupos` es {(bloque_id, fecha): cupos liberados}.
+
+    Primero busca con una consulta qué grupos tienen fila de espera, y solo
+    en esos promueve. Devuelve {(bloque_id, fecha): promovidos}.
+    """
+    # Los días pasados no se promueven: ni se consultan
+    claves = [clave for clave in grupos if clave[1] >= timezone.localdate()]
+    con_espera = set()
+    for inicio in range(0, len(claves), 200):
+        condicion = Q()
+        for bloque_id, fecha in claves[inicio:inicio + 200]:
+            condicion |= Q(bloque_id=bloque_id, fecha=fecha)
+        con_espera.update(ListaEspera.objects.filter(condicion).values_list('bloque_id', 'fecha').distinct())
+    return {clave: len(promover(*clave, cupos=grupos[clave])) for clave in con_espera}
+
+
+def vaciar(claves):
+    """
+    Borra las filas de espera de varios (bloque_id, fecha), ej. cuando se
+    cancela un bloque por cierre y nadie debe recibir esos cupos. Devuelve
+    cuántas entradas se borraron.
+    """
+    claves = list(claves)
+    borradas = 0
+    for inicio in range(0, len(claves), 200):
+        condicion = Q()
+        for bloque_id, fecha in claves[inicio:inicio + 200]:
+            condicion |= Q(bloque_id=bloque_id, fecha=fecha)
+        borradas += ListaEspera.objects.filter(condicion).delete()[0]
+    if borradas:
+        semanas = {disponibilidad.lunes_de(fecha) for _, fecha in claves}
+
+        def al_confirmar():
+            for lunes in semanas:
+                disponibilidad.subir_version_semana(lunes)
+        transaction.on_commit(al_confirmar)
+    return borradas
+
+
+def unirse(usuario, bloque_id, fecha_str):
+    """Agrega al usuario al final de la fila de un bloque lleno. Lanza ValidationError."""
+    bloque, fecha = validar_bloque_y_fecha(bloque_id, fecha_str)
+
+    def revisar():
+        if Reserva.objects.filter(usuario=usuario, bloque=bloque, fecha=fecha).exists():
+            raise ValidationError(f"Ya tienes una reserva para el {bloque.nombre} el {fecha}.")
+        if cupos_ocupados(bloque.id, fecha) < bloque.capacidad_maxima:
+            raise ValidationError(
+                f"Todavía quedan cupos en el {bloque.nombre} el {fecha}, puedes reservar directamente."
+            )
+
+    # Antes de pedir la escritura (lo normal es que falle aquí) y otra vez
+    # dentro: entre medio alguien pudo cancelar y liberar un cupo que nadie
+    # de la fila recibiría. Con las escrituras de a una (ver escrituras.py)
+    # la segunda revisión ya no cambia hasta el INSERT.
+    revisar()
+    try:
+        with escritura():
+            revisar()
+            entrada = ListaEspera.objects.create(usuario=usuario, bloque=bloque, fecha=fecha)
+    except IntegrityError:
+        raise ValidationError(f"Ya estás en la lista de espera del {bloque.nombre} el {fecha}.")
+
+    transaction.on_commit(lambda: disponibilidad.subir_version_semana(disponibilidad.lunes_de(fecha)))
+    return entrada
+
+
+def salir(usuario, entrada_id):
+    """
+    Saca al usuario de una fila de espera. Devuelve la entrada borrada o None.
+    Va por escritura(), como unirse y promover: si justo lo están promoviendo,
+    espera y después ya no la encuentra. Lanza ValidationError si no hay turno.
+    """
+    with escritura():
+        entrada = ListaEspera.objects.select_related('bloque').filter(id=entrada_id, usuario=usuario).first()
+        if entrada is not None:
+            entrada.delete()
+            transaction.on_commit(lambda: disponibilidad.subir_version_semana(disponibilidad.lunes_de(entrada.fecha)))
+    return entrada
+
+
+def posicion(entrada):
+    """Lugar (1, 2, ...) de una entrada en su fila."""
+    return ListaEspera.objects.filter(bloque_id=entrada.bloque_id, fecha=entrada.fecha, id__lte=entrada.id).count()
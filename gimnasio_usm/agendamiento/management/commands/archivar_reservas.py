@@ -0,0 +1,51 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from agendamiento import archivo
+from agendamiento.disponibilidad import lunes_de
+from agendamiento.models import Reserva
+
+
+class Command(BaseCommand):
+    help = ('Mueve las reservas de semanas pasadas a ReservaArchivada (por lotes, se puede '
+            'correr con el sitio funcionando) y actualiza el ResumenDiario de esos días.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--semanas', type=int, default=None,
+                            help='Semanas pasadas que se quedan en Reserva (por defecto settings.ARCHIVO_SEMANAS_PASADAS).')
+        parser.add_argument('--lote', type=int, default=500, help='Reservas por transacción.')
+        parser.add_argument('--pausa', type=float, default=0.0,
+                            help='Segundos de espera entre lotes, para dejar pasar las reservas del sitio.')
+        parser.add_argument('--simular', action='store_true', help='Solo muestra cuántas reservas se moverían.')
+
+    def handle(self, *args, **options):
+        if options['semanas'] is not None and options['semanas'] < 0:
+            raise CommandError("--semanas no puede ser negativo: se archivarían reservas futuras.")
+        hasta = archivo.horizonte(options['semanas'])
+        if hasta > lunes_de(timezone.localdate()):
+            raise CommandError("El horizonte no puede ser posterior al lunes de esta semana.")
+
+        pendientes = Reserva.objects.filter(fecha__lt=hasta).count()
+        self.stdout.write(f"Reservas anteriores al {hasta}: {pendientes}")
+        if options['simular'] or not pendientes:
+            return
+
+        movidas = 0
+        inicio = time.monotonic()
+        while True:
+            cantidad = archivo.archivar_lote(hasta, options['lote'])
+            if not cantidad:
+                break
+            movidas += cantidad
+            self.stdout.write(f"  {movidas}/{pendientes} archivadas...")
+            if options['pausa']:
+                time.sleep(options['pausa'])
+
+        contadores, esperas = archivo.limpiar_dias_pasados(hasta)
+        segundos = datetime.timedelta(seconds=round(time.monotonic() - inicio))
+        self.stdout.write(self.style.SUCCESS(
+            f"¡Listo! {movidas} reservas archivadas en {segundos}. "
+            f"Borrados {contadores} contadores y {esperas} entradas de lista de espera de días pasados."
+        ))
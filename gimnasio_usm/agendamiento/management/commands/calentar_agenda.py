@@ -0,0 +1,23 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from agendamiento import disponibilidad
+
+
+class Command(BaseCommand):
+    help = ('Deja en caché la estructura y los cupos de las semanas que se pueden reservar, '
+            'para que la primera visita a cada semana no vaya a la base de datos. '
+            'Pensado para correr con cron, ej. cada 5 minutos (el TTL de las celdas).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--semanas', type=int, default=None,
+                            help='Cuántas semanas desde la actual (por defecto todas las visibles).')
+
+    def handle(self, *args, **options):
+        primera, ultima = disponibilidad.semanas_visibles()
+        cantidad = options['semanas'] or (ultima - primera).days // 7 + 1
+        celdas = disponibilidad.calentar_semanas(primera, cantidad)
+        hasta = primera + datetime.timedelta(weeks=cantidad - 1)
+        self.stdout.write(self.style.SUCCESS(
+            f"¡Listo! {celdas} celdas en caché, semanas del {primera} al {hasta}."
+        ))
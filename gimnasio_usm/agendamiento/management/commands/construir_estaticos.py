@@ -0,0 +1,45 @@
+import shutil
+import subprocess
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from agendamiento.estaticos import VENDOR
+
+
+class Command(BaseCommand):
+    help = ('Genera static/css/app.css con Tailwind (solo las clases que usan las plantillas), copia '
+            'Chart.js y la fuente Inter a static/vendor/ y corre collectstatic, que con DEBUG = False '
+            'agrega el hash a los nombres y deja versiones comprimidas. Antes: npm install.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sin-collectstatic', action='store_true',
+                            help='Solo genera los archivos en static/ (para probarlos con runserver).')
+
+    def handle(self, *args, **options):
+        base = settings.BASE_DIR
+        modulos = base / 'node_modules'
+        if not modulos.is_dir():
+            raise CommandError(f"No está {modulos}. Instala las herramientas primero: npm install")
+        static = settings.STATICFILES_DIRS[0]
+
+        try:
+            subprocess.run(
+                [str(modulos / '.bin' / 'tailwindcss'), '-c', 'tailwind.config.js',
+                 '-i', 'estilos/app.css', '-o', str(static / 'css' / 'app.css'), '--minify'],
+                cwd=base, check=True,
+            )
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise CommandError(f"Falló Tailwind: {e}")
+        self.stdout.write(f"css/app.css: {(static / 'css' / 'app.css').stat().st_size / 1024:.1f} KB")
+
+        for destino, origen in VENDOR.items():
+            if not (modulos / origen).is_file():
+                raise CommandError(f"Falta node_modules/{origen}: revisa package.json y corre npm install")
+            (static / destino).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(modulos / origen, static / destino)
+        self.stdout.write(f"{len(VENDOR)} archivos copiados a static/vendor/")
+
+        if not options['sin_collectstatic']:
+            call_command('collectstatic', interactive=False, verbosity=options['verbosity'])
+        self.stdout.write(self.style.SUCCESS("¡Listo! Reinicia el servidor para que las páginas usen los archivos nuevos."))
@@ -1,56 +1,46 @@
-import datetime
-from django.core.management.base import BaseCommand
-from agendamiento.models import BloqueHorario
+from pathlib import Path
 
-class Command(BaseCommand):
-    help = 'Crea los 10 bloques horarios del gimnasio con sus reglas de recreos y almuerzo.'
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from agendamiento import horario
 
-    def handle(self, *args, **options):
-        self.stdout.write("Eliminando bloques horarios antiguos...")
-        BloqueHorario.objects.all().delete()
+class Command(BaseCommand):
+    help = ('Sincroniza los bloques horarios y los cierres con el archivo de horario '
+            '(settings.HORARIO_GIMNASIO). Solo aplica las diferencias y nunca borra reservas.')
 
-        self.stdout.write("Creando nuevos bloques horarios...")
-        
-        # 10 bloques dobles (20 bloques en total)
-        total_bloques_dobles = 10
-        duracion_bloque_doble = datetime.timedelta(minutes=70) # 35 min * 2
-        duracion_recreo = datetime.timedelta(minutes=15)
-        hora_almuerzo = datetime.timedelta(hours=1)
-        
-        # Empezamos a las 8:15 AM
-        hora_actual = datetime.time(8, 15)
-        
-        # Usamos una fecha ficticia para poder sumar timedeltas
-        fecha_ficticia = datetime.date.today()
+    def add_arguments(self, parser):
+        parser.add_argument('--archivo', type=Path, help='Otro archivo de horario en vez del de settings.')
+        parser.add_argument('--simular', action='store_true', help='Muestra los cambios sin aplicarlos.')
+        parser.add_argument('--forzar', action='store_true',
+                            help='Aplica el horario aunque deje reservas futuras fuera de él (no se cancelan).')
 
-        for i in range(total_bloques_dobles):
-            # Calculamos inicio y fin
-            inicio_dt = datetime.datetime.combine(fecha_ficticia, hora_actual)
-            fin_dt = inicio_dt + duracion_bloque_doble
-            
-            nombre_bloque = f"Bloque {i*2 + 1}-{i*2 + 2}"
+    def handle(self, *args, **options):
+        try:
+            bloques, cierres = horario.cargar_definicion(options['archivo'])
+        except ValidationError as e:
+            raise CommandError('. '.join(e.messages))
 
-            # Creamos el bloque en la BD
-            bloque = BloqueHorario.objects.create(
-                nombre=nombre_bloque,
-                hora_inicio=inicio_dt.time(),
-                hora_fin=fin_dt.time()
-            )
-            self.stdout.write(self.style.SUCCESS(f"Creado: {bloque}"))
+        self.stdout.write(f"Horario: {len(bloques)} bloques y {len(cierres)} cierres.")
+        try:
+            cambios = horario.sincronizar(bloques, cierres, simular=options['simular'], forzar=options['forzar'])
+        except ValidationError as e:
+            raise CommandError('\n'.join(e.messages))
 
-            # Actualizamos la hora_actual para el siguiente bloque
-            
-            # Caso especial: Bloque 7-8 (índice 3)
-            # i=0 (Bloque 1-2)
-            # i=1 (Bloque 3-4)
-            # i=2 (Bloque 5-6)
-            # i=3 (Bloque 7-8) -> Este es el bloque antes del almuerzo
-            if i == 3:
-                self.stdout.write(self.style.NOTICE("-> Recreo de Almuerzo (1 hora)"))
-                siguiente_inicio_dt = fin_dt + hora_almuerzo
-            else:
-                siguiente_inicio_dt = fin_dt + duracion_recreo
-            
-            hora_actual = siguiente_inicio_dt.time()
+        for nombre in cambios['creados']:
+            self.stdout.write(self.style.SUCCESS(f"Creado: {nombre}"))
+        for nombre in cambios['actualizados']:
+            self.stdout.write(self.style.SUCCESS(f"Actualizado: {nombre}"))
+        for nombre in cambios['desactivados']:
+            self.stdout.write(self.style.WARNING(f"Desactivado (ya no está en el horario): {nombre}"))
+        self.stdout.write(f"Cierres nuevos: {cambios['cierres_nuevos']}, cierres quitados: {cambios['cierres_borrados']}")
+        for linea in horario.describir_afectadas(cambios['afectadas']):
+            self.stdout.write(self.style.WARNING(f"{linea}; no se cancelan."))
 
-        self.stdout.write(self.style.SUCCESS("¡Todos los bloques han sido creados!"))
+        if options['simular']:
+            self.stdout.write(self.style.NOTICE("Simulación: no se guardó ningún cambio."))
+            return
+        if cambios['reservas_en_cierres']:
+            self.stdout.write(self.style.WARNING(
+                f"Hay {cambios['reservas_en_cierres']} reservas en días o bloques cerrados; no se cancelaron."
+            ))
+        self.stdout.write(self.style.SUCCESS("¡Horario sincronizado!"))
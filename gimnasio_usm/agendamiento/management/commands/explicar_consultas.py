@@ -0,0 +1,117 @@
+import datetime
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+from agendamiento.models import BloqueHorario, ListaEspera, OcupacionBloque, Reserva
+
+
+def consultas_frecuentes(bloque_id, usuario_id, fecha):
+    """
+    [(nombre, queryset, recorre_todo)] con las consultas que más se ejecutan.
+
+    `recorre_todo` marca las que leen toda la tabla a propósito (ej.
+    recalcular_ocupacion): para ellas un SCAN no es un problema.
+    """
+    lunes = fecha - datetime.timedelta(days=fecha.weekday())
+    dias = [lunes + datetime.timedelta(days=i) for i in range(5)]
+    primero_del_mes = fecha.replace(day=1)
+    siguiente_mes = (primero_del_mes + datetime.timedelta(days=32)).replace(day=1)
+    return [
+        ('Grilla: cupos de la semana',
+         OcupacionBloque.objects.filter(fecha__in=dias).values('bloque_id', 'fecha', 'ocupados'), False),
+        ('Grilla: reservas del usuario en la semana',
+         Reserva.objects.filter(usuario_id=usuario_id, fecha__in=dias).values_list('id', 'bloque_id', 'fecha'), False),
+        ('Cupos de un bloque en un día (reservar, clean)',
+         OcupacionBloque.objects.filter(bloque_id=bloque_id, fecha=fecha).values_list('ocupados'), False),
+        ('Reservas de un bloque en un día',
+         Reserva.objects.filter(bloque_id=bloque_id, fecha=fecha).values_list('id'), False),
+        ('Reservas de la semana agrupadas por bloque',
+         Reserva.objects.filter(fecha__in=dias).values('bloque').annotate(total=Count('id')).order_by(), False),
+        ('Admin: reservas del mes (date_hierarchy)',
+         Reserva.objects.filter(fecha__gte=primero_del_mes, fecha__lt=siguiente_mes).values_list('id'), False),
+        ('Admin: días con reservas del mes (date_hierarchy)',
+         Reserva.objects.filter(fecha__gte=primero_del_mes, fecha__lt=siguiente_mes).dates('fecha', 'day'), False),
+        ('Lista de espera: primero de la fila',
+         ListaEspera.objects.filter(bloque_id=bloque_id, fecha=fecha).order_by('id').values_list('id')[:1], False),
+        ('recalcular_ocupacion: conteo por bloque y fecha',
+         Reserva.objects.values('bloque', 'fecha').annotate(conteo=Count('id')).order_by(), True),
+    ]
+
+
+def revisar_plan(plan):
+    """
+    Devuelve (recorridos_completos, avisos) leyendo el texto del plan.
+
+    Entiende el EXPLAIN QUERY PLAN de SQLite ("SCAN tabla" sin índice) y el
+    EXPLAIN de PostgreSQL ("Seq Scan").
+    """
+    completos, avisos = [], []
+    for linea in plan.splitlines():
+        texto = linea.strip()
+        if 'Seq Scan' in texto or (' SCAN ' in f' {texto} ' and 'USING' not in texto and 'CONSTANT ROW' not in texto):
+            completos.append(texto)
+        elif 'SCAN' in texto and 'USING' in texto:
+            avisos.append(f"recorre un índice completo: {texto}")
+        elif 'TEMP B-TREE' in texto:
+            avisos.append(f"ordena en memoria: {texto}")
+    return completos, avisos
+
+
+class Command(BaseCommand):
+    help = ('Muestra el plan (EXPLAIN QUERY PLAN en SQLite) de las consultas más usadas de '
+            'agendamiento y avisa cuáles recorren toda la tabla.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sql', action='store_true', help='Muestra también el SQL de cada consulta.')
+        parser.add_argument('--analizar', action='store_true',
+                            help='Ejecuta ANALYZE antes (SQLite) para que el plan use estadísticas al día.')
+        parser.add_argument('--fallar', action='store_true',
+                            help='Termina con error si alguna consulta recorre la tabla completa (útil en CI).')
+
+    def handle(self, *args, **options):
+        # Los valores no cambian el plan, pero usamos ids reales si existen
+        bloque_id = BloqueHorario.objects.values_list('id', flat=True).first() or 1
+        usuario_id = User.objects.values_list('id', flat=True).first() or 1
+        fecha = timezone.localdate()
+
+        if options['analizar'] and connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        self.stdout.write(f"Base de datos: {connection.vendor}")
+        problemas = []
+        for nombre, consulta, recorre_todo in consultas_frecuentes(bloque_id, usuario_id, fecha):
+            plan = consulta.explain()
+            completos, avisos = revisar_plan(plan)
+
+            self.stdout.write("")
+            self.stdout.write(self.style.MIGRATE_HEADING(nombre))
+            if options['sql']:
+                self.stdout.write(f"  {consulta.query}")
+            for linea in plan.splitlines():
+                self.stdout.write(f"    {linea}")
+
+            if completos and not recorre_todo:
+                problemas.append(nombre)
+                self.stdout.write(self.style.ERROR(f"  Recorre la tabla completa: {'; '.join(completos)}"))
+            elif completos:
+                self.stdout.write(self.style.NOTICE("  Lee toda la tabla (esperado para esta consulta)."))
+            else:
+                self.stdout.write(self.style.SUCCESS("  Usa índices."))
+            for aviso in avisos:
+                self.stdout.write(self.style.WARNING(f"  Aviso: {aviso}"))
+
+        self.stdout.write("")
+        if problemas:
+            mensaje = f"{len(problemas)} consultas recorren la tabla completa: {', '.join(problemas)}"
+            if connection.vendor == 'sqlite' and not options['analizar']:
+                # Con estadísticas de cuando la tabla era chica SQLite prefiere recorrerla
+                mensaje += " (si la tabla creció desde el último ANALYZE, prueba con --analizar)"
+            if options['fallar']:
+                raise CommandError(mensaje)
+            self.stdout.write(self.style.ERROR(mensaje))
+        else:
+            self.stdout.write(self.style.SUCCESS("Ninguna consulta frecuente recorre la tabla completa."))
@@ -0,0 +1,30 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from agendamiento import encuesta
+
+class Command(BaseCommand):
+    help = ('Importa respuestas individuales de la encuesta desde un .csv o .xlsx '
+            '(una fila por persona). Las filas del principio que ya se importaron de la '
+            'misma fuente se saltan sin procesarlas; las demás se comparan por su contenido.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', type=Path)
+        parser.add_argument('--lote', type=int, default=1000,
+                            help='Cantidad de filas que se procesan por transacción.')
+        parser.add_argument('--fuente', help='Nombre con que se guarda el origen (por defecto, el nombre del archivo).')
+
+    def handle(self, *args, **options):
+        ruta = options['archivo']
+        if not ruta.exists():
+            raise CommandError(f"No existe el archivo {ruta}")
+
+        self.stdout.write(f"Importando respuestas desde {ruta}...")
+        try:
+            nuevas, repetidas = encuesta.importar_archivo(ruta, options['fuente'], tam_lote=options['lote'])
+        except ImportError as e:
+            raise CommandError(str(e))
+        encuesta.refrescar()
+        self.stdout.write(self.style.SUCCESS(
+            f"¡Listo! {nuevas} respuestas nuevas, {repetidas} ya estaban importadas."
+        ))
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import os
+import secrets
+import tempfile
+import time
+from urllib.parse import urlencode
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import include, path, reverse
+from agendamiento import views, vistas_async
+from agendamiento.management.commands.prueba_carga import percentil
+from agendamiento.management.commands.prueba_escrituras import celdas_libres, copiar_base, usar_base
+from agendamiento.urls import rutas
+
+PREFIJO = 'asincrona_'
+MODOS = {'sync': views, 'async': vistas_async}
+
+
+def urlconf(agenda):
+    """ROOT_URLCONF con las vistas de reservar de `agenda` (views o vistas_async)."""
+    return type('Urls', (), {'urlpatterns': [
+        path('accounts/', include('django.contrib.auth.urls')),
+        path('', include(rutas(agenda))),
+    ]})
+
+
+class Command(BaseCommand):
+    help = ('Compara las vistas de reservar síncronas (views.py) con las asíncronas (vistas_async.py) '
+            'bajo ASGI: muchos clientes a la vez ven la grilla, reservan y cancelan contra el '
+            'ASGIHandler de Django, como lo llamaría uvicorn. Trabaja sobre una copia temporal de la '
+            'base de datos: no modifica la real.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clientes', type=int, default=50, help='Clientes haciendo peticiones a la vez.')
+        parser.add_argument('--rondas', type=int, default=5,
+                            help='Rondas por cliente (cada una: agendar.html, api_agenda, reservar y cancelar).')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("Esta prueba es solo para SQLite.")
+        configuracion = connections.settings['default']
+        original = {'NAME': configuracion['NAME'], 'OPTIONS': configuracion['OPTIONS']}
+        resultados = {}
+        try:
+            with tempfile.TemporaryDirectory() as carpeta:
+                copia = os.path.join(carpeta, 'prueba.sqlite3')
+                copiar_base(original['NAME'], copia)
+                usar_base(configuracion, copia, original['OPTIONS'])
+                clientes = self._preparar(options['clientes'])
+                # Sin límites de peticiones: todos los clientes salen de la misma IP
+                with override_settings(LIMITES_PETICIONES={}, AGENDA_SALA_ESPERA=None):
+                    for nombre, agenda in MODOS.items():
+                        with override_settings(ROOT_URLCONF=urlconf(agenda)):
+                            cache.clear()
+                            resultados[nombre] = asyncio.run(self._correr(clientes, options['rondas']))
+                        self._imprimir(nombre, resultados[nombre])
+                connections.close_all()
+        finally:
+            usar_base(configuracion, original['NAME'], original['OPTIONS'])
+
+        base = resultados['sync']['por_segundo']
+        cambio = f"{resultados['async']['por_segundo'] / base:.2f}x" if base else 'n/a'
+        self.stdout.write(f"\nasync respecto de sync: {cambio} peticiones/s")
+
+    # -----------------------------------------------------------------
+    # Preparación
+    # -----------------------------------------------------------------
+    def _preparar(self, cantidad):
+        """Por cliente: (cookies de sesión y CSRF, celda libre que va a reservar y cancelar)."""
+        User.objects.bulk_create([User(username=f'{PREFIJO}{i}', password='!') for i in range(cantidad)])
+        usuarios = User.objects.filter(username__startswith=PREFIJO).order_by('id')
+        clientes = []
+        for usuario, celda in zip(usuarios, celdas_libres(cantidad)):
+            sesion = Client()
+            sesion.force_login(usuario)
+            token = secrets.token_hex(16)  # Secreto CSRF de 32 caracteres, va en la cookie y en el header
+            clientes.append({
+                'cookie': f"sessionid={sesion.cookies['sessionid'].value}; csrftoken={token}",
+                'csrf': token,
+                'celda': celda,
+            })
+        return clientes
+
+    # -----------------------------------------------------------------
+    # Medición
+    # -----------------------------------------------------------------
+    async def _correr(self, clientes, rondas):
+        # Un ASGIHandler nuevo: carga el middleware en modo asíncrono, como en producción
+        aplicacion = ASGIHandler()
+        tiempos, errores = {}, []
+
+        async def pedir(cliente, metodo, ruta, datos=None, vista=None):
+            cuerpo = urlencode(datos or {}).encode()
+            ruta, _, consulta = ruta.partition('?')
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+                'method': metodo, 'scheme': 'http', 'path': ruta, 'raw_path': ruta.encode(),
+                'query_string': consulta.encode(), 'root_path': '',
+                'client': ('127.0.0.1', 50000), 'server': ('localhost', 80),
+                'headers': [
+                    (b'host', b'localhost'),
+                    (b'cookie', cliente['cookie'].encode()),
+                    (b'x-csrftoken', cliente['csrf'].encode()),
+                    (b'content-type', b'application/x-www-form-urlencoded'),
+                    (b'content-length', str(len(cuerpo)).encode()),
+                ],
+            }
+            mensajes = [{'type': 'http.request', 'body': cuerpo, 'more_body': False}]
+            respuesta = {'cuerpo': b''}
+
+            async def recibir():
+                if mensajes:
+                    return mensajes.pop()
+                # El cliente no se desconecta: Django cancela esta espera al terminar
+                await asyncio.Future()
+
+            async def enviar(mensaje):
+                if mensaje['type'] == 'http.response.start':
+                    respuesta['estado'] = mensaje['status']
+                else:
+                    respuesta['cuerpo'] += mensaje.get('body', b'')
+
+            inicio = time.perf_counter()
+            await aplicacion(scope, recibir, enviar)
+            tiempos.setdefault(vista, []).append((time.perf_counter() - inicio) * 1000)
+            if respuesta['estado'] >= 400:
+                errores.append(f"{vista}: {respuesta['estado']} {respuesta['cuerpo'][:200]!r}")
+            return respuesta
+
+        async def cliente_haciendo(cliente):
+            bloque_id, fecha = cliente['celda']
+            semana = f"?semana={fecha.isoformat()}"
+            for _ in range(rondas):
+                await pedir(cliente, 'GET', reverse('vista_agendamiento') + semana, vista='vista_agendamiento')
+                await pedir(cliente, 'GET', reverse('api_agenda') + semana, vista='api_agenda')
+                reserva = await pedir(cliente, 'POST', reverse('api_reservar'),
+                                      {'bloque_id': bloque_id, 'fecha': fecha.isoformat()}, vista='api_reservar')
+                if reserva['estado'] == 201:
+                    reserva_id = json.loads(reserva['cuerpo'])['reserva_id']
+                    await pedir(cliente, 'POST', reverse('api_cancelar', args=[reserva_id]), vista='api_cancelar')
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(cliente_haciendo(cliente) for cliente in clientes))
+        duracion = time.perf_counter() - inicio
+
+        todas = sorted(t for lista in tiempos.values() for t in lista)
+        return {
+            'peticiones': len(todas),
+            'duracion_s': duracion,
+            'por_segundo': len(todas) / duracion if duracion else 0,
+            'p50_ms': percentil(todas, 50),
+            'p99_ms': percentil(todas, 99),
+            'por_vista': {vista: percentil(sorted(lista), 50) for vista, lista in tiempos.items()},
+            'errores': errores,
+        }
+
+    def _imprimir(self, nombre, datos):
+        self.stdout.write(self.style.SUCCESS(f"\n{nombre}"))
+        self.stdout.write(
+            f"  {datos['peticiones']} peticiones en {datos['duracion_s']:.2f} s ({datos['por_segundo']:.1f}/s), "
+            f"p50 {datos['p50_ms']:.1f} ms, p99 {datos['p99_ms']:.1f} ms"
+        )
+        for vista, p50 in datos['por_vista'].items():
+            self.stdout.write(f"  {vista:<20} p50 {p50:.1f} ms")
+        if datos['errores']:
+            self.stdout.write(self.style.ERROR(f"  {len(datos['errores'])} errores, el primero: {datos['errores'][0]}"))
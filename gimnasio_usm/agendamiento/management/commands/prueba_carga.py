@@ -0,0 +1,323 @@
+import datetime
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Count, F
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from agendamiento.models import BloqueHorario, OcupacionBloque, Reserva
+from agendamiento.ocupacion import recalcular_ocupacion
+
+PREFIJO = 'carga_'
+
+# Operaciones que se simulan y la URL que usan
+OPERACIONES = ('grilla', 'api_grilla', 'reservar', 'cancelar')
+
+
+def percentil(valores, p):
+    """Percentil por rango más cercano (valores ya ordenados)."""
+    if not valores:
+        return 0.0
+    indice = max(0, min(len(valores) - 1, round(p / 100 * len(valores)) - 1))
+    return valores[indice]
+
+
+class Command(BaseCommand):
+    help = ('Simula la apertura de una semana: crea usuarios y reservas de prueba y lanza '
+            'hilos que reservan, cancelan y consultan la grilla a la vez. Reporta rendimiento, '
+            'latencias, consultas por vista y cupos sobrevendidos. Trabaja sobre una copia '
+            'temporal de la base de datos, sin límites de peticiones y con un caché propio: '
+            'no modifica la real.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuarios', type=int, default=200, help='Usuarios de prueba a crear.')
+        parser.add_argument('--semanas', type=int, default=4, help='Semanas de reservas previas a sembrar.')
+        parser.add_argument('--hilos', type=int, default=16, help='Clientes concurrentes.')
+        parser.add_argument('--operaciones', type=int, default=2000, help='Operaciones totales a ejecutar.')
+        parser.add_argument('--mezcla', default='grilla=30,api_grilla=20,reservar=40,cancelar=10',
+                            help='Peso de cada operación (grilla, api_grilla, reservar, cancelar).')
+        parser.add_argument('--semilla', type=int, default=1)
+        parser.add_argument('--json', type=Path, help='Guarda los resultados en este archivo.')
+        parser.add_argument('--comparar', type=Path, help='Compara con los resultados guardados de una corrida anterior.')
+        parser.add_argument('--limpiar', action='store_true',
+                            help='Borra de la base real los usuarios y reservas de prueba que dejaron versiones '
+                                 'anteriores de este comando (que no usaban una copia) y termina.')
+
+    def handle(self, *args, **options):
+        from agendamiento.management.commands.prueba_escrituras import copiar_base, usar_base
+
+        if options['limpiar']:
+            self._limpiar()
+            return
+        if connection.vendor != 'sqlite':
+            raise CommandError("Esta prueba es solo para SQLite.")
+        if not BloqueHorario.objects.exists():
+            raise CommandError("No hay bloques horarios. Ejecuta primero: python manage.py crear_bloques")
+
+        configuracion = connections.settings['default']
+        original = {'NAME': configuracion['NAME'], 'OPTIONS': configuracion['OPTIONS']}
+        try:
+            with tempfile.TemporaryDirectory() as carpeta:
+                # La base en memoria de las pruebas ya es desechable (y cerrarla la borraría)
+                if not connection.is_in_memory_db():
+                    copia = os.path.join(carpeta, 'prueba.sqlite3')
+                    copiar_base(original['NAME'], copia)
+                    usar_base(configuracion, copia, original['OPTIONS'])
+                # Todos los clientes salen de la misma IP: sin límites de peticiones. Con un
+                # caché compartido (Redis) la grilla de la copia no debe llegar al servidor real.
+                with override_settings(
+                    LIMITES_PETICIONES={}, AGENDA_SALA_ESPERA=None,
+                    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'prueba-carga'}},
+                ):
+                    resultados = self._correr(options)
+                connections.close_all()
+        finally:
+            usar_base(configuracion, original['NAME'], original['OPTIONS'])
+
+        self._imprimir(resultados)
+        if options['comparar']:
+            self._comparar(json.loads(options['comparar'].read_text()), resultados)
+        if options['json']:
+            options['json'].write_text(json.dumps(resultados, indent=2, ensure_ascii=False))
+            self.stdout.write(f"Resultados guardados en {options['json']}")
+
+    def _correr(self, options):
+        bloques = list(BloqueHorario.objects.all())
+        random.seed(options['semilla'])
+        mezcla = self._leer_mezcla(options['mezcla'])
+        usuarios = self._sembrar(bloques, options['usuarios'], options['semanas'])
+
+        # La "semana que abre": la próxima
+        hoy = timezone.localdate()
+        lunes_objetivo = hoy - datetime.timedelta(days=hoy.weekday()) + datetime.timedelta(weeks=1)
+        fechas_objetivo = [lunes_objetivo + datetime.timedelta(days=i) for i in range(5)]
+
+        self.stdout.write(f"Iniciando sesión de {min(len(usuarios), options['hilos'] * 8)} clientes...")
+        clientes = []
+        for usuario in random.sample(usuarios, min(len(usuarios), options['hilos'] * 8)):
+            cliente = Client(HTTP_HOST='localhost', raise_request_exception=False)
+            cliente.force_login(usuario)
+            clientes.append({'cliente': cliente, 'reservas': [], 'lock': threading.Lock()})
+
+        mediciones = {op: [] for op in OPERACIONES}
+        lock_mediciones = threading.Lock()
+        pendientes = iter(range(options['operaciones']))
+        lock_pendientes = threading.Lock()
+
+        def trabajador(numero):
+            azar = random.Random(options['semilla'] * 1000 + numero)
+            while True:
+                with lock_pendientes:
+                    if next(pendientes, None) is None:
+                        break
+                operacion = azar.choices(list(mezcla), weights=list(mezcla.values()))[0]
+                datos = azar.choice(clientes)
+                with datos['lock']:
+                    medicion = self._ejecutar(operacion, datos, azar, bloques, fechas_objetivo, lunes_objetivo)
+                with lock_mediciones:
+                    mediciones[operacion].append(medicion)
+            connection.close()
+
+        self.stdout.write(f"Ejecutando {options['operaciones']} operaciones con {options['hilos']} hilos...")
+        # Los 409 de reservas llenas son esperables: no los mostramos como advertencias
+        registro = logging.getLogger('django.request')
+        nivel_anterior = registro.level
+        registro.setLevel(logging.ERROR)
+        inicio = time.perf_counter()
+        hilos = [threading.Thread(target=trabajador, args=(i,)) for i in range(options['hilos'])]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        duracion = time.perf_counter() - inicio
+        registro.setLevel(nivel_anterior)
+
+        resultados = self._resumir(mediciones, duracion)
+        resultados['sobreventas'] = self._sobreventas()
+        resultados['contadores_descuadrados'] = self._contadores_descuadrados()
+        resultados['configuracion'] = {
+            clave: options[clave] for clave in ('usuarios', 'semanas', 'hilos', 'operaciones', 'mezcla', 'semilla')
+        }
+        return resultados
+
+    # -----------------------------------------------------------------
+    # Preparación
+    # -----------------------------------------------------------------
+    def _leer_mezcla(self, texto):
+        mezcla = {}
+        for parte in texto.split(','):
+            nombre, _, peso = parte.partition('=')
+            nombre = nombre.strip()
+            if nombre not in OPERACIONES:
+                raise CommandError(f"Operación desconocida en --mezcla: {nombre}")
+            mezcla[nombre] = float(peso or 1)
+        return mezcla
+
+    def _sembrar(self, bloques, cantidad, semanas):
+        existentes = User.objects.filter(username__startswith=PREFIJO).count()
+        if existentes < cantidad:
+            self.stdout.write(f"Creando {cantidad - existentes} usuarios de prueba...")
+            User.objects.bulk_create(
+                [User(username=f'{PREFIJO}{i}', password='!') for i in range(existentes, cantidad)],
+                batch_size=1000,
+            )
+        usuarios = list(User.objects.filter(username__startswith=PREFIJO).order_by('id')[:cantidad])
+
+        # Reservas de semanas pasadas, para que las tablas no estén vacías
+        hoy = timezone.localdate()
+        lunes = hoy - datetime.timedelta(days=hoy.weekday())
+        reservas = []
+        for semana in range(1, semanas + 1):
+            for dia in range(5):
+                fecha = lunes - datetime.timedelta(weeks=semana) + datetime.timedelta(days=dia)
+                for bloque in bloques:
+                    for usuario in random.sample(usuarios, min(len(usuarios), bloque.capacidad_maxima)):
+                        reservas.append(Reserva(usuario=usuario, bloque=bloque, fecha=fecha))
+        if reservas:
+            self.stdout.write(f"Sembrando {len(reservas)} reservas de {semanas} semanas anteriores...")
+            Reserva.objects.bulk_create(reservas, batch_size=1000, ignore_conflicts=True)
+            # bulk_create no pasa por Reserva.save: rehacemos los contadores
+            recalcular_ocupacion()
+        return usuarios
+
+    def _limpiar(self):
+        reservas, _ = Reserva.objects.filter(usuario__username__startswith=PREFIJO).delete()
+        usuarios, _ = User.objects.filter(username__startswith=PREFIJO).delete()
+        recalcular_ocupacion()
+        self.stdout.write(self.style.SUCCESS(f"Eliminadas {reservas} reservas y los usuarios de prueba ({usuarios} filas)."))
+
+    # -----------------------------------------------------------------
+    # Operaciones
+    # -----------------------------------------------------------------
+    def _ejecutar(self, operacion, datos, azar, bloques, fechas, lunes):
+        cliente = datos['cliente']
+        if operacion == 'grilla':
+            peticion = lambda: cliente.get('/agendar/')
+        elif operacion == 'api_grilla':
+            peticion = lambda: cliente.get('/api/agenda/', {'semana': lunes.isoformat()})
+        elif operacion == 'reservar':
+            bloque = azar.choice(bloques)
+            fecha = azar.choice(fechas)
+            peticion = lambda: cliente.post('/api/reservas/', {'bloque_id': bloque.id, 'fecha': fecha.isoformat()})
+        elif datos['reservas']:
+            reserva_id = datos['reservas'].pop(azar.randrange(len(datos['reservas'])))
+            peticion = lambda: cliente.post(f'/api/reservas/{reserva_id}/cancelar/')
+        else:
+            # Nada que cancelar: se mide una consulta de la grilla
+            peticion = lambda: cliente.get('/api/agenda/', {'semana': lunes.isoformat()})
+
+        with CaptureQueriesContext(connection) as consultas:
+            inicio = time.perf_counter()
+            respuesta = peticion()
+            duracion = time.perf_counter() - inicio
+
+        if operacion == 'reservar' and respuesta.status_code == 201:
+            datos['reservas'].append(respuesta.json()['reserva_id'])
+        return {'segundos': duracion, 'estado': respuesta.status_code, 'consultas': len(consultas)}
+
+    # -----------------------------------------------------------------
+    # Resultados
+    # -----------------------------------------------------------------
+    def _resumir(self, mediciones, duracion):
+        total = sum(len(m) for m in mediciones.values())
+        resumen = {'duracion_s': duracion, 'operaciones': total, 'ops_por_segundo': total / duracion if duracion else 0}
+        vistas = {}
+        for operacion, lista in mediciones.items():
+            if not lista:
+                continue
+            tiempos = sorted(m['segundos'] * 1000 for m in lista)
+            estados = {}
+            for m in lista:
+                estados[str(m['estado'])] = estados.get(str(m['estado']), 0) + 1
+            vistas[operacion] = {
+                'cantidad': len(lista),
+                'p50_ms': percentil(tiempos, 50),
+                'p95_ms': percentil(tiempos, 95),
+                'p99_ms': percentil(tiempos, 99),
+                'max_ms': tiempos[-1],
+                'consultas_promedio': sum(m['consultas'] for m in lista) / len(lista),
+                'consultas_max': max(m['consultas'] for m in lista),
+                'estados': estados,
+                'errores_5xx': sum(1 for m in lista if m['estado'] >= 500),
+            }
+        resumen['vistas'] = vistas
+        return resumen
+
+    def _sobreventas(self):
+        """(bloque, fecha) con más reservas que la capacidad del bloque."""
+        return [
+            {'bloque': c['bloque__nombre'], 'fecha': c['fecha'].isoformat(), 'reservas': c['total'], 'capacidad': c['bloque__capacidad_maxima']}
+            for c in Reserva.objects.values('bloque__nombre', 'bloque__capacidad_maxima', 'fecha')
+            .annotate(total=Count('id'))
+            .filter(total__gt=F('bloque__capacidad_maxima'))
+            .order_by()
+        ]
+
+    def _contadores_descuadrados(self):
+        """Cantidad de contadores de OcupacionBloque que no coinciden con las reservas reales."""
+        reales = {
+            (c['bloque'], c['fecha']): c['total']
+            for c in Reserva.objects.values('bloque', 'fecha').annotate(total=Count('id')).order_by()
+        }
+        contadores = {
+            (o['bloque_id'], o['fecha']): o['ocupados']
+            for o in OcupacionBloque.objects.values('bloque_id', 'fecha', 'ocupados')
+        }
+        claves = set(reales) | set(contadores)
+        return sum(1 for clave in claves if reales.get(clave, 0) != contadores.get(clave, 0))
+
+    def _imprimir(self, resultados):
+        self.stdout.write("")
+        self.stdout.write(
+            f"{resultados['operaciones']} operaciones en {resultados['duracion_s']:.2f} s "
+            f"({resultados['ops_por_segundo']:.1f} ops/s)"
+        )
+        self.stdout.write(f"{'vista':<12}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'consultas':>11}{'5xx':>6}  estados")
+        for operacion, datos in resultados['vistas'].items():
+            self.stdout.write(
+                f"{operacion:<12}{datos['cantidad']:>7}{datos['p50_ms']:>10.1f}{datos['p95_ms']:>10.1f}"
+                f"{datos['p99_ms']:>10.1f}{datos['consultas_promedio']:>7.1f}/{datos['consultas_max']:<3}"
+                f"{datos['errores_5xx']:>6}  {datos['estados']}"
+            )
+
+        if resultados['sobreventas']:
+            self.stdout.write(self.style.ERROR(f"¡Cupos sobrevendidos! {resultados['sobreventas']}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("Sin cupos sobrevendidos."))
+        if resultados['contadores_descuadrados']:
+            self.stdout.write(self.style.ERROR(
+                f"{resultados['contadores_descuadrados']} contadores de ocupación no coinciden con las reservas."
+            ))
+
+    def _comparar(self, anterior, actual):
+        self.stdout.write("")
+        self.stdout.write("Comparación con la corrida anterior (actual vs anterior):")
+        self.stdout.write(
+            f"  ops/s: {actual['ops_por_segundo']:.1f} vs {anterior['ops_por_segundo']:.1f} "
+            f"({self._cambio(anterior['ops_por_segundo'], actual['ops_por_segundo'])})"
+        )
+        for operacion, datos in actual['vistas'].items():
+            previo = anterior['vistas'].get(operacion)
+            if not previo:
+                continue
+            self.stdout.write(
+                f"  {operacion:<12} p95 {datos['p95_ms']:.1f} vs {previo['p95_ms']:.1f} ms "
+                f"({self._cambio(previo['p95_ms'], datos['p95_ms'])}), "
+                f"consultas {datos['consultas_promedio']:.1f} vs {previo['consultas_promedio']:.1f}"
+            )
+
+    @staticmethod
+    def _cambio(antes, despues):
+        if not antes:
+            return 'n/a'
+        return f"{(despues - antes) / antes * 100:+.1f}%"
@@ -0,0 +1,188 @@
+import datetime
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, connections
+from django.db.models import Min
+from django.test.utils import override_settings
+from django.utils import timezone
+from agendamiento import disponibilidad
+from agendamiento.escrituras import MENSAJE_OCUPADO
+from agendamiento.management.commands.prueba_carga import percentil
+from agendamiento.models import BloqueHorario, OcupacionBloque, Reserva
+from agendamiento.ocupacion import crear_reserva
+
+PREFIJO = 'escritura_'
+
+# Configuraciones que se comparan: (OPTIONS de la base de datos, fila de escrituras en el proceso)
+ESCENARIOS = {
+    'sin_wal': ({'init_command': 'PRAGMA journal_mode=DELETE;', 'timeout': 5}, False),
+    'wal': (None, False),  # None: settings.SQLITE_OPCIONES_PRODUCCION
+    'wal_fila': (None, True),
+}
+
+
+# -----------------------------------------------------------------
+# Preparación (también la usa prueba_async)
+# -----------------------------------------------------------------
+
+def copiar_base(origen, destino):
+    connections.close_all()
+    with sqlite3.connect(origen) as fuente, sqlite3.connect(destino) as copia:
+        fuente.backup(copia)
+
+
+def usar_base(configuracion, nombre, opciones):
+    # Las conexiones leen NAME y OPTIONS al abrirse: basta con cerrarlas
+    connections.close_all()
+    configuracion['NAME'] = nombre
+    configuracion['OPTIONS'] = opciones
+
+
+def celdas_libres(cantidad):
+    """`cantidad` celdas (bloque_id, fecha) abiertas y sin reservas, desde la semana siguiente."""
+    lunes = disponibilidad.lunes_de(timezone.localdate()) + datetime.timedelta(weeks=1)
+    ocupadas = set(
+        OcupacionBloque.objects.filter(fecha__gte=lunes, ocupados__gt=0).values_list('bloque_id', 'fecha')
+    )
+    celdas = []
+    for semana in range(52):
+        estructura = disponibilidad.estructura_semana(lunes + datetime.timedelta(weeks=semana))
+        for bloque in estructura['bloques']:
+            celdas.extend(
+                (bloque['id'], dia)
+                for dia, cierre in zip(estructura['dias'], bloque['cierres'])
+                if cierre is None and (bloque['id'], dia) not in ocupadas
+            )
+        if len(celdas) >= cantidad:
+            return celdas[:cantidad]
+    raise CommandError("No hay suficientes bloques libres en el próximo año.")
+
+
+class Command(BaseCommand):
+    help = ('Mide cuántas reservas y cancelaciones por segundo aguanta SQLite con varios hilos '
+            'escribiendo a la vez, comparando el modo de journal clásico, WAL y WAL con la fila '
+            'de escrituras (agendamiento/escrituras.py). Trabaja sobre una copia temporal de la '
+            'base de datos: no modifica la real.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hilos', type=int, default=16, help='Hilos escribiendo a la vez.')
+        parser.add_argument('--reservas', type=int, default=50, help='Reservas por hilo (la mitad se cancela después).')
+        parser.add_argument('--escenarios', default=','.join(ESCENARIOS),
+                            help=f"Cuáles correr, separados por coma ({', '.join(ESCENARIOS)}).")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("Esta prueba es solo para SQLite.")
+        escenarios = [nombre.strip() for nombre in options['escenarios'].split(',')]
+        desconocidos = set(escenarios) - set(ESCENARIOS)
+        if desconocidos:
+            raise CommandError(f"Escenarios desconocidos: {', '.join(sorted(desconocidos))}")
+
+        configuracion = connections.settings['default']
+        original = {'NAME': configuracion['NAME'], 'OPTIONS': configuracion['OPTIONS']}
+        resultados = {}
+        try:
+            for nombre in escenarios:
+                opciones, fila = ESCENARIOS[nombre]
+                with tempfile.TemporaryDirectory() as carpeta:
+                    copia = os.path.join(carpeta, 'prueba.sqlite3')
+                    copiar_base(original['NAME'], copia)
+                    usar_base(configuracion, copia, opciones if opciones is not None else settings.SQLITE_OPCIONES_PRODUCCION)
+                    with override_settings(SQLITE_SERIALIZAR_ESCRITURAS=fila):
+                        resultados[nombre] = self._correr(options['hilos'], options['reservas'])
+                    connections.close_all()
+                self._imprimir(nombre, resultados[nombre])
+        finally:
+            usar_base(configuracion, original['NAME'], original['OPTIONS'])
+
+        if 'sin_wal' in resultados:
+            base = resultados['sin_wal']['por_segundo']
+            self.stdout.write("")
+            for nombre, datos in resultados.items():
+                cambio = f"{datos['por_segundo'] / base:.1f}x" if base else 'n/a'
+                self.stdout.write(f"{nombre:<10} {datos['por_segundo']:>8.1f} escrituras/s ({cambio} respecto de sin_wal)")
+
+    # -----------------------------------------------------------------
+    # Medición
+    # -----------------------------------------------------------------
+    def _correr(self, hilos, por_hilo):
+        capacidad = BloqueHorario.objects.filter(activo=True).aggregate(minima=Min('capacidad_maxima'))['minima']
+        if not capacidad:
+            raise CommandError("No hay bloques horarios. Ejecuta primero: python manage.py crear_bloques")
+        User.objects.bulk_create([User(username=f'{PREFIJO}{i}', password='!') for i in range(hilos * capacidad)])
+        usuarios = list(User.objects.filter(username__startswith=PREFIJO).order_by('id'))
+
+        # Cada hilo llena sus propias celdas: ninguna reserva falla por cupo,
+        # solo por el lock de la base de datos
+        celdas = celdas_libres(hilos * por_hilo // capacidad + hilos)
+        tareas = [[] for _ in range(hilos)]
+        for numero in range(hilos):
+            for i in range(por_hilo):
+                bloque_id, fecha = celdas[numero + hilos * (i // capacidad)]
+                tareas[numero].append((usuarios[numero * capacidad + i % capacidad], bloque_id, fecha))
+        connections.close_all()
+
+        tiempos, errores = [], {'ocupado': 0, 'otros': 0}
+        lock = threading.Lock()
+
+        def medir(operacion):
+            inicio = time.perf_counter()
+            try:
+                resultado = operacion()
+            except (ValidationError, DatabaseError) as e:
+                mensaje = '. '.join(e.messages) if isinstance(e, ValidationError) else str(e)
+                with lock:
+                    errores['ocupado' if MENSAJE_OCUPADO in mensaje or 'locked' in mensaje else 'otros'] += 1
+                return None
+            with lock:
+                tiempos.append(time.perf_counter() - inicio)
+            return resultado
+
+        def trabajador(numero):
+            reservas = [
+                medir(lambda: crear_reserva(usuario, bloque_id, fecha.isoformat()))
+                for usuario, bloque_id, fecha in tareas[numero]
+            ]
+            for reserva in [r for r in reservas if r is not None][::2]:
+                medir(reserva.delete)
+            connection.close()
+
+        inicio = time.perf_counter()
+        trabajadores = [threading.Thread(target=trabajador, args=(i,)) for i in range(hilos)]
+        for hilo in trabajadores:
+            hilo.start()
+        for hilo in trabajadores:
+            hilo.join()
+        duracion = time.perf_counter() - inicio
+
+        tiempos = sorted(t * 1000 for t in tiempos)
+        return {
+            'escrituras': len(tiempos),
+            'duracion_s': duracion,
+            'por_segundo': len(tiempos) / duracion if duracion else 0,
+            'p50_ms': percentil(tiempos, 50),
+            'p95_ms': percentil(tiempos, 95),
+            'p99_ms': percentil(tiempos, 99),
+            'fallidas_por_lock': errores['ocupado'],
+            'fallidas_otras': errores['otros'],
+            'reservas_finales': Reserva.objects.filter(usuario__username__startswith=PREFIJO).count(),
+        }
+
+    def _imprimir(self, nombre, datos):
+        self.stdout.write(self.style.SUCCESS(f"\n{nombre}"))
+        self.stdout.write(
+            f"  {datos['escrituras']} escrituras en {datos['duracion_s']:.2f} s ({datos['por_segundo']:.1f}/s), "
+            f"p50 {datos['p50_ms']:.1f} ms, p95 {datos['p95_ms']:.1f} ms, p99 {datos['p99_ms']:.1f} ms"
+        )
+        estilo = self.style.ERROR if datos['fallidas_por_lock'] else self.style.SUCCESS
+        self.stdout.write(estilo(
+            f"  Fallidas por lock: {datos['fallidas_por_lock']}, otras: {datos['fallidas_otras']}"
+        ))
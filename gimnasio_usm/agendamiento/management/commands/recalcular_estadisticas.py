@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from agendamiento.estadisticas import recalcular_estadisticas
+
+class Command(BaseCommand):
+    help = ('Rehace las reservas de EstadisticaDiaria (tablero del admin) desde las reservas '
+            'vigentes y archivadas. Las cancelaciones registradas se conservan.')
+
+    def handle(self, *args, **options):
+        self.stdout.write("Recalculando estadísticas diarias...")
+        total = recalcular_estadisticas()
+        self.stdout.write(self.style.SUCCESS(f"¡Listo! {total} filas de bloque/fecha actualizadas."))
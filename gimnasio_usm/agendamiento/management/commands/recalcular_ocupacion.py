@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from agendamiento.models import OcupacionBloque
+from agendamiento.ocupacion import recalcular_ocupacion
+
+class Command(BaseCommand):
+    help = 'Reconstruye los contadores de cupos (OcupacionBloque) a partir de las reservas existentes.'
+
+    def handle(self, *args, **options):
+        self.stdout.write("Recalculando cupos ocupados...")
+        recalcular_ocupacion()
+        total = OcupacionBloque.objects.count()
+        self.stdout.write(self.style.SUCCESS(f"¡Listo! {total} contadores de bloque/fecha actualizados."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+from agendamiento import busqueda
+
+
+class Command(BaseCommand):
+    help = ('Reindexa el texto de todas las sugerencias para la búsqueda del admin y vuelve a crear '
+            'los triggers que mantienen el índice al día (necesario si una migración rehízo la tabla).')
+
+    def handle(self, *args, **options):
+        if not busqueda.disponible():
+            raise CommandError("El índice de texto completo solo existe en SQLite; en esta base la búsqueda usa icontains.")
+        total = busqueda.reconstruir()
+        self.stdout.write(self.style.SUCCESS(f"¡Listo! {total} sugerencias indexadas."))
@@ -0,0 +1,42 @@
+import urllib.request
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from agendamiento import encuesta
+
+class Command(BaseCommand):
+    help = ('Descarga la exportación CSV de la encuesta, importa las respuestas nuevas '
+            'y recalcula los resultados que muestra resultados.html.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default=settings.ENCUESTA_URL_EXPORTACION,
+                            help='Enlace CSV publicado del formulario.')
+        parser.add_argument('--sin-descarga', action='store_true',
+                            help='No descarga nada, solo importa el archivo local que ya existe.')
+
+    def handle(self, *args, **options):
+        ruta = settings.ENCUESTA_EXPORTACION_CSV
+
+        if not options['sin_descarga']:
+            self.stdout.write(f"Descargando encuesta desde {options['url']}...")
+            try:
+                with urllib.request.urlopen(options['url'], timeout=30) as respuesta:
+                    contenido = respuesta.read()
+            except OSError as e:
+                raise CommandError(f"No se pudo descargar la encuesta: {e}")
+
+            # Escribimos a un archivo temporal y lo renombramos, para que
+            # nadie lea un CSV a medio escribir
+            temporal = ruta.with_suffix('.tmp')
+            temporal.write_bytes(contenido)
+            temporal.replace(ruta)
+            self.stdout.write(f"Guardado en {ruta}")
+
+        if ruta.exists():
+            nuevas, _ = encuesta.importar_archivo(ruta)
+            self.stdout.write(f"{nuevas} respuestas nuevas importadas.")
+
+        datos = encuesta.refrescar()
+        self.stdout.write(self.style.SUCCESS(
+            f"¡Resultados actualizados! {datos['total_respuestas']} encuestados."
+        ))
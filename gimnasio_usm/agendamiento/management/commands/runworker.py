@@ -0,0 +1,53 @@
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+from agendamiento import tareas
+
+# Cada cuánto se borran las tareas hechas antiguas (segundos)
+LIMPIAR_CADA = 60 * 60
+
+
+class Command(BaseCommand):
+    help = ('Ejecuta la cola de tareas (correos de confirmación, recordatorios, avisos de la lista de '
+            'espera) por lotes, con reintentos. Queda corriendo; detener con Ctrl+C. '
+            'Se pueden correr varios a la vez.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=50, help='Tareas que se toman por transacción.')
+        parser.add_argument('--espera', type=float, default=2.0,
+                            help='Segundos entre revisiones cuando no hay tareas pendientes.')
+        parser.add_argument('--una-vez', action='store_true',
+                            help='Ejecuta lo que ya toca y termina (para cron o para probar).')
+
+    def handle(self, *args, **options):
+        hechas = errores = 0
+        ultima_limpieza = 0
+        try:
+            while True:
+                if time.monotonic() - ultima_limpieza > LIMPIAR_CADA:
+                    tareas.limpiar()
+                    ultima_limpieza = time.monotonic()
+                try:
+                    tareas.programar_periodicas()
+                    lote = tareas.tomar_lote(options['lote'])
+                except ValidationError:
+                    # La base de datos está ocupada con reservas: se reintenta en la próxima vuelta
+                    lote = []
+                if lote:
+                    try:
+                        bien, mal = tareas.ejecutar_lote(lote)
+                    except ValidationError:
+                        # No se pudo guardar el resultado: vuelven a la fila después de TAREAS_TIEMPO_MAXIMO
+                        self.stderr.write(f"No se pudo guardar el resultado de un lote de {len(lote)} tareas.")
+                        continue
+                    hechas, errores = hechas + bien, errores + mal
+                    if options['verbosity'] > 1 or mal:
+                        self.stdout.write(f"Lote de {len(lote)}: {bien} hechas, {mal} con error.")
+                    continue
+                if options['una_vez']:
+                    break
+                time.sleep(options['espera'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"¡Listo! {hechas} tareas hechas, {errores} con error."))
@@ -0,0 +1,260 @@
+"""
+Métricas en el formato de texto de Prometheus, expuestas en /metrics.
+
+MetricasMiddleware (ver middleware.py) mide cada petición por nombre de URL:
+cantidad por método y código de estado, duración, y cantidad y tiempo de
+las consultas SQL (con connection.execute_wrapper, sin tocar las vistas).
+La envoltura se instala en cada conexión al abrirse (ver signals.py) y
+suma en la medición de la petición actual, que va en un ContextVar: así
+también cuenta las consultas de las vistas asíncronas, que corren en otro
+hilo con su propia conexión.
+
+Además hay contadores del negocio: reservas, cancelaciones, rechazos por
+bloque lleno y cuánto tarda cada bloque en llenarse desde que se abre su
+semana (disponibilidad.apertura_de). Las reservas y cancelaciones se
+cuentan desde estadisticas.sumar, que ya recibe todos los cambios de cupos,
+y solo después del COMMIT.
+
+Los valores viven en memoria del proceso: con varios workers cada uno
+expone los suyos y Prometheus los suma por instancia. Registrar un valor es
+tomar un lock y sumar en un dict, así que el costo por petición es mínimo.
+
+Perfilador opcional (settings.METRICAS_PERFILADOR): corre cProfile en una
+muestra de las peticiones y guarda el perfil de las que pasan el umbral,
+conservando solo las más lentas.
+"""
+import bisect
+import contextvars
+import cProfile
+import io
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+
+def _etiquetas(nombres, valores):
+    def escapar(valor):
+        return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    if not nombres:
+        return ''
+    return '{' + ','.join(f'{nombre}="{escapar(valor)}"' for nombre, valor in zip(nombres, valores)) + '}'
+
+
+class Contador:
+    """Contador que solo sube, con etiquetas opcionales."""
+
+    tipo = 'counter'
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def sumar(self, valor=1, **etiquetas):
+        clave = tuple(etiquetas[nombre] for nombre in self.etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+    def muestras(self):
+        with self._lock:
+            valores = dict(self._valores)
+        for clave, valor in sorted(valores.items()):
+            yield f'{self.nombre}{_etiquetas(self.etiquetas, clave)} {valor}'
+
+
+class Histograma:
+    """Histograma con límites fijos (`le`), suma y cantidad, con etiquetas opcionales."""
+
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, limites, etiquetas=()):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, tuple(etiquetas)
+        self.limites = sorted(limites)
+        self._valores = {}  # {etiquetas: [conteo por límite (+Inf al final), suma]}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, **etiquetas):
+        clave = tuple(etiquetas[nombre] for nombre in self.etiquetas)
+        posicion = bisect.bisect_left(self.limites, valor)
+        with self._lock:
+            datos = self._valores.get(clave)
+            if datos is None:
+                datos = self._valores[clave] = [[0] * (len(self.limites) + 1), 0.0]
+            datos[0][posicion] += 1
+            datos[1] += valor
+
+    def muestras(self):
+        with self._lock:
+            valores = {clave: (list(conteos), suma) for clave, (conteos, suma) in self._valores.items()}
+        nombres = self.etiquetas + ('le',)
+        for clave, (conteos, suma) in sorted(valores.items()):
+            acumulado = 0
+            for limite, conteo in zip(self.limites + ['+Inf'], conteos):
+                acumulado += conteo
+                yield f'{self.nombre}_bucket{_etiquetas(nombres, clave + (limite,))} {acumulado}'
+            yield f'{self.nombre}_sum{_etiquetas(self.etiquetas, clave)} {suma}'
+            yield f'{self.nombre}_count{_etiquetas(self.etiquetas, clave)} {acumulado}'
+
+
+# -----------------------------------------------------------------
+# MÉTRICAS
+# -----------------------------------------------------------------
+
+SEGUNDOS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+HORA, DIA = 60 * 60, 60 * 60 * 24
+
+peticiones = Contador(
+    'gimnasio_peticiones_total', 'Peticiones atendidas por vista, método y código de estado.',
+    ('vista', 'metodo', 'estado'),
+)
+duracion = Histograma('gimnasio_peticion_segundos', 'Duración de las peticiones por vista.', SEGUNDOS, ('vista',))
+consultas = Histograma(
+    'gimnasio_consultas_por_peticion', 'Consultas SQL por petición, por vista.',
+    [0, 1, 2, 3, 5, 8, 12, 20, 50, 100], ('vista',),
+)
+tiempo_consultas = Histograma(
+    'gimnasio_consultas_segundos', 'Tiempo total en consultas SQL por petición, por vista.', SEGUNDOS, ('vista',),
+)
+reservas = Contador('gimnasio_reservas_total', 'Reservas confirmadas (incluye series y lista de espera).')
+cancelaciones = Contador('gimnasio_cancelaciones_total', 'Reservas canceladas.')
+rechazos_cupo = Contador('gimnasio_rechazos_cupo_total', 'Reservas rechazadas porque el bloque estaba lleno.')
+llenado = Histograma(
+    'gimnasio_bloque_lleno_segundos',
+    'Segundos desde que se abre la semana hasta que cada bloque se ve lleno (primer rechazo por cupo).',
+    [60, 5 * 60, 15 * 60, HORA, 3 * HORA, 6 * HORA, 12 * HORA, DIA, 2 * DIA, 4 * DIA, 7 * DIA, 14 * DIA, 28 * DIA, 56 * DIA],
+)
+
+TODAS = [peticiones, duracion, consultas, tiempo_consultas, reservas, cancelaciones, rechazos_cupo, llenado]
+
+
+def exponer():
+    """Todas las métricas en el formato de texto de Prometheus."""
+    lineas = []
+    for metrica in TODAS:
+        lineas.append(f'# HELP {metrica.nombre} {metrica.ayuda}')
+        lineas.append(f'# TYPE {metrica.nombre} {metrica.tipo}')
+        lineas.extend(metrica.muestras())
+    return '\n'.join(lineas) + '\n'
+
+
+# ----- Consultas SQL de la petición -----
+
+_medicion = contextvars.ContextVar('metricas_medicion', default=None)
+
+
+def _medir_consulta(execute, sql, params, many, context):
+    medicion = _medicion.get()
+    if medicion is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        medicion['consultas'] += 1
+        medicion['segundos'] += time.perf_counter() - inicio
+
+
+def instalar_medicion(conexion):
+    """Agrega la envoltura que mide las consultas a `conexion` (una sola vez)."""
+    if _medir_consulta not in conexion.execute_wrappers:
+        conexion.execute_wrappers.append(_medir_consulta)
+
+
+@contextmanager
+def medir_consultas():
+    """Cuenta las consultas hechas dentro del bloque, en este hilo o en los que lance sync_to_async."""
+    medicion = {'consultas': 0, 'segundos': 0.0}
+    token = _medicion.set(medicion)
+    try:
+        yield medicion
+    finally:
+        _medicion.reset(token)
+
+
+# ----- Contadores del negocio -----
+
+def contar_cambios(cambios):
+    """Suma reservas y cancelaciones de `cambios` = {(bloque_id, fecha): (reservas, cancelaciones)} al confirmar."""
+    hechas = sum(r for r, _ in cambios.values())
+    canceladas = sum(c for _, c in cambios.values())
+
+    def al_confirmar():
+        if hechas:
+            reservas.sumar(hechas)
+        if canceladas:
+            cancelaciones.sumar(canceladas)
+    transaction.on_commit(al_confirmar)
+
+
+def contar_rechazo(bloque_id, fecha):
+    """
+    Cuenta una reserva rechazada por cupo. La primera vez que pasa en una
+    celda (entre todos los procesos si el caché es compartido) se registra
+    cuánto tardó en llenarse desde la apertura de su semana.
+    """
+    from .disponibilidad import apertura_de, lunes_de
+
+    rechazos_cupo.sumar()
+    if cache.add(f'agendamiento:lleno:{bloque_id}:{fecha.isoformat()}', True, 60 * DIA):
+        llenado.observar(max(0.0, (timezone.now() - apertura_de(lunes_de(fecha))).total_seconds()))
+
+
+# -----------------------------------------------------------------
+# PERFILADOR DE LAS PETICIONES MÁS LENTAS
+# -----------------------------------------------------------------
+
+class Perfilador:
+    """
+    Con settings.METRICAS_PERFILADOR = {'muestreo': 0.01, 'umbral_ms': 500,
+    'carpeta': ..., 'maximo': 20}, perfila una de cada 1/muestreo peticiones
+    y guarda en `carpeta` el perfil (texto de pstats) de las que tardaron
+    más de `umbral_ms`, dejando solo las `maximo` más lentas.
+    """
+
+    def __init__(self, configuracion):
+        self.configuracion = configuracion
+        self.carpeta = Path(configuracion['carpeta'])
+        self._lock = threading.Lock()
+
+    @classmethod
+    def desde_settings(cls):
+        configuracion = getattr(settings, 'METRICAS_PERFILADOR', None)
+        return cls(configuracion) if configuracion else None
+
+    def iniciar(self):
+        """Un cProfile.Profile ya activo si esta petición entra en la muestra, o None."""
+        if random.random() >= self.configuracion.get('muestreo', 0.01):
+            return None
+        perfil = cProfile.Profile()
+        try:
+            perfil.enable()
+        except ValueError:
+            # Otro hilo ya está perfilando
+            return None
+        return perfil
+
+    def terminar(self, perfil, request, milisegundos):
+        perfil.disable()
+        if milisegundos < self.configuracion.get('umbral_ms', 500):
+            return
+        texto = io.StringIO()
+        texto.write(f'{request.method} {request.get_full_path()} {milisegundos:.0f} ms\n\n')
+        pstats.Stats(perfil, stream=texto).sort_stats('cumulative').print_stats(40)
+
+        vista = request.resolver_match.url_name if request.resolver_match else 'sin_ruta'
+        with self._lock:
+            self.carpeta.mkdir(parents=True, exist_ok=True)
+            # El nombre empieza con los milisegundos: ordenar por nombre es ordenar por lentitud
+            nombre = f'{milisegundos:09.0f}ms_{vista}_{time.strftime("%Y%m%d-%H%M%S")}.txt'
+            (self.carpeta / nombre).write_text(texto.getvalue(), encoding='utf-8')
+            perfiles = sorted(self.carpeta.glob('*ms_*.txt'), reverse=True)
+            for sobrante in perfiles[self.configuracion.get('maximo', 20):]:
+                sobrante.unlink(missing_ok=True)
@@ -0,0 +1,134 @@
+"""
+Middleware de agendamiento. Los dos funcionan con WSGI y con ASGI: si el
+resto de la cadena es asíncrona no obligan a Django a pasar cada petición
+por un hilo (ver vistas_async.py).
+"""
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.http import HttpResponse, JsonResponse
+from django.urls import Resolver404, resolve
+
+from . import limites, metricas
+
+
+class MetricasMiddleware:
+    """
+    Mide cada petición para /metrics (ver agendamiento/metricas.py): estado,
+    duración y consultas SQL, por nombre de URL. Va primero en MIDDLEWARE
+    para que la duración incluya a los demás middleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.asincrono = iscoroutinefunction(get_response)
+        # cProfile mide un hilo: en el event loop mezclaría todas las peticiones
+        self.perfilador = None if self.asincrono else metricas.Perfilador.desde_settings()
+        if self.asincrono:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.asincrono:
+            return self.__acall__(request)
+        perfil = self.perfilador.iniciar() if self.perfilador else None
+        inicio = time.perf_counter()
+        with metricas.medir_consultas() as medicion:
+            respuesta = self.get_response(request)
+        segundos = time.perf_counter() - inicio
+        if perfil is not None:
+            self.perfilador.terminar(perfil, request, segundos * 1000)
+        self.registrar(request, respuesta, segundos, medicion)
+        return respuesta
+
+    async def __acall__(self, request):
+        inicio = time.perf_counter()
+        with metricas.medir_consultas() as medicion:
+            respuesta = await self.get_response(request)
+        self.registrar(request, respuesta, time.perf_counter() - inicio, medicion)
+        return respuesta
+
+    def registrar(self, request, respuesta, segundos, medicion):
+        # Solo nombres de URL como etiqueta: las rutas inexistentes van juntas
+        vista = request.resolver_match.url_name if request.resolver_match else None
+        vista = vista or 'sin_ruta'
+        metricas.peticiones.sumar(vista=vista, metodo=request.method, estado=respuesta.status_code)
+        metricas.duracion.observar(segundos, vista=vista)
+        metricas.consultas.observar(medicion['consultas'], vista=vista)
+        metricas.tiempo_consultas.observar(medicion['segundos'], vista=vista)
+
+
+class LimitePeticionesMiddleware:
+    """
+    Aplica los límites de agendamiento/limites.py a los POST de las vistas de
+    settings.LIMITES_PETICIONES, antes de que la vista toque la base de datos.
+    Va después de AuthenticationMiddleware (usa el usuario de la sesión).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.asincrono = iscoroutinefunction(get_response)
+        if self.asincrono:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.asincrono:
+            return self.__acall__(request)
+        limite = self.limite_de(request)
+        if limite is not None:
+            respuesta = self.revisar(request, request.user, *limite)
+            if respuesta is not None:
+                return respuesta
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        limite = self.limite_de(request)
+        if limite is not None:
+            usuario = await request.auser()
+            # revisar lee y escribe el caché (Redis o memcached en producción):
+            # va en un hilo para no bloquear el event loop. No toca la base de
+            # datos, así que no necesita esperar al hilo de las consultas.
+            respuesta = await sync_to_async(self.revisar, thread_sensitive=False)(request, usuario, *limite)
+            if respuesta is not None:
+                return respuesta
+        return await self.get_response(request)
+
+    def limite_de(self, request):
+        """(grupo, regla) si la petición es un POST a una vista con límite, o None."""
+        if request.method != 'POST':
+            return None
+        try:
+            nombre_url = resolve(request.path_info).url_name
+        except Resolver404:
+            return None
+        grupo, regla = limites.grupo_de(nombre_url)
+        return None if grupo is None else (grupo, regla)
+
+    def revisar(self, request, usuario, grupo, regla):
+        espera = limites.revisar_limite(request, usuario, grupo, regla)
+        if espera:
+            return self.demasiadas(request, espera, "Demasiados intentos seguidos. Espera un momento.")
+
+        if regla.get('sala_espera') and usuario.is_authenticated:
+            espera = limites.turno_sala(usuario.pk)
+            if espera:
+                return self.demasiadas(
+                    request, espera, "Hay muchas personas reservando en este momento. Ya tienes tu turno, intenta de nuevo en unos segundos."
+                )
+        return None
+
+    def demasiadas(self, request, segundos, mensaje):
+        """429 con Retry-After; en JSON para la API, texto plano para los formularios."""
+        if request.path.startswith('/api/'):
+            respuesta = JsonResponse({'error': mensaje, 'reintentar_en': segundos}, status=429)
+        else:
+            respuesta = HttpResponse(
+                f"{mensaje} (reintenta en {segundos} s)", status=429, content_type='text/plain; charset=utf-8'
+            )
+        respuesta['Retry-After'] = str(segundos)
+        return respuesta
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def contar_reservas_existentes(apps, schema_editor):
+    Reserva = apps.get_model('agendamiento', 'Reserva')
+    OcupacionBloque = apps.get_model('agendamiento', 'OcupacionBloque')
+    conteos = Reserva.objects.values('bloque', 'fecha').annotate(conteo=Count('id')).order_by()
+    OcupacionBloque.objects.bulk_create(
+        [OcupacionBloque(bloque_id=c['bloque'], fecha=c['fecha'], ocupados=c['conteo']) for c in conteos],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamiento', '0002_sugerencia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OcupacionBloque',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('ocupados', models.PositiveIntegerField(default=0)),
+                ('bloque', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ocupaciones', to='agendamiento.bloquehorario')),
+            ],
+            options={
+                'verbose_name': 'Ocupación de Bloque',
+                'verbose_name_plural': 'Ocupaciones de Bloques',
+                'unique_together': {('bloque', 'fecha')},
+            },
+        ),
+        migrations.RunPython(contar_reservas_existentes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamiento', '0003_ocupacionbloque'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PreguntaEncuesta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seccion', models.CharField(max_length=100)),
+                ('texto', models.CharField(max_length=255, unique=True)),
+                ('orden', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Pregunta de Encuesta',
+                'verbose_name_plural': 'Preguntas de Encuesta',
+                'ordering': ['orden'],
+            },
+        ),
+        migrations.CreateModel(
+            name='OpcionEncuesta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('texto', models.CharField(max_length=255)),
+                ('conteo', models.PositiveIntegerField(default=0)),
+                ('pregunta', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='opciones', to='agendamiento.preguntaencuesta')),
+            ],
+            options={
+                'verbose_name': 'Opción de Encuesta',
+                'verbose_name_plural': 'Opciones de Encuesta',
+                'unique_together': {('pregunta', 'texto')},
+            },
+        ),
+        migrations.CreateModel(
+            name='RespuestaEncuesta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=64, unique=True)),
+                ('fuente', models.CharField(max_length=255)),
+                ('fecha_importacion', models.DateTimeField(auto_now_add=True)),
+                ('opciones', models.ManyToManyField(related_name='respuestas', to='agendamiento.opcionencuesta')),
+            ],
+            options={
+                'verbose_name': 'Respuesta de Encuesta',
+                'verbose_name_plural': 'Respuestas de Encuesta',
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamiento', '0004_encuesta'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListaEspera',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('bloque', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='listas_espera', to='agendamiento.bloquehorario')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='listas_espera', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Lista de Espera',
+                'verbose_name_plural': 'Listas de Espera',
+                'indexes': [models.Index(fields=['bloque', 'fecha', 'id'], name='espera_bloque_fecha_id')],
+                'unique_together': {('usuario', 'bloque', 'fecha')},
+            },
+        ),
+    ]
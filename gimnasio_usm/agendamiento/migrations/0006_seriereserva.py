@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamiento', '0005_listaespera'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SerieReserva',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dias_semana', models.CharField(max_length=20)),
+                ('fecha_inicio', models.DateField()),
+                ('fecha_fin', models.DateField()),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('bloque', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='series_reserva', to='agendamiento.bloquehorario')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='series_reserva', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Serie de Reservas',
+                'verbose_name_plural': 'Series de Reservas',
+            },
+        ),
+        migrations.AddField(
+            model_name='reserva',
+            name='serie',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reservas', to='agendamiento.seriereserva'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:48
+
+from django.db import migrations, models
+
+
+def actualizar_estadisticas(apps, schema_editor):
+    # Sin estadísticas SQLite puede elegir el índice único (usuario, ...) para
+    # consultas por fecha. ANALYZE deja que el planificador use los nuevos.
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('ANALYZE')
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamiento', '0006_seriereserva'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ocupacionbloque',
+            index=models.Index(fields=['fecha', 'bloque'], name='ocupacion_fecha_bloque'),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['bloque', 'fecha'], name='reserva_bloque_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['fecha', 'bloque'], name='reserva_fecha_bloque'),
+        ),
+        migrations.RunPython(actualizar_estadisticas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamiento', '0007_indices_reserva'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservaArchivada',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reserva_id', models.BigIntegerField(unique=True)),
+                ('bloque_nombre', models.CharField(max_length=50)),
+                ('fecha', models.DateField()),
+                ('fecha_archivado', models.DateTimeField(auto_now_add=True)),
+                ('bloque', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reservas_archivadas', to='agendamiento.bloquehorario')),
+                ('usuario', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reservas_archivadas', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Reserva Archivada',
+                'verbose_name_plural': 'Reservas Archivadas',
+                'indexes': [models.Index(fields=['fecha', 'bloque'], name='archivada_fecha_bloque')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ResumenDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bloque_nombre', models.CharField(max_length=50)),
+                ('fecha', models.DateField()),
+                ('reservas', models.PositiveIntegerField(default=0)),
+                ('usuarios_distintos', models.PositiveIntegerField(default=0)),
+                ('capacidad', models.PositiveIntegerField(default=0)),
+                ('bloque', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='resumenes', to='agendamiento.bloquehorario')),
+            ],
+            options={
+                'verbose_name': 'Resumen Diario',
+                'verbose_name_plural': 'Resúmenes Diarios',
+                'unique_together': {('bloque_nombre', 'fecha')},
+            },
+        ),
+    ]
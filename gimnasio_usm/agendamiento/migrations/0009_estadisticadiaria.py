@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:52
+
+import django.db.models.deletion
+import datetime
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def contar_reservas_existentes(apps, schema_editor):
+    # Las cancelaciones anteriores a esta migración no quedaron registradas
+    Reserva = apps.get_model('agendamiento', 'Reserva')
+    EstadisticaDiaria = apps.get_model('agendamiento', 'EstadisticaDiaria')
+    conteos = Reserva.objects.values('bloque', 'bloque__capacidad_maxima', 'fecha').annotate(conteo=Count('id')).order_by()
+    EstadisticaDiaria.objects.bulk_create(
+        [
+            EstadisticaDiaria(
+                bloque_id=c['bloque'],
+                fecha=c['fecha'],
+                semana=c['fecha'] - datetime.timedelta(days=c['fecha'].weekday()),
+                dia_semana=c['fecha'].weekday(),
+                reservas=c['conteo'],
+                capacidad=c['bloque__capacidad_maxima'],
+            )
+            for c in conteos
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamiento', '0008_historial_reservas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstadisticaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('semana', models.DateField()),
+                ('dia_semana', models.PositiveSmallIntegerField()),
+                ('reservas', models.PositiveIntegerField(default=0)),
+                ('cancelaciones', models.PositiveIntegerField(default=0)),
+                ('capacidad', models.PositiveIntegerField(default=0)),
+                ('bloque', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='estadisticas', to='agendamiento.bloquehorario')),
+            ],
+            options={
+                'verbose_name': 'Estadística Diaria',
+                'verbose_name_plural': 'Estadísticas Diarias',
+                'indexes': [models.Index(fields=['fecha'], name='estadistica_fecha')],
+                'unique_together': {('bloque', 'fecha')},
+            },
+        ),
+        migrations.RunPython(contar_reservas_existentes, migrations.RunPython.noop),
+    ]
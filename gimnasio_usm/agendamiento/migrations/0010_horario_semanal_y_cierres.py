@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamiento', '0009_estadisticadiaria'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bloquehorario',
+            name='activo',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='bloquehorario',
+            name='dias_semana',
+            field=models.CharField(default='0,1,2,3,4', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='Cierre',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('motivo', models.CharField(max_length=100)),
+                ('bloque', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='cierres', to='agendamiento.bloquehorario')),
+            ],
+            options={
+                'verbose_name': 'Cierre',
+                'verbose_name_plural': 'Cierres',
+                'ordering': ['fecha'],
+                'unique_together': {('fecha', 'bloque')},
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+from django.db import migrations
+
+# Índice de texto completo de Sugerencia.texto (ver agendamiento/busqueda.py).
+# Tabla FTS5 de "contenido externo": guarda solo el índice y lee el texto de
+# agendamiento_sugerencia. Los triggers la mantienen al día con cada INSERT,
+# UPDATE y DELETE, también los masivos (bulk_create, queryset.delete()).
+CREAR = [
+    """CREATE VIRTUAL TABLE agendamiento_sugerencia_fts USING fts5(
+        texto, content='agendamiento_sugerencia', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    # Vista del vocabulario del índice: en cuántas sugerencias aparece cada término
+    "CREATE VIRTUAL TABLE agendamiento_sugerencia_vocab USING fts5vocab(agendamiento_sugerencia_fts, 'row')",
+    """CREATE TRIGGER agendamiento_sugerencia_fts_insert AFTER INSERT ON agendamiento_sugerencia BEGIN
+        INSERT INTO agendamiento_sugerencia_fts(rowid, texto) VALUES (new.id, new.texto);
+    END""",
+    """CREATE TRIGGER agendamiento_sugerencia_fts_delete AFTER DELETE ON agendamiento_sugerencia BEGIN
+        INSERT INTO agendamiento_sugerencia_fts(agendamiento_sugerencia_fts, rowid, texto) VALUES ('delete', old.id, old.texto);
+    END""",
+    """CREATE TRIGGER agendamiento_sugerencia_fts_update AFTER UPDATE OF texto ON agendamiento_sugerencia BEGIN
+        INSERT INTO agendamiento_sugerencia_fts(agendamiento_sugerencia_fts, rowid, texto) VALUES ('delete', old.id, old.texto);
+        INSERT INTO agendamiento_sugerencia_fts(rowid, texto) VALUES (new.id, new.texto);
+    END""",
+    # Indexa las sugerencias que ya existen
+    "INSERT INTO agendamiento_sugerencia_fts(agendamiento_sugerencia_fts) VALUES ('rebuild')",
+]
+BORRAR = [
+    'DROP TRIGGER IF EXISTS agendamiento_sugerencia_fts_update',
+    'DROP TRIGGER IF EXISTS agendamiento_sugerencia_fts_delete',
+    'DROP TRIGGER IF EXISTS agendamiento_sugerencia_fts_insert',
+    'DROP TABLE IF EXISTS agendamiento_sugerencia_vocab',
+    'DROP TABLE IF EXISTS agendamiento_sugerencia_fts',
+]
+
+
+def crear_indice(apps, schema_editor):
+    # Solo SQLite: en otra base de datos la búsqueda usa icontains
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in CREAR:
+            schema_editor.execute(sql)
+
+
+def borrar_indice(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in BORRAR:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamiento', '0010_horario_semanal_y_cierres'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indice, borrar_indice),
+    ]
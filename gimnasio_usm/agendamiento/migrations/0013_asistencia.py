@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamiento', '0012_cola_de_tareas'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='estadisticadiaria',
+            name='asistencias',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='Asistencia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reserva_id', models.BigIntegerField(unique=True)),
+                ('fecha', models.DateField()),
+                ('hora_entrada', models.DateTimeField()),
+                ('bloque', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='asistencias', to='agendamiento.bloquehorario')),
+                ('usuario', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='asistencias', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Asistencia',
+                'verbose_name_plural': 'Asistencias',
+                'indexes': [models.Index(fields=['fecha', 'bloque'], name='asistencia_fecha_bloque')],
+            },
+        ),
+    ]
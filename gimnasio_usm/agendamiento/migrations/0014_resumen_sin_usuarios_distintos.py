@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:59
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamiento', '0013_asistencia'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='resumendiario',
+            name='usuarios_distintos',
+        ),
+    ]
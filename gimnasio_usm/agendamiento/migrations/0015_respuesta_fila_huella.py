@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamiento', '0014_resumen_sin_usuarios_distintos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='respuestaencuesta',
+            name='fila',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='respuestaencuesta',
+            name='huella',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='respuestaencuesta',
+            index=models.Index(fields=['fuente', 'fila'], name='respuesta_fuente_fila'),
+        ),
+        migrations.AddIndex(
+            model_name='respuestaencuesta',
+            index=models.Index(fields=['fuente', 'huella'], name='respuesta_fuente_huella'),
+        ),
+    ]
@@ -5,15 +5,26 @@ from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 
+from .escrituras import escritura
+
 class BloqueHorario(models.Model):
     """
     Representa un bloque de agendamiento (ej. "Bloque 1-2").
-    Estos son fijos y se crean una sola vez.
+    Se sincronizan desde horario.json con `python manage.py crear_bloques`
+    (ver agendamiento/horario.py); nunca se borran, solo se desactivan.
     """
     nombre = models.CharField(max_length=50, unique=True, help_text="Ej: Bloque 1-2")
     hora_inicio = models.TimeField()
     hora_fin = models.TimeField()
     capacidad_maxima = models.PositiveIntegerField(default=10)
+    # Días de la semana en que se ofrece, como en SerieReserva: "0,1,2,3,4" = lunes a viernes
+    dias_semana = models.CharField(max_length=20, default='0,1,2,3,4')
+    # Un bloque que sale del horario queda inactivo para no perder sus reservas
+    activo = models.BooleanField(default=True)
+
+    @property
+    def lista_dias(self):
+        return [int(dia) for dia in self.dias_semana.split(',') if dia]
 
     def __str__(self):
         return f"{self.nombre} ({self.hora_inicio.strftime('%H:%M')} - {self.hora_fin.strftime('%H:%M')})"
@@ -23,6 +34,128 @@ class BloqueHorario(models.Model):
         verbose_name_plural = "Bloques Horarios"
         ordering = ['hora_inicio']
 
+class Cierre(models.Model):
+    """
+    Día en que el gimnasio (bloque=None) o un bloque no abre: feriados,
+    mantenciones, etc. Se sincronizan desde horario.json y quedan
+    precalculados en la estructura de la grilla (ver disponibilidad.py).
+    """
+    fecha = models.DateField()
+    bloque = models.ForeignKey(BloqueHorario, on_delete=models.CASCADE, null=True, blank=True, related_name="cierres")
+    motivo = models.CharField(max_length=100)
+
+    def __str__(self):
+        donde = self.bloque.nombre if self.bloque_id else "Todo el día"
+        return f"{self.fecha} ({donde}): {self.motivo}"
+
+    class Meta:
+        unique_together = ('fecha', 'bloque')
+        ordering = ['fecha']
+        verbose_name = "Cierre"
+        verbose_name_plural = "Cierres"
+
+class OcupacionBloque(models.Model):
+    """
+    Contador de cupos ocupados de un BloqueHorario en una fecha.
+    Se actualiza junto con cada Reserva (ver agendamiento/ocupacion.py),
+    así revisar la capacidad no necesita contar la tabla de reservas.
+    """
+    bloque = models.ForeignKey(BloqueHorario, on_delete=models.CASCADE, related_name="ocupaciones")
+    fecha = models.DateField()
+    ocupados = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.bloque_id} el {self.fecha}: {self.ocupados} ocupados"
+
+    class Meta:
+        unique_together = ('bloque', 'fecha')
+        # La grilla lee todas las celdas de una semana: fecha__in primero
+        indexes = [models.Index(fields=['fecha', 'bloque'], name='ocupacion_fecha_bloque')]
+        verbose_name = "Ocupación de Bloque"
+        verbose_name_plural = "Ocupaciones de Bloques"
+
+class ReservaQuerySet(models.QuerySet):
+
+    def delete(self):
+        """
+        Borrado masivo que también libera los cupos en OcupacionBloque,
+        agrupando por (bloque, fecha) en vez de descontar fila por fila.
+        """
+        from .asistencia import revocar
+        from .lista_espera import promover_grupos
+        from .ocupacion import liberar_cupos
+
+        with escritura():
+            filas = list(self.select_for_update().values_list('pk', 'bloque_id', 'fecha'))
+            if not filas:
+                return 0, {}
+
+            # Borramos exactamente las filas que contamos (por lotes, SQLite limita los parámetros)
+            total, por_modelo = 0, {}
+            for inicio in range(0, len(filas), 500):
+                lote = self.model.objects.filter(pk__in=[f[0] for f in filas[inicio:inicio + 500]])
+                borradas, detalle = super(ReservaQuerySet, lote).delete()
+                total += borradas
+                for etiqueta, cantidad in detalle.items():
+                    por_modelo[etiqueta] = por_modelo.get(etiqueta, 0) + cantidad
+
+            # Sus códigos de entrada dejan de servir en el kiosko
+            revocar([(pk, fecha) for pk, _, fecha in filas])
+            grupos = {}
+            for _, bloque_id, fecha in filas:
+                grupos[(bloque_id, fecha)] = grupos.get((bloque_id, fecha), 0) + 1
+            # Los cupos que toma la lista de espera no se liberan
+            for clave, promovidos in promover_grupos(grupos).items():
+                grupos[clave] -= promovidos
+            liberar_cupos({clave: cantidad for clave, cantidad in grupos.items() if cantidad})
+        return total, por_modelo
+
+    def cancelar(self, vaciar_espera=False):
+        """
+        Cancela todas las reservas del queryset con el borrado masivo de
+        arriba (ej. todas las de un bloque o un día en que el gimnasio cierra).
+        Con `vaciar_espera` primero se vacía la lista de espera de esos
+        bloques y días, así nadie recibe un cupo que no se va a usar.
+        Devuelve (reservas canceladas, entradas de espera borradas).
+        """
+        from .lista_espera import vaciar
+
+        with escritura():
+            en_espera = 0
+            if vaciar_espera:
+                en_espera = vaciar(self.order_by().values_list('bloque_id', 'fecha').distinct())
+            return self.delete()[0], en_espera
+
+class SerieReserva(models.Model):
+    """
+    Reserva recurrente: el mismo bloque, ciertos días de la semana, entre
+    dos fechas (ej. todo el semestre). Cada fecha es una Reserva normal que
+    apunta a su serie (ver agendamiento/series.py).
+    """
+    DIAS = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes']
+
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name="series_reserva")
+    bloque = models.ForeignKey(BloqueHorario, on_delete=models.CASCADE, related_name="series_reserva")
+    # Días de la semana como texto, ej. "0,2,4" = lunes, miércoles y viernes
+    dias_semana = models.CharField(max_length=20)
+    fecha_inicio = models.DateField()
+    fecha_fin = models.DateField()
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def lista_dias(self):
+        return [int(dia) for dia in self.dias_semana.split(',') if dia]
+
+    def nombres_dias(self):
+        return ', '.join(self.DIAS[dia] for dia in self.lista_dias)
+
+    def __str__(self):
+        return f"Serie de {self.usuario.username} para {self.bloque.nombre} ({self.nombres_dias()}) del {self.fecha_inicio} al {self.fecha_fin}"
+
+    class Meta:
+        verbose_name = "Serie de Reservas"
+        verbose_name_plural = "Series de Reservas"
+
 class Reserva(models.Model):
     """
     Conecta a un Usuario con un BloqueHorario en una fecha específica.
@@ -30,6 +163,9 @@ class Reserva(models.Model):
     usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name="reservas")
     bloque = models.ForeignKey(BloqueHorario, on_delete=models.CASCADE, related_name="reservas")
     fecha = models.DateField(default=timezone.now)
+    serie = models.ForeignKey(SerieReserva, on_delete=models.SET_NULL, null=True, blank=True, related_name="reservas")
+
+    objects = ReservaQuerySet.as_manager()
 
     def __str__(self):
         return f"Reserva de {self.usuario.username} para {self.bloque.nombre} el {self.fecha}"
@@ -37,29 +173,223 @@ class Reserva(models.Model):
     class Meta:
         # Un usuario no puede reservar el mismo bloque el mismo día dos veces
         unique_together = ('usuario', 'bloque', 'fecha')
+        # Ver `python manage.py explicar_consultas` para los planes de cada consulta
+        indexes = [
+            # Cupos y lista de espera de un bloque en un día; recalcular_ocupacion
+            models.Index(fields=['bloque', 'fecha'], name='reserva_bloque_fecha'),
+            # Rangos de fecha agrupados por bloque (conteos de la semana, date_hierarchy del admin)
+            models.Index(fields=['fecha', 'bloque'], name='reserva_fecha_bloque'),
+            # Las reservas de un usuario ya usan el índice único (usuario, bloque, fecha)
+        ]
         verbose_name = "Reserva"
         verbose_name_plural = "Reservas"
 
     def clean(self):
         """
         Validación a nivel de modelo para asegurar que no se supere la capacidad.
+        Lee el contador de OcupacionBloque en vez de contar las reservas.
         """
-        # Contamos cuántas reservas existen ya para este bloque en esta fecha
-        reservas_existentes = Reserva.objects.filter(
-            bloque=self.bloque,
-            fecha=self.fecha
-        ).count()
-        
-        # Si las reservas existentes son iguales o mayores a la capacidad, lanzamos un error
-        if reservas_existentes >= self.bloque.capacidad_maxima:
+        from .ocupacion import cupos_ocupados
+
+        if not self._state.adding:
+            return
+
+        # Si los cupos ocupados son iguales o mayores a la capacidad, lanzamos un error
+        if cupos_ocupados(self.bloque_id, self.fecha) >= self.bloque.capacidad_maxima:
             raise ValidationError(
                 f"El bloque {self.bloque.nombre} para el {self.fecha} está lleno."
             )
 
     def save(self, *args, **kwargs):
-        # Ejecutar la validación 'clean' antes de guardar
-        self.clean()
-        super().save(*args, **kwargs)
+        """
+        Toma el cupo y guarda la reserva en la misma transacción: si el
+        INSERT falla (ej. reserva duplicada) el cupo se devuelve solo. Los
+        correos de una reserva nueva se encolan en la misma transacción
+        (ver notificaciones.py).
+        """
+        from .notificaciones import al_reservar
+        from .ocupacion import ocupar_cupo, liberar_cupo
+
+        with escritura():
+            nueva = self._state.adding
+            if nueva:
+                ocupar_cupo(self.bloque, self.fecha)
+            else:
+                # Si se movió la reserva (ej. desde el admin) cambiamos el cupo de lugar
+                anterior = Reserva.objects.filter(pk=self.pk).values_list('bloque_id', 'fecha').first()
+                if anterior and anterior != (self.bloque_id, self.fecha):
+                    ocupar_cupo(self.bloque, self.fecha)
+                    liberar_cupo(*anterior)
+            super().save(*args, **kwargs)
+            if nueva:
+                al_reservar(self)
+
+    def delete(self, *args, **kwargs):
+        from .asistencia import revocar
+        from .lista_espera import promover_siguiente
+        from .ocupacion import liberar_cupo
+
+        pk, bloque_id, fecha = self.pk, self.bloque_id, self.fecha
+        with escritura():
+            resultado = super().delete(*args, **kwargs)
+            # Solo devolvemos el cupo si la fila realmente se borró
+            # (dos cancelaciones simultáneas no deben liberar dos cupos).
+            # Si hay lista de espera, el cupo pasa directo al primero de la fila.
+            if resultado[1].get(self._meta.label, 0):
+                revocar([(pk, fecha)])
+                if not promover_siguiente(bloque_id, fecha):
+                    liberar_cupo(bloque_id, fecha)
+        return resultado
+
+class ListaEspera(models.Model):
+    """
+    Fila de espera (FIFO) para un BloqueHorario lleno en una fecha.
+    Cuando alguien cancela, el primero de la fila recibe el cupo
+    (ver agendamiento/lista_espera.py).
+    """
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name="listas_espera")
+    bloque = models.ForeignKey(BloqueHorario, on_delete=models.CASCADE, related_name="listas_espera")
+    fecha = models.DateField()
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.usuario.username} espera {self.bloque.nombre} el {self.fecha}"
+
+    class Meta:
+        unique_together = ('usuario', 'bloque', 'fecha')
+        # El primero de la fila se busca por (bloque, fecha) ordenado por id
+        indexes = [models.Index(fields=['bloque', 'fecha', 'id'], name='espera_bloque_fecha_id')]
+        verbose_name = "Lista de Espera"
+        verbose_name_plural = "Listas de Espera"
+
+# -----------------------------------------------------------------
+# HISTORIAL DE RESERVAS (ver agendamiento/archivo.py)
+# -----------------------------------------------------------------
+class ReservaArchivada(models.Model):
+    """
+    Reserva de una semana ya pasada, movida fuera de la tabla Reserva por
+    el comando archivar_reservas. Guarda el nombre del bloque por si el
+    bloque se borra después (crear_bloques los vuelve a crear).
+    """
+    reserva_id = models.BigIntegerField(unique=True)  # id que tenía en Reserva
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name="reservas_archivadas")
+    bloque = models.ForeignKey(BloqueHorario, on_delete=models.SET_NULL, null=True, related_name="reservas_archivadas")
+    bloque_nombre = models.CharField(max_length=50)
+    fecha = models.DateField()
+    fecha_archivado = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Reserva archivada {self.reserva_id}: {self.bloque_nombre} el {self.fecha}"
+
+    class Meta:
+        indexes = [models.Index(fields=['fecha', 'bloque'], name='archivada_fecha_bloque')]
+        verbose_name = "Reserva Archivada"
+        verbose_name_plural = "Reservas Archivadas"
+
+class ResumenDiario(models.Model):
+    """
+    Resumen de un bloque en un día ya archivado: cuántas reservas tuvo y su
+    capacidad. Sirve para reportes sin leer las reservas una por una. (Cada
+    usuario reserva un bloque una sola vez al día, así que las reservas ya
+    son los usuarios distintos del bloque.)
+    """
+    bloque = models.ForeignKey(BloqueHorario, on_delete=models.SET_NULL, null=True, related_name="resumenes")
+    bloque_nombre = models.CharField(max_length=50)
+    fecha = models.DateField()
+    reservas = models.PositiveIntegerField(default=0)
+    capacidad = models.PositiveIntegerField(default=0)  # capacidad_maxima del bloque al archivar
+
+    def __str__(self):
+        return f"{self.bloque_nombre} el {self.fecha}: {self.reservas}/{self.capacidad}"
+
+    class Meta:
+        unique_together = ('bloque_nombre', 'fecha')
+        verbose_name = "Resumen Diario"
+        verbose_name_plural = "Resúmenes Diarios"
+
+# -----------------------------------------------------------------
+# ESTADÍSTICAS DE USO (ver agendamiento/estadisticas.py)
+# -----------------------------------------------------------------
+class EstadisticaDiaria(models.Model):
+    """
+    Reservas hechas y canceladas de un bloque en un día. Se suma en la
+    misma transacción de cada reserva o cancelación, así el tablero del
+    admin lee unas pocas filas por día en vez de contar la tabla Reserva.
+    Las reservas que siguen en pie son `reservas - cancelaciones`, y las de
+    quienes no llegaron, `reservas - cancelaciones - asistencias` (en los
+    días en que se usó el kiosko, ver asistencia.py).
+    """
+    bloque = models.ForeignKey(BloqueHorario, on_delete=models.CASCADE, related_name="estadisticas")
+    fecha = models.DateField()
+    # Copias de la fecha para agrupar sin funciones de fecha en SQL
+    semana = models.DateField()  # lunes de la semana
+    dia_semana = models.PositiveSmallIntegerField()  # 0 = lunes
+    reservas = models.PositiveIntegerField(default=0)
+    cancelaciones = models.PositiveIntegerField(default=0)
+    asistencias = models.PositiveIntegerField(default=0)  # entradas registradas en el kiosko
+    capacidad = models.PositiveIntegerField(default=0)  # capacidad_maxima del bloque ese día
+
+    def __str__(self):
+        return f"{self.bloque_id} el {self.fecha}: {self.reservas} reservas, {self.cancelaciones} cancelaciones"
+
+    class Meta:
+        unique_together = ('bloque', 'fecha')
+        indexes = [models.Index(fields=['fecha'], name='estadistica_fecha')]
+        verbose_name = "Estadística Diaria"
+        verbose_name_plural = "Estadísticas Diarias"
+
+# -----------------------------------------------------------------
+# ASISTENCIA (ver agendamiento/asistencia.py)
+# -----------------------------------------------------------------
+class Asistencia(models.Model):
+    """
+    Entrada al gimnasio con una reserva, registrada al escanear su código en
+    el kiosko. Se guardan por lotes, por eso no hay FK a Reserva (como en
+    ReservaArchivada): la reserva puede haberse archivado o cancelado después.
+    """
+    reserva_id = models.BigIntegerField(unique=True)
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name="asistencias")
+    bloque = models.ForeignKey(BloqueHorario, on_delete=models.SET_NULL, null=True, related_name="asistencias")
+    fecha = models.DateField()
+    hora_entrada = models.DateTimeField()
+
+    def __str__(self):
+        return f"Asistencia de la reserva {self.reserva_id} el {self.fecha}"
+
+    class Meta:
+        indexes = [models.Index(fields=['fecha', 'bloque'], name='asistencia_fecha_bloque')]
+        verbose_name = "Asistencia"
+        verbose_name_plural = "Asistencias"
+
+# -----------------------------------------------------------------
+# COLA DE TAREAS (ver agendamiento/tareas.py)
+# -----------------------------------------------------------------
+class Tarea(models.Model):
+    """
+    Trabajo pendiente fuera de la petición (ej. un correo de confirmación).
+    Lo ejecuta "python manage.py runworker" desde `ejecutar_desde`.
+    """
+    PENDIENTE, EN_CURSO, HECHA, FALLIDA = 'pendiente', 'en_curso', 'hecha', 'fallida'
+    ESTADOS = [(PENDIENTE, 'Pendiente'), (EN_CURSO, 'En curso'), (HECHA, 'Hecha'), (FALLIDA, 'Fallida')]
+
+    nombre = models.CharField(max_length=50)  # la función registrada en tareas.py
+    argumentos = models.JSONField(default=dict, blank=True)
+    estado = models.CharField(max_length=10, choices=ESTADOS, default=PENDIENTE)
+    ejecutar_desde = models.DateTimeField(default=timezone.now)
+    intentos = models.PositiveSmallIntegerField(default=0)
+    max_intentos = models.PositiveSmallIntegerField(default=3)
+    ultimo_error = models.TextField(blank=True)
+    tomada_en = models.DateTimeField(null=True, blank=True)  # cuándo la tomó un worker
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.nombre} #{self.id} ({self.get_estado_display()})"
+
+    class Meta:
+        # El worker busca las pendientes que ya toca ejecutar, las más antiguas primero
+        indexes = [models.Index(fields=['estado', 'ejecutar_desde'], name='tarea_estado_ejecutar')]
+        verbose_name = "Tarea"
+        verbose_name_plural = "Tareas"
 
 class Sugerencia(models.Model):
     # Usamos ForeignKey para saber QUÉ usuario envió la sugerencia
@@ -77,3 +407,61 @@ class Sugerencia(models.Model):
         # Esto es para que se vea bonito en el panel de administrador
         user_display = self.usuario.username if self.usuario else 'Anónimo'
         return f'Sugerencia de {user_display} ({self.fecha_creacion.strftime("%Y-%m-%d")})'
+
+# -----------------------------------------------------------------
+# ENCUESTA DE BIENESTAR (ver agendamiento/encuesta.py)
+# -----------------------------------------------------------------
+class PreguntaEncuesta(models.Model):
+    seccion = models.CharField(max_length=100)
+    texto = models.CharField(max_length=255, unique=True)
+    orden = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.seccion}: {self.texto}"
+
+    class Meta:
+        verbose_name = "Pregunta de Encuesta"
+        verbose_name_plural = "Preguntas de Encuesta"
+        ordering = ['orden']
+
+class OpcionEncuesta(models.Model):
+    """
+    Una respuesta posible de una pregunta. `conteo` es el total acumulado,
+    lo mantiene el comando importar_encuesta al agregar respuestas nuevas.
+    """
+    pregunta = models.ForeignKey(PreguntaEncuesta, on_delete=models.CASCADE, related_name="opciones")
+    texto = models.CharField(max_length=255)
+    conteo = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.texto} ({self.conteo})"
+
+    class Meta:
+        unique_together = ('pregunta', 'texto')
+        verbose_name = "Opción de Encuesta"
+        verbose_name_plural = "Opciones de Encuesta"
+
+class RespuestaEncuesta(models.Model):
+    """
+    Una persona que respondió la encuesta (una fila del archivo importado).
+    `clave` identifica la fila para no importarla dos veces. `fila` (posición
+    en el archivo) y `huella` (hash del contenido) permiten saltarse sin
+    leerlas las filas del principio que ya se importaron de la misma fuente.
+    """
+    clave = models.CharField(max_length=64, unique=True)
+    fuente = models.CharField(max_length=255)
+    fila = models.PositiveIntegerField(null=True, blank=True)
+    huella = models.CharField(max_length=64, blank=True)
+    fecha_importacion = models.DateTimeField(auto_now_add=True)
+    opciones = models.ManyToManyField(OpcionEncuesta, related_name="respuestas")
+
+    def __str__(self):
+        return f"Respuesta {self.clave[:8]} ({self.fuente})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['fuente', 'fila'], name='respuesta_fuente_fila'),
+            models.Index(fields=['fuente', 'huella'], name='respuesta_fuente_huella'),
+        ]
+        verbose_name = "Respuesta de Encuesta"
+        verbose_name_plural = "Respuestas de Encuesta"
@@ -0,0 +1,136 @@
+"""
+Correos a los socios, enviados por la cola de tareas (ver tareas.py).
+
+Reserva.save encola la confirmación y el recordatorio (programado
+settings.NOTIFICACIONES_RECORDATORIO_ANTES antes del bloque) con un solo
+INSERT dentro de la transacción de la reserva. Las reservas que se crean
+con bulk_create no pasan por save, así que sus correos se encolan aparte,
+en la misma transacción: series.crear_serie encola una confirmación de
+toda la serie y un recordatorio por fecha, y lista_espera.promover el
+aviso y el recordatorio de quienes reciben un cupo. La petición no espera
+al servidor de correo: eso lo hace "python manage.py runworker".
+
+Cada correo vuelve a leer la reserva: si se canceló antes de que el worker
+llegue a ella, no se envía nada. Los usuarios sin email se saltan.
+
+Con el EMAIL_BACKEND de settings.py los correos quedan como archivos en
+correos/ (o en la consola con django.core.mail.backends.console.EmailBackend);
+en producción se configura SMTP.
+"""
+import datetime
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.utils import timezone
+
+from . import tareas
+from .models import Reserva, SerieReserva
+
+
+def _inicio(reserva):
+    return timezone.make_aware(
+        datetime.datetime.combine(reserva.fecha, reserva.bloque.hora_inicio), timezone.get_current_timezone()
+    )
+
+
+def _recordatorios(reservas):
+    """Tareas de recordatorio de las `reservas` a las que todavía les alcanza el tiempo."""
+    ahora = timezone.now()
+    nuevas = []
+    for reserva in reservas:
+        cuando = _inicio(reserva) - datetime.timedelta(seconds=settings.NOTIFICACIONES_RECORDATORIO_ANTES)
+        if cuando > ahora:
+            nuevas.append(tareas.nueva('recordar_reserva', cuando, reserva_id=reserva.id))
+    return nuevas
+
+
+def al_reservar(reserva):
+    """Encola la confirmación y, si todavía alcanza, el recordatorio. Va dentro de la transacción de la reserva."""
+    tareas.encolar_varias([tareas.nueva('confirmar_reserva', reserva_id=reserva.id), *_recordatorios([reserva])])
+
+
+def al_crear_serie(serie, reservas):
+    """Encola una confirmación para toda la serie y el recordatorio de cada reserva. Va dentro de su transacción."""
+    tareas.encolar_varias([tareas.nueva('confirmar_serie', serie_id=serie.id), *_recordatorios(reservas)])
+
+
+def al_promover(reservas):
+    """Encola el aviso y el recordatorio de las reservas creadas desde la lista de espera."""
+    tareas.encolar_varias([
+        *(tareas.nueva('avisar_cupo_lista_espera', reserva_id=reserva.id) for reserva in reservas),
+        *_recordatorios(reservas),
+    ])
+
+
+def _enviar(reserva_id, asunto, cuerpo):
+    reserva = Reserva.objects.select_related('usuario', 'bloque').filter(id=reserva_id).first()
+    # Cancelada antes de enviar, o el usuario no tiene email
+    if reserva is None or not reserva.usuario.email:
+        return
+    EmailMessage(
+        asunto(reserva), cuerpo(reserva), to=[reserva.usuario.email], connection=tareas.correo(),
+    ).send()
+
+
+def _detalle(reserva):
+    return (
+        f"Bloque: {reserva.bloque.nombre} "
+        f"({reserva.bloque.hora_inicio.strftime('%H:%M')} - {reserva.bloque.hora_fin.strftime('%H:%M')})\n"
+        f"Fecha: {reserva.fecha.strftime('%d/%m/%Y')}\n\n"
+        "Si no puedes asistir, cancela tu reserva en la página del gimnasio para liberar el cupo.\n"
+    )
+
+
+@tareas.registrar('confirmar_reserva')
+def confirmar_reserva(reserva_id):
+    _enviar(
+        reserva_id,
+        lambda reserva: f"Reserva confirmada: {reserva.bloque.nombre} el {reserva.fecha.strftime('%d/%m')}",
+        lambda reserva: f"Hola {reserva.usuario.username}, tu reserva en el gimnasio quedó confirmada.\n\n" + _detalle(reserva),
+    )
+
+
+@tareas.registrar('confirmar_serie')
+def confirmar_serie(serie_id):
+    serie = SerieReserva.objects.select_related('usuario', 'bloque').filter(id=serie_id).first()
+    # Cancelada antes de enviar, o el usuario no tiene email
+    if serie is None or not serie.usuario.email:
+        return
+    fechas = list(serie.reservas.filter(fecha__gte=timezone.localdate()).order_by('fecha').values_list('fecha', flat=True))
+    if not fechas:
+        return
+    bloque = serie.bloque
+    EmailMessage(
+        f"Serie confirmada: {bloque.nombre} ({serie.nombres_dias()})",
+        f"Hola {serie.usuario.username}, tus reservas recurrentes en el gimnasio quedaron confirmadas.\n\n"
+        f"Bloque: {bloque.nombre} ({bloque.hora_inicio.strftime('%H:%M')} - {bloque.hora_fin.strftime('%H:%M')})\n"
+        f"Fechas: {', '.join(fecha.strftime('%d/%m') for fecha in fechas)}\n\n"
+        "Te enviaremos un recordatorio antes de cada una. Si no puedes asistir, cancela la reserva "
+        "en la página del gimnasio para liberar el cupo.\n",
+        to=[serie.usuario.email], connection=tareas.correo(),
+    ).send()
+
+
+@tareas.registrar('recordar_reserva')
+def recordar_reserva(reserva_id):
+    reserva = Reserva.objects.select_related('bloque').filter(id=reserva_id).first()
+    # Si el worker estuvo detenido y el bloque ya empezó, el recordatorio no sirve
+    if reserva is None or _inicio(reserva) <= timezone.now():
+        return
+    _enviar(
+        reserva_id,
+        lambda reserva: f"Recordatorio: {reserva.bloque.nombre} el {reserva.fecha.strftime('%d/%m')}",
+        lambda reserva: f"Hola {reserva.usuario.username}, te recordamos tu reserva en el gimnasio.\n\n" + _detalle(reserva),
+    )
+
+
+@tareas.registrar('avisar_cupo_lista_espera')
+def avisar_cupo_lista_espera(reserva_id):
+    _enviar(
+        reserva_id,
+        lambda reserva: f"Tienes cupo: {reserva.bloque.nombre} el {reserva.fecha.strftime('%d/%m')}",
+        lambda reserva: (
+            f"Hola {reserva.usuario.username}, se liberó un cupo y pasaste de la lista de espera "
+            "a tener una reserva confirmada.\n\n" + _detalle(reserva)
+        ),
+    )
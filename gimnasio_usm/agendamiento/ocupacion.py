@@ -0,0 +1,252 @@
+"""
+Servicio de cupos: lleva la cuenta de reservas por (bloque, fecha) en
+OcupacionBloque.
+
+Tomar un cupo es un solo UPDATE condicional ("sumar 1 si todavía hay
+espacio"), así que la base de datos decide de forma atómica quién se queda
+con el último cupo aunque lleguen muchas reservas al mismo tiempo, tanto en
+SQLite (un escritor a la vez) como en un servidor (bloqueo de fila).
+
+Estas funciones se deben llamar dentro de transaction.atomic(), junto con
+el INSERT/DELETE de la Reserva (ver Reserva.save y Reserva.delete).
+Cuando la transacción se confirma, se invalida en el caché la celda de la
+grilla afectada (ver disponibilidad.py) y se avisa a los navegadores
+conectados por SSE (ver eventos.py). Cada cambio también se suma a las
+estadísticas del tablero del admin (ver estadisticas.py).
+"""
+import datetime
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.expressions import Col
+from django.db.models.lookups import Lookup
+from django.utils import timezone
+
+from . import disponibilidad, estadisticas, eventos, metricas
+from .models import BloqueHorario, OcupacionBloque, Reserva
+
+
+def avisar_cambio(claves):
+    """Después del COMMIT: invalida las celdas en caché y publica los nuevos cupos."""
+    def al_confirmar():
+        disponibilidad.invalidar_celdas(claves)
+        eventos.publicar_cambios(claves)
+    transaction.on_commit(al_confirmar)
+
+
+def _sumar_cupo(bloque, fecha):
+    """UPDATE condicional: devuelve 1 si se tomó el cupo, 0 si no."""
+    return OcupacionBloque.objects.filter(
+        bloque=bloque,
+        fecha=fecha,
+        ocupados__lt=bloque.capacidad_maxima,
+    ).update(ocupados=F('ocupados') + 1)
+
+
+def ocupar_cupo(bloque, fecha):
+    """
+    Toma un cupo del bloque en la fecha o lanza ValidationError si está lleno.
+    """
+    if _sumar_cupo(bloque, fecha):
+        estadisticas.sumar({(bloque.id, fecha): (1, 0)})
+        avisar_cambio([(bloque.id, fecha)])
+        return
+
+    # Puede que sea la primera reserva del bloque ese día: creamos el contador.
+    # Si otro proceso lo creó justo antes, ignore_conflicts evita el error.
+    OcupacionBloque.objects.bulk_create(
+        [OcupacionBloque(bloque=bloque, fecha=fecha)], ignore_conflicts=True
+    )
+    if not _sumar_cupo(bloque, fecha):
+        metricas.contar_rechazo(bloque.id, fecha)
+        raise ValidationError(
+            f"El bloque {bloque.nombre} para el {fecha} está lleno."
+        )
+    estadisticas.sumar({(bloque.id, fecha): (1, 0)})
+    avisar_cambio([(bloque.id, fecha)])
+
+
+def liberar_cupo(bloque_id, fecha, cantidad=1):
+    """Devuelve `cantidad` cupos del bloque en la fecha."""
+    OcupacionBloque.objects.filter(
+        bloque_id=bloque_id, fecha=fecha, ocupados__gte=cantidad
+    ).update(ocupados=F('ocupados') - cantidad)
+    estadisticas.sumar({(bloque_id, fecha): (0, cantidad)})
+    avisar_cambio([(bloque_id, fecha)])
+
+
+def liberar_cupos(grupos):
+    """
+    Libera cupos de varios (bloque, fecha) a la vez.
+
+    `grupos` es un dict {(bloque_id, fecha): cantidad}. Se hace un UPDATE por
+    cada cantidad distinta (normalmente una sola) en vez de uno por reserva.
+    """
+    por_cantidad = {}
+    for (bloque_id, fecha), cantidad in grupos.items():
+        por_cantidad.setdefault(cantidad, []).append((bloque_id, fecha))
+
+    for cantidad, claves in por_cantidad.items():
+        # Lotes chicos para no pasar el límite de profundidad de expresiones de SQLite
+        for inicio in range(0, len(claves), 200):
+            condicion = Q()
+            for bloque_id, fecha in claves[inicio:inicio + 200]:
+                condicion |= Q(bloque_id=bloque_id, fecha=fecha)
+            OcupacionBloque.objects.filter(condicion, ocupados__gte=cantidad).update(
+                ocupados=F('ocupados') - cantidad
+            )
+    estadisticas.sumar({clave: (0, cantidad) for clave, cantidad in grupos.items()})
+    avisar_cambio(list(grupos))
+
+
+def _consulta_ocupados(bloque_id, fecha):
+    return OcupacionBloque.objects.filter(bloque_id=bloque_id, fecha=fecha).values_list('ocupados', flat=True)
+
+
+def cupos_ocupados(bloque_id, fecha):
+    """Cupos ocupados del bloque en la fecha (lectura O(1) por la clave única)."""
+    return _consulta_ocupados(bloque_id, fecha).first() or 0
+
+
+async def acupos_ocupados(bloque_id, fecha):
+    return await _consulta_ocupados(bloque_id, fecha).afirst() or 0
+
+
+def validar_bloque_y_fecha(bloque_id, fecha_str):
+    """
+    Busca el bloque, interpreta la fecha (AAAA-MM-DD) y revisa que no haya
+    pasado y que el bloque abra ese día.
+    Devuelve (bloque, fecha) o lanza ValidationError.
+    """
+    try:
+        bloque = BloqueHorario.objects.get(id=bloque_id, activo=True)
+        fecha = datetime.datetime.strptime(fecha_str, "%Y-%m-%d").date()
+    except (BloqueHorario.DoesNotExist, TypeError, ValueError):
+        raise ValidationError("Error: El bloque o la fecha no son válidos.")
+    _revisar_horario(bloque, fecha)
+    _revisar_cierre(bloque, fecha, disponibilidad.motivo_cierre(bloque.id, fecha))
+    return bloque, fecha
+
+
+async def avalidar_bloque_y_fecha(bloque_id, fecha_str):
+    """Versión asíncrona de validar_bloque_y_fecha (ver vistas_async.py)."""
+    try:
+        bloque = await BloqueHorario.objects.aget(id=bloque_id, activo=True)
+        fecha = datetime.datetime.strptime(fecha_str, "%Y-%m-%d").date()
+    except (BloqueHorario.DoesNotExist, TypeError, ValueError):
+        raise ValidationError("Error: El bloque o la fecha no son válidos.")
+    _revisar_horario(bloque, fecha)
+    _revisar_cierre(bloque, fecha, await disponibilidad.amotivo_cierre(bloque.id, fecha))
+    return bloque, fecha
+
+
+def _revisar_horario(bloque, fecha):
+    # Validación de tiempo
+    hora_inicio_reserva = datetime.datetime.combine(fecha, bloque.hora_inicio)
+    hora_inicio_reserva_tz = timezone.make_aware(hora_inicio_reserva, timezone.get_current_timezone())
+    if hora_inicio_reserva_tz < timezone.now():
+        raise ValidationError("Error: No puedes reservar un bloque de horario que ya ha pasado.")
+
+
+def _revisar_cierre(bloque, fecha, motivo):
+    # Cierres y días en que no se ofrece el bloque (desde el caché de la grilla)
+    if motivo:
+        raise ValidationError(f"Error: El {bloque.nombre} no abre el {fecha} ({motivo}).")
+
+
+def crear_reserva(usuario, bloque_id, fecha_str):
+    """
+    Valida los datos de una reserva y la crea.
+
+    Lo usan tanto el formulario de agendar.html como la API JSON. Lanza
+    ValidationError con el mensaje que se le muestra al usuario.
+    """
+    bloque, fecha = validar_bloque_y_fecha(bloque_id, fecha_str)
+
+    # Reserva.save toma el cupo de forma atómica.
+    # Si ya existe la reserva, el unique_together lo detecta y el cupo se devuelve.
+    try:
+        return Reserva.objects.create(usuario=usuario, bloque=bloque, fecha=fecha)
+    except IntegrityError:
+        raise ValidationError(f"Ya tienes una reserva para el {bloque.nombre} el {fecha}.")
+    except ValidationError as e:
+        raise ValidationError(f"Error al reservar: {'. '.join(e.messages)}")
+
+
+async def acrear_reserva(usuario, bloque_id, fecha_str):
+    """
+    Versión asíncrona de crear_reserva. La validación usa el ORM asíncrono;
+    el INSERT va con acreate, que corre Reserva.save (la transacción que toma
+    el cupo) en el hilo de la base de datos.
+    """
+    bloque, fecha = await avalidar_bloque_y_fecha(bloque_id, fecha_str)
+    try:
+        return await Reserva.objects.acreate(usuario=usuario, bloque=bloque, fecha=fecha)
+    except IntegrityError:
+        raise ValidationError(f"Ya tienes una reserva para el {bloque.nombre} el {fecha}.")
+    except ValidationError as e:
+        raise ValidationError(f"Error al reservar: {'. '.join(e.messages)}")
+
+
+# Filtros de una consulta de Reserva que también se pueden aplicar a OcupacionBloque
+_FILTRABLES = {'fecha', 'bloque'}
+_LOOKUPS = {'exact', 'gt', 'gte', 'lt', 'lte', 'in', 'range'}
+
+
+def filtros_en_contadores(reservas):
+    """
+    Los filtros de `reservas` (un queryset de Reserva) como kwargs para
+    OcupacionBloque, o None si filtra por algo más que fecha y bloque (ej.
+    una búsqueda por usuario) y los contadores no sirven para contarlas.
+    """
+    consulta = reservas.query
+    if consulta.is_sliced or consulta.distinct or consulta.where.negated or consulta.where.connector != 'AND':
+        return None
+    filtros = {}
+    for condicion in consulta.where.children:
+        if not (
+            isinstance(condicion, Lookup) and isinstance(condicion.lhs, Col)
+            and condicion.lhs.alias == consulta.base_table
+            and condicion.lhs.target.name in _FILTRABLES and condicion.lookup_name in _LOOKUPS
+        ):
+            return None
+        clave = f'{condicion.lhs.target.name}__{condicion.lookup_name}'
+        if clave in filtros:
+            return None
+        filtros[clave] = condicion.rhs
+    return filtros
+
+
+def contar_reservas(reservas):
+    """
+    Cuántas filas tiene `reservas` sumando los contadores de OcupacionBloque
+    (una fila por bloque y día en vez de una por reserva). None si la
+    consulta no se puede contar así (ver filtros_en_contadores).
+    """
+    filtros = filtros_en_contadores(reservas)
+    if filtros is None:
+        return None
+    return OcupacionBloque.objects.filter(**filtros).aggregate(total=Sum('ocupados'))['total'] or 0
+
+
+def recalcular_ocupacion():
+    """
+    Reconstruye todos los contadores desde la tabla Reserva.
+
+    Sirve para corregir desajustes por borrados en cascada (ej. al eliminar
+    un usuario), que no pasan por Reserva.delete.
+    """
+    with transaction.atomic():
+        conteos = list(Reserva.objects.values('bloque', 'fecha').annotate(conteo=Count('id')).order_by())
+        claves = set(OcupacionBloque.objects.values_list('bloque_id', 'fecha'))
+        OcupacionBloque.objects.all().delete()
+        OcupacionBloque.objects.bulk_create(
+            [
+                OcupacionBloque(bloque_id=c['bloque'], fecha=c['fecha'], ocupados=c['conteo'])
+                for c in conteos
+            ],
+            batch_size=500,
+        )
+    claves.update((c['bloque'], c['fecha']) for c in conteos)
+    disponibilidad.invalidar_celdas(claves)
@@ -0,0 +1,153 @@
+"""
+Reservas recurrentes (series).
+
+Crear una serie valida y reserva todas sus fechas con consultas sobre el
+conjunto completo, no una por fecha:
+
+1. Una consulta para saber qué fechas ya tenía reservadas el usuario.
+2. Un INSERT masivo (ignore_conflicts) para asegurar que exista el contador
+   de OcupacionBloque de cada fecha.
+3. Un SELECT ... FOR UPDATE de las fechas con cupo y un UPDATE que suma 1 a
+   todas ellas, con la misma condición "ocupados < capacidad".
+4. Un bulk_create de las reservas, y otro de los correos (una confirmación
+   de la serie y un recordatorio por fecha, ver notificaciones.py).
+
+Todo va en una transacción. En SQLite el primer INSERT ya toma el bloqueo
+de escritura, así que nadie puede tomar un cupo entre el paso 3 y el 4.
+"""
+import datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import F
+from django.utils import timezone
+
+from .escrituras import escritura
+from .models import BloqueHorario, OcupacionBloque, Reserva, SerieReserva
+from . import disponibilidad, estadisticas, metricas, notificaciones
+from .ocupacion import avisar_cambio
+
+# Un semestre y algo: evita series gigantes por error
+MAXIMO_DIAS_SERIE = 200
+
+
+def _todavia_no_empieza(bloque, fecha, ahora):
+    inicio = timezone.make_aware(datetime.datetime.combine(fecha, bloque.hora_inicio), timezone.get_current_timezone())
+    return inicio >= ahora
+
+
+def fechas_de_serie(fecha_inicio, fecha_fin, dias_semana):
+    """Fechas entre inicio y fin (inclusive) que caen en los días de la semana pedidos."""
+    fechas = []
+    fecha = fecha_inicio
+    while fecha <= fecha_fin:
+        if fecha.weekday() in dias_semana:
+            fechas.append(fecha)
+        fecha += datetime.timedelta(days=1)
+    return fechas
+
+
+def _validar(bloque_id, dias_semana, fecha_inicio_str, fecha_fin_str):
+    try:
+        bloque = BloqueHorario.objects.get(id=bloque_id, activo=True)
+        fecha_inicio = datetime.date.fromisoformat(fecha_inicio_str)
+        fecha_fin = datetime.date.fromisoformat(fecha_fin_str)
+        dias = sorted({int(dia) for dia in dias_semana})
+    except (BloqueHorario.DoesNotExist, TypeError, ValueError):
+        raise ValidationError("Error: Los datos de la reserva recurrente no son válidos.")
+
+    if not dias or any(dia not in range(5) for dia in dias):
+        raise ValidationError("Error: Elige al menos un día entre lunes y viernes.")
+    if fecha_fin < fecha_inicio:
+        raise ValidationError("Error: La fecha de término debe ser posterior a la de inicio.")
+    if (fecha_fin - fecha_inicio).days > MAXIMO_DIAS_SERIE:
+        raise ValidationError(f"Error: Una serie puede durar como máximo {MAXIMO_DIAS_SERIE} días.")
+    return bloque, dias, fecha_inicio, fecha_fin
+
+
+def crear_serie(usuario, bloque_id, dias_semana, fecha_inicio_str, fecha_fin_str):
+    """
+    Crea la serie y reserva todas las fechas futuras que tengan cupo.
+
+    Devuelve (serie, reservadas, llenas, ya_reservadas), las últimas tres
+    son listas de fechas. Lanza ValidationError si los datos no son válidos
+    o si no se pudo reservar ninguna fecha (en ese caso no queda la serie).
+    """
+    bloque, dias, fecha_inicio, fecha_fin = _validar(bloque_id, dias_semana, fecha_inicio_str, fecha_fin_str)
+
+    # Solo fechas cuyo bloque todavía no empieza y que no están cerradas (feriados, etc.)
+    ahora = timezone.now()
+    fechas = [
+        fecha for fecha in fechas_de_serie(fecha_inicio, fecha_fin, dias) if _todavia_no_empieza(bloque, fecha, ahora)
+    ]
+    fechas = disponibilidad.fechas_abiertas(bloque.id, fechas)
+    if not fechas:
+        raise ValidationError("Error: La serie no tiene fechas futuras.")
+
+    serie = None
+    with escritura():
+        ya_reservadas = set(
+            Reserva.objects.filter(usuario=usuario, bloque=bloque, fecha__in=fechas).values_list('fecha', flat=True)
+        )
+        candidatas = [fecha for fecha in fechas if fecha not in ya_reservadas]
+
+        OcupacionBloque.objects.bulk_create(
+            [OcupacionBloque(bloque=bloque, fecha=fecha) for fecha in candidatas], ignore_conflicts=True
+        )
+        con_cupo = list(
+            OcupacionBloque.objects.select_for_update()
+            .filter(bloque=bloque, fecha__in=candidatas, ocupados__lt=bloque.capacidad_maxima)
+            .values_list('fecha', flat=True)
+        )
+        tomados = OcupacionBloque.objects.filter(
+            bloque=bloque, fecha__in=con_cupo, ocupados__lt=bloque.capacidad_maxima
+        ).update(ocupados=F('ocupados') + 1)
+        if tomados != len(con_cupo):
+            # No debería pasar con las filas bloqueadas; si pasa, deshacemos todo
+            raise ValidationError("Error: Hubo demasiadas reservas al mismo tiempo, intenta de nuevo.")
+
+        # La serie solo se crea si tomó al menos un cupo
+        if con_cupo:
+            serie = SerieReserva.objects.create(
+                usuario=usuario,
+                bloque=bloque,
+                dias_semana=','.join(str(dia) for dia in dias),
+                fecha_inicio=fecha_inicio,
+                fecha_fin=fecha_fin,
+            )
+            # bulk_create no pasa por Reserva.save: los cupos ya se tomaron arriba
+            reservas = Reserva.objects.bulk_create(
+                [Reserva(usuario=usuario, bloque=bloque, fecha=fecha, serie=serie) for fecha in con_cupo],
+                batch_size=500,
+            )
+            notificaciones.al_crear_serie(serie, reservas)
+            estadisticas.sumar({(bloque.id, fecha): (1, 0) for fecha in con_cupo})
+            avisar_cambio([(bloque.id, fecha) for fecha in con_cupo])
+
+    llenas = sorted(set(candidatas) - set(con_cupo))
+    for fecha in llenas:
+        metricas.contar_rechazo(bloque.id, fecha)
+    if serie is None:
+        if llenas:
+            raise ValidationError("Error: Ninguna fecha de la serie tiene cupo, no se creó la serie.")
+        raise ValidationError("Error: Ya tenías reservadas todas las fechas de la serie.")
+    return serie, sorted(con_cupo), llenas, sorted(ya_reservadas)
+
+
+def cancelar_serie(usuario, serie_id):
+    """
+    Cancela las reservas de la serie cuyo bloque todavía no empieza con un
+    solo borrado masivo (ReservaQuerySet.delete ajusta los cupos y la lista
+    de espera) y borra la serie; las reservas pasadas se quedan, sin serie.
+    Devuelve (serie, reservas canceladas) o (None, 0).
+    """
+    serie = SerieReserva.objects.select_related('bloque').filter(id=serie_id, usuario=usuario).first()
+    if serie is None:
+        return None, 0
+
+    # Hoy solo si el bloque todavía no empieza, igual que al crearla
+    hoy = timezone.localdate()
+    desde = hoy if _todavia_no_empieza(serie.bloque, hoy, timezone.now()) else hoy + datetime.timedelta(days=1)
+    with escritura():
+        canceladas, _ = Reserva.objects.filter(serie=serie, fecha__gte=desde).delete()
+        serie.delete()
+    return serie, canceladas
@@ -0,0 +1,21 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import disponibilidad, metricas
+from .models import BloqueHorario, Cierre
+
+
+@receiver(post_save, sender=BloqueHorario)
+@receiver(post_delete, sender=BloqueHorario)
+@receiver(post_save, sender=Cierre)
+@receiver(post_delete, sender=Cierre)
+def bloques_modificados(sender, **kwargs):
+    """Si cambian los bloques (nombre, horario, capacidad, días) o los cierres, la grilla en caché queda vieja."""
+    disponibilidad.invalidar_bloques()
+
+
+@receiver(connection_created)
+def conexion_abierta(sender, connection, **kwargs):
+    """Cada conexión nueva mide sus consultas para /metrics (ver metricas.medir_consultas)."""
+    metricas.instalar_medicion(connection)
@@ -0,0 +1,171 @@
+"""
+Cola de tareas en la base de datos, para sacar trabajo de las peticiones.
+
+Una vista (o Reserva.save) solo encola: un INSERT en la tabla Tarea dentro
+de su misma transacción, así la tarea existe si y solo si la reserva se
+confirmó. Los correos, que pueden tardar segundos, los manda después
+"python manage.py runworker", un proceso aparte que:
+
+1. Toma un lote de tareas pendientes cuyo `ejecutar_desde` ya pasó (las
+   programadas, como los recordatorios, esperan su hora) y las marca
+   en_curso en una sola transacción corta.
+2. Las ejecuta fuera de la transacción, con una sola conexión de correo
+   para todo el lote.
+3. Marca las que terminaron bien con un solo UPDATE. Las que fallan vuelven
+   a quedar pendientes con una espera creciente (30 s, 2 min, 8 min, ...)
+   hasta `max_intentos`; después quedan como fallidas, con el error, para
+   revisarlas en el admin.
+
+Una tarea en_curso por más de settings.TAREAS_TIEMPO_MAXIMO (el worker se
+cayó a la mitad) vuelve a pendiente: cada tarea se ejecuta al menos una
+vez, así que deben poder repetirse sin daño (ej. revisar que la reserva
+siga existiendo antes de avisar).
+
+Las funciones que se pueden encolar se registran con @registrar('nombre');
+las de los correos están en notificaciones.py. Las tareas de
+settings.TAREAS_PERIODICAS las vuelve a programar el propio worker.
+"""
+import contextvars
+import datetime
+import traceback
+
+from django.conf import settings
+from django.core import mail
+from django.db.models import F
+from django.utils import timezone
+
+from . import disponibilidad
+from .escrituras import escritura
+from .models import Tarea
+
+# nombre -> función que recibe los argumentos de la tarea
+REGISTRADAS = {}
+
+# Conexión de correo del lote que se está ejecutando (ver correo())
+_conexion_correo = contextvars.ContextVar('conexion_correo', default=None)
+
+
+def registrar(nombre):
+    def decorador(funcion):
+        REGISTRADAS[nombre] = funcion
+        return funcion
+    return decorador
+
+
+def nueva(nombre, cuando=None, **argumentos):
+    """Tarea sin guardar, para encolar varias con un solo INSERT (ver encolar_varias)."""
+    if nombre not in REGISTRADAS:
+        raise ValueError(f"No hay una tarea registrada con el nombre {nombre!r}")
+    return Tarea(nombre=nombre, argumentos=argumentos, ejecutar_desde=cuando or timezone.now())
+
+
+def encolar(nombre, cuando=None, **argumentos):
+    """Encola `nombre(**argumentos)` para ahora o para `cuando`. Los argumentos deben ser JSON."""
+    return encolar_varias([nueva(nombre, cuando, **argumentos)])[0]
+
+
+def encolar_varias(tareas):
+    """Guarda varias tareas de nueva() con un solo INSERT."""
+    return Tarea.objects.bulk_create(tareas)
+
+
+def correo():
+    """Conexión de correo compartida por el lote (una sola conexión SMTP), o una nueva fuera del worker."""
+    return _conexion_correo.get() or mail.get_connection()
+
+
+# ----- Worker -----
+
+def tomar_lote(cantidad):
+    """Marca en_curso hasta `cantidad` tareas que ya toca ejecutar y las devuelve."""
+    ahora = timezone.now()
+    with escritura():
+        # Las que quedaron en_curso de un worker que se cayó vuelven a la fila
+        Tarea.objects.filter(
+            estado=Tarea.EN_CURSO, tomada_en__lt=ahora - datetime.timedelta(seconds=settings.TAREAS_TIEMPO_MAXIMO)
+        ).update(estado=Tarea.PENDIENTE)
+
+        ids = list(
+            Tarea.objects.select_for_update(skip_locked=True)
+            .filter(estado=Tarea.PENDIENTE, ejecutar_desde__lte=ahora)
+            .order_by('ejecutar_desde', 'id')
+            .values_list('id', flat=True)[:cantidad]
+        )
+        if not ids:
+            return []
+        Tarea.objects.filter(id__in=ids).update(estado=Tarea.EN_CURSO, tomada_en=ahora, intentos=F('intentos') + 1)
+        return list(Tarea.objects.filter(id__in=ids).order_by('ejecutar_desde', 'id'))
+
+
+def _espera(intentos):
+    return datetime.timedelta(seconds=30 * 4 ** (intentos - 1))
+
+
+def ejecutar_lote(tareas):
+    """Ejecuta las tareas tomadas y guarda el resultado. Devuelve (hechas, con error)."""
+    hechas, errores = [], []
+    with mail.get_connection() as conexion:
+        marca = _conexion_correo.set(conexion)
+        try:
+            for tarea in tareas:
+                try:
+                    REGISTRADAS[tarea.nombre](**tarea.argumentos)
+                except Exception:
+                    errores.append((tarea, traceback.format_exc()))
+                else:
+                    hechas.append(tarea.id)
+        finally:
+            _conexion_correo.reset(marca)
+
+    ahora = timezone.now()
+    with escritura():
+        if hechas:
+            Tarea.objects.filter(id__in=hechas).update(estado=Tarea.HECHA, ultimo_error='')
+        for tarea, error in errores:
+            if tarea.intentos >= tarea.max_intentos:
+                cambios = {'estado': Tarea.FALLIDA}
+            else:
+                cambios = {'estado': Tarea.PENDIENTE, 'ejecutar_desde': ahora + _espera(tarea.intentos)}
+            Tarea.objects.filter(id=tarea.id).update(ultimo_error=error, **cambios)
+    return len(hechas), len(errores)
+
+
+def programar_periodicas():
+    """Encola las tareas de settings.TAREAS_PERIODICAS que no tengan ya una pendiente."""
+    periodicas = settings.TAREAS_PERIODICAS
+    if not periodicas:
+        return 0
+    ya_programadas = set(
+        Tarea.objects.filter(nombre__in=periodicas, estado__in=[Tarea.PENDIENTE, Tarea.EN_CURSO])
+        .values_list('nombre', flat=True)
+    )
+    ahora = timezone.now()
+    nuevas = [
+        nueva(nombre, ahora + datetime.timedelta(seconds=segundos))
+        for nombre, segundos in periodicas.items() if nombre not in ya_programadas
+    ]
+    if nuevas:
+        with escritura():
+            encolar_varias(nuevas)
+    return len(nuevas)
+
+
+def limpiar(dias=None):
+    """Borra las tareas hechas hace más de `dias` (settings.TAREAS_GUARDAR_DIAS)."""
+    limite = timezone.now() - datetime.timedelta(days=settings.TAREAS_GUARDAR_DIAS if dias is None else dias)
+    with escritura():
+        # Sin relaciones ni señales: Django lo hace con un solo DELETE
+        return Tarea.objects.filter(estado=Tarea.HECHA, ejecutar_desde__lt=limite).delete()[0]
+
+
+# ----- Tareas que no son correos -----
+
+@registrar('calentar_agenda')
+def calentar_agenda():
+    """
+    Como el comando calentar_agenda. Solo sirve si el caché es compartido
+    entre procesos (Redis, memcached, archivos): con LocMemCache el worker
+    calentaría su propio caché y no el del servidor web.
+    """
+    primera, ultima = disponibilidad.semanas_visibles()
+    disponibilidad.calentar_semanas(primera, (ultima - primera).days // 7 + 1)
@@ -0,0 +1,72 @@
+"""
+CSS y JavaScript de las páginas: los archivos propios de static/ si ya se
+corrió "python manage.py construir_estaticos", o los CDN si no
+(ver agendamiento/estaticos.py).
+
+    {% load recursos %}
+    {% estilos %}           Tailwind y la fuente Inter
+    {% scripts_graficos %}  Chart.js y chartjs-plugin-datalabels
+    {% script_qr %}         qrcode-generator (código de entrada)
+"""
+from functools import lru_cache
+
+from django import template
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import ManifestFilesMixin, staticfiles_storage
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
+
+register = template.Library()
+
+ESTILOS_CDN = mark_safe(
+    '<script src="https://cdn.tailwindcss.com"></script>\n'
+    '<link rel="preconnect" href="https://fonts.googleapis.com">\n'
+    '<link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>\n'
+    '<link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap" rel="stylesheet">'
+)
+GRAFICOS = [
+    ('vendor/chart.umd.js', 'https://cdn.jsdelivr.net/npm/chart.js@4.4.7'),
+    ('vendor/chartjs-plugin-datalabels.min.js', 'https://cdn.jsdelivr.net/npm/chartjs-plugin-datalabels@2.2.0'),
+]
+QR = ('vendor/qrcode.js', 'https://cdn.jsdelivr.net/npm/qrcode-generator@1.4.4/qrcode.js')
+
+
+@lru_cache
+def construido(nombre):
+    """
+    Si construir_estaticos ya generó `nombre` (se revisa una vez por proceso).
+    Con el manifest (DEBUG = False) tiene que estar en él, no solo en static/:
+    si falta, static() lanzaría ValueError y la página daría error 500.
+    """
+    if isinstance(staticfiles_storage, ManifestFilesMixin):
+        try:
+            staticfiles_storage.stored_name(nombre)
+        except ValueError:
+            return False
+        return True
+    return finders.find(nombre) is not None
+
+
+@register.simple_tag
+def estilos():
+    if not construido('css/app.css'):
+        return ESTILOS_CDN
+    return format_html(
+        '<link rel="preload" href="{}" as="font" type="font/woff2" crossorigin>\n<link rel="stylesheet" href="{}">',
+        static('vendor/inter/inter-latin-400-normal.woff2'), static('css/app.css'),
+    )
+
+
+@register.simple_tag
+def scripts_graficos():
+    return format_html_join(
+        '\n', '<script src="{}"></script>',
+        ((static(local) if construido(local) else cdn,) for local, cdn in GRAFICOS),
+    )
+
+
+@register.simple_tag
+def script_qr():
+    local, cdn = QR
+    return format_html('<script src="{}"></script>', static(local) if construido(local) else cdn)
@@ -0,0 +1,40 @@
+"""
+Navegación por fechas (date_hierarchy) de la lista de reservas del admin,
+leída de OcupacionBloque en vez de Reserva.
+
+La de Django busca las fechas con reservas con MIN/MAX y DISTINCT sobre la
+tabla Reserva, que con millones de filas la recorre entera. Los contadores
+tienen una fila por bloque y día, así que la misma navegación sale de una
+tabla mucho más chica. Si hay una búsqueda (filtros que los contadores no
+conocen), se usa la de Django.
+
+    {% load reservas_admin %}
+    {% jerarquia_fechas cl %}
+"""
+from django import template
+from django.contrib.admin.templatetags.admin_list import date_hierarchy
+
+from agendamiento.models import OcupacionBloque
+from agendamiento.ocupacion import filtros_en_contadores
+
+register = template.Library()
+
+
+class _ListaDesdeContadores:
+    """La ChangeList del admin, pero con los contadores en vez de las reservas."""
+
+    def __init__(self, cl, contadores):
+        self._cl = cl
+        self.model = OcupacionBloque
+        self.queryset = contadores
+
+    def __getattr__(self, nombre):
+        return getattr(self._cl, nombre)
+
+
+@register.inclusion_tag('admin/date_hierarchy.html')
+def jerarquia_fechas(cl):
+    filtros = filtros_en_contadores(cl.queryset)
+    if filtros is None:
+        return date_hierarchy(cl)
+    return date_hierarchy(_ListaDesdeContadores(cl, OcupacionBloque.objects.filter(ocupados__gt=0, **filtros)))
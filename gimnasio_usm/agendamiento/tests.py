@@ -1,3 +1,1290 @@
-from django.test import TestCase
+"""
+Pruebas de la app.
+
+PresupuestoVistasTest: FabricaDatos llena la base de datos de prueba con
+miles de usuarios y un semestre completo de reservas. Cada vista tiene un
+máximo de consultas SQL (PRESUPUESTOS). Además cada prueba vuelve a medir
+después de agregar más datos (FabricaDatos.crecer) y falla si la cantidad
+de consultas cambió: así se detecta un N+1 o una consulta que recorre toda
+la tabla aunque con pocos datos parezca barata.
+
+El tiempo depende de la máquina, así que los milisegundos de PRESUPUESTOS
+solo se revisan si se pide (en un equipo lento se pueden relajar con
+PRESUPUESTO_FACTOR_TIEMPO=2):
+PRESUPUESTO_TIEMPO=1 python manage.py test agendamiento
+
+Las demás clases prueban el comportamiento de cada módulo con pocos datos.
+"""
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core import mail
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import AsyncRequestFactory, Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from django.utils import timezone
+
+from . import (
+    archivo, asistencia, busqueda, disponibilidad, encuesta, escrituras, estadisticas, estaticos, exportar, horario,
+    limites, lista_espera, metricas, series, vistas_async,
+)
+from .disponibilidad import lunes_entre, semanas_visibles
+from .middleware import LimitePeticionesMiddleware
+from .estadisticas import calcular_tablero, recalcular_estadisticas
+from .models import (
+    Asistencia, BloqueHorario, Cierre, EstadisticaDiaria, ListaEspera, OcupacionBloque, OpcionEncuesta, Reserva,
+    ReservaArchivada, RespuestaEncuesta, ResumenDiario, SerieReserva, Sugerencia, Tarea,
+)
+from .ocupacion import cupos_ocupados, recalcular_ocupacion
+from .templatetags import recursos
+from .urls import rutas
+
+MEDIR_TIEMPO = os.environ.get('PRESUPUESTO_TIEMPO') == '1'
+FACTOR_TIEMPO = float(os.environ.get('PRESUPUESTO_FACTOR_TIEMPO', 1))
+
+# {vista: (máximo de consultas, máximo de milisegundos)}, medidos con el caché
+# vacío: incluyen armar la estructura de la semana (bloques y cierres). Las
+# consultas están justas: si un cambio necesita una más, se sube aquí con un
+# comentario que diga cuál es y por qué no se puede evitar.
+PRESUPUESTOS = {
+    'vista_agendamiento GET': (7, 150),
+    'vista_agendamiento otra semana': (7, 150),
+    'vista_mes': (6, 150),
+    'vista_agendamiento POST': (11, 100),  # incluye encolar los correos (ver notificaciones.py)
+    'cancelar_reserva': (9, 100),
+    'buzon_sugerencias GET': (2, 50),
+    'buzon_sugerencias POST': (3, 50),
+    'api_agenda': (6, 100),
+    'api_reservar': (12, 100),  # ídem
+    'api_cancelar': (12, 100),  # cancelar_reserva + la celda actualizada de la respuesta
+    'admin reservas': (7, 500),
+    'admin reservas por fecha': (6, 500),
+    'admin sugerencias': (5, 400),
+    'admin buscar sugerencias': (5, 300),
+    'admin tablero': (6, 300),
+}
+
+
+class FabricaDatos:
+    """
+    Crea datos de prueba con bulk_create (miles de filas en pocas consultas).
+
+    Las reservas de cada (bloque, día) llegan hasta `LLENADO` cupos, así
+    todavía queda espacio para reservar en las pruebas.
+    """
+    LLENADO = 8
+
+    def __init__(self, usuarios=2000, semanas=20):
+        call_command('crear_bloques', stdout=io.StringIO())
+        self.bloques = list(BloqueHorario.objects.order_by('hora_inicio'))
+        self.lunes = timezone.localdate() - datetime.timedelta(days=timezone.localdate().weekday())
+        self.usuarios = []
+        self.siguiente_usuario = 0
+
+        self.agregar_usuarios(usuarios)
+        # Un semestre: la mitad de las semanas antes de la actual y la mitad después
+        self.agregar_semanas(range(-(semanas // 2), semanas - semanas // 2))
+        self.agregar_sugerencias(usuarios)
+
+        self.socio = User.objects.create_user('socio', password='clave-socio')
+        self.admin = User.objects.create_superuser('admin', password='clave-admin')
+        self.agregar_series(self.socio, 2)
+
+    def agregar_usuarios(self, cantidad):
+        inicio = len(self.usuarios)
+        User.objects.bulk_create(
+            [User(username=f'usuario{i}', password='!') for i in range(inicio, inicio + cantidad)],
+            batch_size=1000,
+        )
+        self.usuarios = list(User.objects.filter(username__startswith='usuario').order_by('id'))
+
+    def agregar_semanas(self, semanas):
+        """Llena los días hábiles de cada semana (relativa a la actual) y rehace contadores y estadísticas."""
+        reservas = []
+        for semana in semanas:
+            for dia in range(5):
+                fecha = self.lunes + datetime.timedelta(weeks=semana, days=dia)
+                for bloque in self.bloques:
+                    for _ in range(self.LLENADO):
+                        usuario = self.usuarios[self.siguiente_usuario % len(self.usuarios)]
+                        self.siguiente_usuario += 1
+                        reservas.append(Reserva(usuario=usuario, bloque=bloque, fecha=fecha))
+        Reserva.objects.bulk_create(reservas, batch_size=1000, ignore_conflicts=True)
+        recalcular_ocupacion()
+        recalcular_estadisticas()
+
+    def agregar_sugerencias(self, cantidad):
+        Sugerencia.objects.bulk_create(
+            [Sugerencia(usuario=self.usuarios[i % len(self.usuarios)], texto=f'Sugerencia {i}') for i in range(cantidad)],
+            batch_size=1000,
+        )
+
+    def agregar_series(self, usuario, cantidad):
+        SerieReserva.objects.bulk_create([
+            SerieReserva(
+                usuario=usuario,
+                bloque=self.bloques[i % len(self.bloques)],
+                dias_semana='0,2,4',
+                fecha_inicio=self.lunes,
+                fecha_fin=self.lunes + datetime.timedelta(weeks=10),
+            )
+            for i in range(cantidad)
+        ])
+
+    def crecer(self):
+        """Más de todo: usuarios, semanas anteriores, sugerencias y series del socio."""
+        self.agregar_usuarios(500)
+        self.agregar_semanas(range(-20, -16))
+        self.agregar_sugerencias(500)
+        self.agregar_series(self.socio, 3)
+        Reserva.objects.bulk_create([
+            Reserva(usuario=self.socio, bloque=bloque, fecha=self.lunes - datetime.timedelta(weeks=20))
+            for bloque in self.bloques
+        ])
+
+
+class UrlsAsync:
+    """ROOT_URLCONF con las vistas asíncronas (como con settings.AGENDA_VISTAS_ASYNC)."""
+    urlpatterns = [
+        path('accounts/', include('django.contrib.auth.urls')),
+        path('', include(rutas(vistas_async))),
+    ]
+
+
+class PruebaConDatos(TestCase):
+    """Base de las pruebas: datos de FabricaDatos (pocos, salvo que la clase pida más) y el socio con sesión."""
+    DATOS = {'usuarios': 30, 'semanas': 3}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = FabricaDatos(**cls.DATOS)
+
+    def setUp(self):
+        # Cada prueba parte con el caché vacío (grilla, cubetas de límites)
+        cache.clear()
+        self.client.force_login(self.datos.socio)
+
+    def fecha_libre(self, i):
+        """(bloque, fecha) distinto para cada i, en la semana que viene (todavía con cupo)."""
+        lunes = self.datos.lunes + datetime.timedelta(weeks=1)
+        bloque = self.datos.bloques[i % len(self.datos.bloques)]
+        return bloque, lunes + datetime.timedelta(days=i // len(self.datos.bloques))
+
+    def llenar(self, bloque, fecha):
+        """Completa la capacidad del bloque ese día y devuelve los usuarios que quedan sin reserva."""
+        libres = list(User.objects.exclude(reservas__bloque=bloque, reservas__fecha=fecha).order_by('id'))
+        faltan = bloque.capacidad_maxima - cupos_ocupados(bloque.id, fecha)
+        for usuario in libres[:faltan]:
+            Reserva.objects.create(usuario=usuario, bloque=bloque, fecha=fecha)
+        return libres[faltan:]
+
+
+class PresupuestoVistasTest(PruebaConDatos):
+    """Presupuestos de consultas (y de tiempo, con PRESUPUESTO_TIEMPO=1) de cada vista, con un semestre de datos."""
+    DATOS = {}
+
+    def medir(self, hacer_peticion):
+        # Caché vacío: medimos el peor caso, cuando la grilla se lee de la base de datos
+        cache.clear()
+        with CaptureQueriesContext(connection) as consultas:
+            inicio = time.perf_counter()
+            respuesta = hacer_peticion()
+            milisegundos = (time.perf_counter() - inicio) * 1000
+        return respuesta, len(consultas), milisegundos, consultas
+
+    def comprobar(self, nombre, preparar, estado=200):
+        """
+        Mide la vista con el semestre completo y después de crecer los datos.
+
+        `preparar(i)` deja lista la i-ésima petición (fuera de la medición) y
+        devuelve una función sin argumentos que la hace. La petición 0 es de
+        calentamiento (plantillas, conexiones) y no se mide.
+        """
+        max_consultas, max_ms = PRESUPUESTOS[nombre]
+        self.medir(preparar(0))
+
+        respuesta, consultas, milisegundos, capturadas = self.medir(preparar(1))
+        self.assertEqual(respuesta.status_code, estado)
+        self.assertLessEqual(
+            consultas, max_consultas,
+            f"{nombre}: {consultas} consultas (máximo {max_consultas}):\n"
+            + '\n'.join(c['sql'] for c in capturadas.captured_queries),
+        )
+        if MEDIR_TIEMPO:
+            self.assertLessEqual(milisegundos, max_ms * FACTOR_TIEMPO, f"{nombre}: {milisegundos:.0f} ms (máximo {max_ms})")
+
+        self.datos.crecer()
+        respuesta, consultas_con_mas_datos, _, capturadas = self.medir(preparar(2))
+        self.assertEqual(respuesta.status_code, estado)
+        self.assertEqual(
+            consultas_con_mas_datos, consultas,
+            f"{nombre}: las consultas crecen con los datos ({consultas} -> {consultas_con_mas_datos}):\n"
+            + '\n'.join(c['sql'] for c in capturadas.captured_queries),
+        )
+
+    # ----- Agendamiento -----
+
+    def test_agendar_get(self):
+        def preparar(i):
+            return lambda: self.client.get(reverse('vista_agendamiento'))
+        self.comprobar('vista_agendamiento GET', preparar)
+
+    def test_agendar_otra_semana(self):
+        def preparar(i):
+            semana = self.datos.lunes + datetime.timedelta(weeks=i + 1)
+            return lambda: self.client.get(reverse('vista_agendamiento'), {'semana': semana.isoformat()})
+        self.comprobar('vista_agendamiento otra semana', preparar)
+
+    def test_cambiar_de_semana_precalentada(self):
+        # Con las semanas en caché, cambiar de semana solo consulta lo propio
+        # del usuario: siempre las mismas consultas y nada de bloques, cierres ni cupos
+        call_command('calentar_agenda', stdout=io.StringIO())
+        self.client.get(reverse('vista_agendamiento'))
+        conteos = []
+        for semana in lunes_entre(*semanas_visibles()):
+            with CaptureQueriesContext(connection) as consultas:
+                respuesta = self.client.get(reverse('vista_agendamiento'), {'semana': semana.isoformat()})
+            self.assertEqual(respuesta.status_code, 200)
+            tablas = ('agendamiento_bloquehorario', 'agendamiento_cierre', 'agendamiento_ocupacionbloque')
+            self.assertFalse([
+                c['sql'] for c in consultas.captured_queries if any(f'FROM "{t}"' in c['sql'] for t in tablas)
+            ])
+            conteos.append(len(consultas))
+        self.assertEqual(len(set(conteos)), 1, conteos)
+
+    def test_vista_mes(self):
+        def preparar(i):
+            return lambda: self.client.get(reverse('vista_mes'), {'mes': self.datos.lunes.strftime('%Y-%m')})
+        self.comprobar('vista_mes', preparar)
+
+    def test_agendar_post(self):
+        def preparar(i):
+            bloque, fecha = self.fecha_libre(i)
+            datos = {'bloque_id': bloque.id, 'fecha': fecha.isoformat()}
+            return lambda: self.client.post(reverse('vista_agendamiento'), datos)
+        self.comprobar('vista_agendamiento POST', preparar, estado=302)
+        self.assertEqual(Reserva.objects.filter(usuario=self.datos.socio, fecha__gt=self.datos.lunes).count(), 3)
+
+    def test_cancelar_reserva(self):
+        def preparar(i):
+            bloque, fecha = self.fecha_libre(i)
+            reserva = Reserva.objects.create(usuario=self.datos.socio, bloque=bloque, fecha=fecha)
+            return lambda: self.client.post(reverse('cancelar_reserva', args=[reserva.id]))
+        self.comprobar('cancelar_reserva', preparar, estado=302)
+        self.assertFalse(Reserva.objects.filter(usuario=self.datos.socio, fecha__gt=self.datos.lunes).exists())
+
+    def test_reservar_no_consulta_cierres(self):
+        # Con la estructura de la semana en caché, los cierres no cuestan consultas
+        bloque, fecha = self.fecha_libre(0)
+        self.client.get(reverse('api_agenda'), {'semana': fecha.isoformat()})
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.post(reverse('api_reservar'), {'bloque_id': bloque.id, 'fecha': fecha.isoformat()})
+        self.assertEqual(respuesta.status_code, 201)
+        self.assertFalse([c for c in consultas.captured_queries if 'agendamiento_cierre' in c['sql']])
+
+    # ----- Sugerencias -----
+
+    def test_buzon_get(self):
+        def preparar(i):
+            return lambda: self.client.get(reverse('buzon_sugerencias'))
+        self.comprobar('buzon_sugerencias GET', preparar)
+
+    def test_buzon_post(self):
+        def preparar(i):
+            return lambda: self.client.post(reverse('buzon_sugerencias'), {'sugerencia': f'Más máquinas {i}'})
+        self.comprobar('buzon_sugerencias POST', preparar, estado=302)
+
+    # ----- API JSON -----
+
+    def test_api_agenda(self):
+        def preparar(i):
+            return lambda: self.client.get(reverse('api_agenda'))
+        self.comprobar('api_agenda', preparar)
+
+    def test_api_reservar(self):
+        def preparar(i):
+            bloque, fecha = self.fecha_libre(i)
+            datos = {'bloque_id': bloque.id, 'fecha': fecha.isoformat()}
+            return lambda: self.client.post(reverse('api_reservar'), datos)
+        self.comprobar('api_reservar', preparar, estado=201)
+
+    def test_api_cancelar(self):
+        def preparar(i):
+            bloque, fecha = self.fecha_libre(i)
+            reserva = Reserva.objects.create(usuario=self.datos.socio, bloque=bloque, fecha=fecha)
+            return lambda: self.client.post(reverse('api_cancelar', args=[reserva.id]))
+        self.comprobar('api_cancelar', preparar)
+
+    # ----- Admin -----
+
+    def test_admin_reservas(self):
+        self.client.force_login(self.datos.admin)
+
+        def preparar(i):
+            return lambda: self.client.get(reverse('admin:agendamiento_reserva_changelist'))
+        self.comprobar('admin reservas', preparar)
+
+    def test_admin_reservas_por_fecha(self):
+        self.client.force_login(self.datos.admin)
+        hoy = timezone.localdate()
+
+        def preparar(i):
+            filtro = {'fecha__year': hoy.year, 'fecha__month': hoy.month}
+            return lambda: self.client.get(reverse('admin:agendamiento_reserva_changelist'), filtro)
+        self.comprobar('admin reservas por fecha', preparar)
+
+    def test_admin_sugerencias(self):
+        self.client.force_login(self.datos.admin)
+
+        def preparar(i):
+            return lambda: self.client.get(reverse('admin:agendamiento_sugerencia_changelist'))
+        self.comprobar('admin sugerencias', preparar)
+
+    def test_admin_buscar_sugerencias(self):
+        self.client.force_login(self.datos.admin)
+
+        def preparar(i):
+            return lambda: self.client.get(reverse('admin:agendamiento_sugerencia_buscar'), {'q': 'sugerencia 1'})
+        self.comprobar('admin buscar sugerencias', preparar)
+
+    def test_admin_tablero(self):
+        self.client.force_login(self.datos.admin)
+        desde = self.datos.lunes - datetime.timedelta(weeks=30)
+
+        def preparar(i):
+            filtro = {'desde': desde.isoformat(), 'hasta': (self.datos.lunes + datetime.timedelta(weeks=10)).isoformat()}
+            return lambda: self.client.get(reverse('admin:agendamiento_estadisticadiaria_changelist'), filtro)
+        self.comprobar('admin tablero', preparar)
+
+
+class VistaMesTest(PruebaConDatos):
+    """Calendario del mes (ver views.vista_mes)."""
+
+    def test_meses_fuera_de_rango(self):
+        primera, ultima = semanas_visibles()
+        for mes, esperado in (
+            ('9999-12', (ultima + datetime.timedelta(days=4)).replace(day=1)),
+            ('0001-01', primera.replace(day=1)),
+            ('no-es-mes', timezone.localdate().replace(day=1)),
+        ):
+            respuesta = self.client.get(reverse('vista_mes'), {'mes': mes})
+            self.assertEqual(respuesta.status_code, 200)
+            self.assertEqual(respuesta.context['mes'], esperado)
+
+
+class VistasAsyncTest(PruebaConDatos):
+    """Las vistas asíncronas (vistas_async.py) con el ORM asíncrono."""
+
+    @override_settings(ROOT_URLCONF=UrlsAsync)
+    async def test_vistas_async(self):
+        await self.async_client.aforce_login(self.datos.socio)
+        bloque, fecha = self.fecha_libre(0)
+        consultas_antes = metricas.consultas._valores.get(('api_reservar',), [[], 0.0])[1]
+
+        respuesta = await self.async_client.get(reverse('vista_agendamiento'))
+        self.assertContains(respuesta, bloque.nombre)
+
+        respuesta = await self.async_client.post(reverse('api_reservar'), {'bloque_id': bloque.id, 'fecha': fecha.isoformat()})
+        self.assertEqual(respuesta.status_code, 201)
+        reserva_id = respuesta.json()['reserva_id']
+        # MetricasMiddleware cuenta también las consultas hechas fuera del event loop
+        self.assertGreater(metricas.consultas._valores[('api_reservar',)][1], consultas_antes)
+
+        respuesta = await self.async_client.get(reverse('api_agenda'), {'semana': fecha.isoformat()})
+        self.assertEqual(respuesta.status_code, 200)
+        repetida = await self.async_client.get(
+            reverse('api_agenda'), {'semana': fecha.isoformat()}, headers={'if-none-match': respuesta['ETag']}
+        )
+        self.assertEqual(repetida.status_code, 304)
+
+        respuesta = await self.async_client.post(reverse('api_cancelar', args=[reserva_id]))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertFalse(await Reserva.objects.filter(id=reserva_id).aexists())
+
+    async def test_cache_de_la_grilla_fuera_del_event_loop(self):
+        hilos = []
+
+        def registrar(metodo):
+            def envoltura(*args, **kwargs):
+                hilos.append(threading.get_ident())
+                return metodo(*args, **kwargs)
+            return envoltura
+
+        lunes = self.datos.lunes
+        with mock.patch.object(LocMemCache, 'get', registrar(LocMemCache.get)), \
+                mock.patch.object(LocMemCache, 'add', registrar(LocMemCache.add)), \
+                mock.patch.object(LocMemCache, 'set', registrar(LocMemCache.set)):
+            # Con el caché vacío y después desde el caché
+            for _ in range(2):
+                dias, filas = await disponibilidad.agrilla_usuario(self.datos.socio, lunes)
+                await disponibilidad.aetag_semana(lunes, self.datos.socio.pk)
+        self.assertEqual((dias, filas), await sync_to_async(disponibilidad.grilla_usuario)(self.datos.socio, lunes))
+        self.assertTrue(hilos)
+        self.assertNotIn(threading.get_ident(), hilos)
+
+
+class BusquedaTest(PruebaConDatos):
+    """Búsqueda de texto completo en las sugerencias (ver busqueda.py)."""
+
+    def test_buscar_sugerencias(self):
+        usuario = self.datos.usuarios[0]
+        mejor = Sugerencia.objects.create(usuario=usuario, texto='Más máquinas de remo, las máquinas están llenas')
+        otra = Sugerencia.objects.create(usuario=usuario, texto='Arreglar una máquina de la sala de pesas y las duchas')
+        Sugerencia.objects.create(usuario=usuario, texto='Abrir los sábados')
+
+        # Sin tildes ni mayúsculas, por prefijo y ordenadas por relevancia; las comillas no rompen la consulta
+        resultados = busqueda.buscar('"MAQUINA')
+        self.assertEqual([sugerencia for sugerencia, _ in resultados], [mejor, otra])
+        self.assertIn('<mark>máquinas</mark>', resultados[0][1])
+        self.assertEqual(busqueda.filtrar(Sugerencia.objects.all(), 'maquina duchas').get(), otra)
+
+        # Los triggers siguen los cambios y borrados
+        otra.texto = 'Arreglar las duchas'
+        otra.save()
+        mejor.delete()
+        self.assertEqual(busqueda.buscar('maquinas'), [])
+        self.assertIn('duchas', [termino for termino, _, _ in busqueda.terminos_frecuentes(100)])
+        self.assertNotIn('las', [termino for termino, _, _ in busqueda.terminos_frecuentes(100)])
+
+        # La lista del admin también busca con el índice
+        self.client.force_login(self.datos.admin)
+        respuesta = self.client.get(reverse('admin:agendamiento_sugerencia_changelist'), {'q': 'duchas'})
+        self.assertEqual(respuesta.context['cl'].result_count, 1)
+
+
+class AdminReservasTest(PruebaConDatos):
+    """Acciones y exportación del admin de reservas."""
+
+    def test_admin_cancelar_bloque_cerrado(self):
+        self.client.force_login(self.datos.admin)
+        bloque, fecha = self.fecha_libre(0)
+        ListaEspera.objects.create(usuario=self.datos.socio, bloque=bloque, fecha=fecha)
+        filtros = {'bloque__id__exact': bloque.id, 'fecha__year': fecha.year, 'fecha__month': fecha.month, 'fecha__day': fecha.day}
+        url = reverse('admin:agendamiento_reserva_changelist') + '?' + urlencode(filtros)
+        reservas = Reserva.objects.filter(bloque=bloque, fecha=fecha).count()
+
+        # El total de la lista sale de los contadores y coincide con las reservas
+        respuesta = self.client.get(url)
+        self.assertEqual(respuesta.context['cl'].result_count, reservas)
+
+        # "Todas las de la lista" (select_across): confirmación por bloque y día, sin cargar cada reserva
+        accion = {'action': 'cancelar_reservas', 'index': 0, 'select_across': 1, '_selected_action': [0]}
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.post(url, accion)
+        self.assertContains(respuesta, f'<strong>{reservas}</strong>')
+        self.assertLess(len(consultas), 10)
+
+        respuesta = self.client.post(url, {**accion, 'confirmar': 1, 'vaciar_espera': 1})
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertFalse(Reserva.objects.filter(bloque=bloque, fecha=fecha).exists())
+        # Nadie de la lista de espera recibió el cupo y el contador quedó en cero
+        self.assertFalse(ListaEspera.objects.filter(bloque=bloque, fecha=fecha).exists())
+        self.assertEqual(OcupacionBloque.objects.get(bloque=bloque, fecha=fecha).ocupados, 0)
+
+    def test_exportar_reservas_en_streaming(self):
+        self.client.force_login(self.datos.admin)
+        desde = self.datos.lunes - datetime.timedelta(weeks=4)
+        hasta = self.datos.lunes
+        esperadas = Reserva.objects.filter(fecha__gte=desde, fecha__lte=hasta).count()
+
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(
+                reverse('admin:agendamiento_reserva_exportar'),
+                {'desde': desde.isoformat(), 'hasta': hasta.isoformat(), 'formato': 'jsonl'},
+            )
+            lineas = b''.join(respuesta.streaming_content).decode().splitlines()
+        self.assertEqual(len(lineas), esperadas)
+        self.assertEqual(set(json.loads(lineas[0])), {'id', 'fecha', 'bloque', 'hora_inicio', 'usuario', 'serie_id'})
+        # Sesión, usuario y una consulta por cada lote de filas
+        self.assertLessEqual(len(consultas), 3 + esperadas // exportar.TAMANO_LOTE)
+
+        # Acción del admin sobre las filas seleccionadas
+        ids = list(Reserva.objects.values_list('id', flat=True)[:3])
+        respuesta = self.client.post(
+            reverse('admin:agendamiento_reserva_changelist'), {'action': 'exportar_csv', '_selected_action': ids}
+        )
+        self.assertEqual(len(b''.join(respuesta.streaming_content).decode().splitlines()), 1 + len(ids))
+        self.assertEqual(
+            self.client.get(reverse('admin:agendamiento_reserva_exportar'), {'desde': 'ayer'}).status_code, 400
+        )
+
+    def test_exportar_csv_sin_formulas(self):
+        self.client.force_login(self.datos.admin)
+        Sugerencia.objects.all().delete()
+        textos = ['=HYPERLINK("http://malo")', '+1', '-2', '@SUMA(A1)', '\tcon tab', 'normal, con coma']
+        Sugerencia.objects.bulk_create([Sugerencia(usuario=self.datos.socio, texto=texto) for texto in textos])
+
+        respuesta = self.client.get(reverse('admin:agendamiento_sugerencia_exportar'), {'formato': 'csv'})
+        filas = list(csv.reader(io.StringIO(b''.join(respuesta.streaming_content).decode('utf-8-sig'))))
+        self.assertEqual(
+            [fila[-1] for fila in filas[1:]],
+            ["'" + texto for texto in textos[:-1]] + ['normal, con coma'],
+        )
+        # En JSONL los textos van tal cual
+        respuesta = self.client.get(reverse('admin:agendamiento_sugerencia_exportar'), {'formato': 'jsonl'})
+        lineas = b''.join(respuesta.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(linea)['texto'] for linea in lineas], textos)
+        # La página de la lista muestra el formulario de exportar
+        self.assertContains(
+            self.client.get(reverse('admin:agendamiento_sugerencia_changelist')),
+            f'action="{reverse("admin:agendamiento_sugerencia_exportar")}"',
+        )
+
+    def test_tablero_cuenta_los_bloques_sin_reservas(self):
+        viernes = self.datos.lunes + datetime.timedelta(weeks=1, days=4)
+        lunes = self.datos.lunes + datetime.timedelta(weeks=2)
+        cerrado, vacio = self.datos.bloques[:2]
+        Cierre.objects.filter(fecha__in=[viernes, lunes]).delete()
+        Cierre.objects.create(fecha=lunes, bloque=cerrado, motivo='Mantención')
+        # El lunes nadie reservó: no hay filas de estadísticas
+        EstadisticaDiaria.objects.filter(fecha=lunes).delete()
+
+        tablero = calcular_tablero(viernes, lunes)
+        filas = EstadisticaDiaria.objects.filter(fecha=viernes)
+        abiertos = [b for b in self.datos.bloques if b.activo and 0 in b.lista_dias and b != cerrado]
+        self.assertEqual(
+            [(s['semana'], s['vigentes'], s['capacidad']) for s in tablero['por_semana']],
+            [
+                (viernes - datetime.timedelta(days=4),
+                 sum(f.reservas - f.cancelaciones for f in filas), sum(f.capacidad for f in filas)),
+                (lunes, 0, sum(b.capacidad_maxima for b in abiertos)),
+            ],
+        )
+        # El bloque abierto sin reservas aparece en 0 %; el cerrado, sin dato
+        lunes_del_mapa = {fila['bloque']: fila['celdas'][0] for fila in tablero['mapa_calor']}
+        self.assertEqual(lunes_del_mapa[vacio.nombre]['uso'], 0.0)
+        self.assertIsNone(lunes_del_mapa[cerrado.nombre])
+
+    def test_tablero_con_rango_enorme_o_al_reves(self):
+        self.client.force_login(self.datos.admin)
+        url = reverse('admin:agendamiento_estadisticadiaria_changelist')
+        largo = datetime.timedelta(days=estadisticas.MAXIMO_DIAS_TABLERO - 1)
+
+        # Hasta el último día posible: se acota a un año y no se pasa de date.max
+        respuesta = self.client.get(url, {'desde': '0001-01-01', 'hasta': '9999-12-31'})
+        self.assertEqual(respuesta.status_code, 200)
+        tablero = respuesta.context['tablero']
+        self.assertEqual((tablero['desde'], tablero['hasta']), (datetime.date.max - largo, datetime.date.max))
+
+        # Al revés se da vuelta
+        viernes = self.datos.lunes + datetime.timedelta(days=4)
+        respuesta = self.client.get(url, {'desde': viernes.isoformat(), 'hasta': self.datos.lunes.isoformat()})
+        tablero = respuesta.context['tablero']
+        self.assertEqual((tablero['desde'], tablero['hasta']), (self.datos.lunes, viernes))
+
+
+class OcupacionTest(PruebaConDatos):
+    """Cupos de OcupacionBloque al reservar (ver ocupacion.py y Reserva.save)."""
+
+    def libres(self, bloque, fecha):
+        """Usuarios sin reserva en el bloque ese día."""
+        return User.objects.exclude(reservas__bloque=bloque, reservas__fecha=fecha).order_by('id')
+
+    def test_bloque_lleno_rechaza_la_siguiente(self):
+        bloque, fecha = self.fecha_libre(0)
+        faltan = bloque.capacidad_maxima - cupos_ocupados(bloque.id, fecha)
+        usuarios = list(self.libres(bloque, fecha)[:faltan + 1])
+        for usuario in usuarios[:-1]:
+            Reserva.objects.create(usuario=usuario, bloque=bloque, fecha=fecha)
+
+        with self.assertRaises(ValidationError):
+            Reserva.objects.create(usuario=usuarios[-1], bloque=bloque, fecha=fecha)
+        self.assertEqual(cupos_ocupados(bloque.id, fecha), bloque.capacidad_maxima)
+        self.assertEqual(Reserva.objects.filter(bloque=bloque, fecha=fecha).count(), bloque.capacidad_maxima)
+
+    def test_insert_fallido_devuelve_el_cupo(self):
+        bloque, fecha = self.fecha_libre(0)
+        Reserva.objects.create(usuario=self.datos.socio, bloque=bloque, fecha=fecha)
+        ocupados = cupos_ocupados(bloque.id, fecha)
+
+        # La reserva repetida toma el cupo, el INSERT falla y el cupo vuelve con el rollback
+        with self.assertRaises(IntegrityError):
+            Reserva.objects.create(usuario=self.datos.socio, bloque=bloque, fecha=fecha)
+        self.assertEqual(cupos_ocupados(bloque.id, fecha), ocupados)
+        self.assertEqual(cupos_ocupados(bloque.id, fecha), Reserva.objects.filter(bloque=bloque, fecha=fecha).count())
+
+    def test_lectura_tardia_no_tapa_la_invalidacion(self):
+        bloque, fecha = self.fecha_libre(0)
+        estructuras = disponibilidad.estructuras_semanas([disponibilidad.lunes_de(fecha)])
+        # Una visita lee la base de datos justo antes de una reserva...
+        claves, ocupacion, faltantes = disponibilidad._celdas_en_cache(estructuras)
+        filas = list(disponibilidad._consulta_celdas(claves, faltantes))
+        with self.captureOnCommitCallbacks(execute=True):
+            Reserva.objects.create(usuario=self.datos.socio, bloque=bloque, fecha=fecha)
+        # ...y guarda su valor viejo en el caché después de la invalidación
+        disponibilidad._completar_celdas(claves, ocupacion, faltantes, filas)
+
+        ocupacion = disponibilidad.ocupacion_semanas(estructuras)
+        self.assertEqual(ocupacion[(bloque.id, fecha)], cupos_ocupados(bloque.id, fecha))
+
+
+class ListaEsperaTest(PruebaConDatos):
+    """Fila de espera de los bloques llenos (ver lista_espera.py)."""
+
+    def test_unirse_solo_si_esta_lleno(self):
+        bloque, fecha = self.fecha_libre(0)
+        with self.assertRaises(ValidationError):
+            lista_espera.unirse(self.datos.socio, bloque.id, fecha.isoformat())
+        self.llenar(bloque, fecha)
+        entrada = lista_espera.unirse(self.datos.socio, bloque.id, fecha.isoformat())
+        self.assertEqual(lista_espera.posicion(entrada), 1)
+        with self.assertRaises(ValidationError):
+            lista_espera.unirse(self.datos.socio, bloque.id, fecha.isoformat())
+
+    def test_promover_en_orden_y_saltar_a_quien_ya_tiene_reserva(self):
+        bloque, fecha = self.fecha_libre(0)
+        segundo, tercero = self.llenar(bloque, fecha)[:2]
+        con_reserva = Reserva.objects.filter(bloque=bloque, fecha=fecha).order_by('id')
+        ya_reservado = con_reserva[0].usuario
+        # El primero de la fila ya tiene reserva (ej. se la agregó el staff)
+        for usuario in (ya_reservado, segundo, tercero):
+            ListaEspera.objects.create(usuario=usuario, bloque=bloque, fecha=fecha)
+
+        con_reserva[1].delete()
+        self.assertTrue(Reserva.objects.filter(usuario=segundo, bloque=bloque, fecha=fecha).exists())
+        fila = ListaEspera.objects.filter(bloque=bloque, fecha=fecha).values_list('usuario', flat=True)
+        self.assertEqual(list(fila), [tercero.id])
+        # El cupo cambió de dueño: sigue lleno
+        self.assertEqual(cupos_ocupados(bloque.id, fecha), bloque.capacidad_maxima)
+
+        con_reserva[2].delete()
+        self.assertTrue(Reserva.objects.filter(usuario=tercero, bloque=bloque, fecha=fecha).exists())
+        self.assertFalse(ListaEspera.objects.filter(bloque=bloque, fecha=fecha).exists())
+
+    def test_no_promover_en_dias_pasados(self):
+        reserva = Reserva.objects.filter(fecha__lt=timezone.localdate()).order_by('fecha').first()
+        ocupados = cupos_ocupados(reserva.bloque_id, reserva.fecha)
+        ListaEspera.objects.create(usuario=self.datos.socio, bloque=reserva.bloque, fecha=reserva.fecha)
+
+        reserva.delete()
+        self.assertFalse(Reserva.objects.filter(usuario=self.datos.socio, fecha=reserva.fecha).exists())
+        self.assertEqual(cupos_ocupados(reserva.bloque_id, reserva.fecha), ocupados - 1)
+        self.assertEqual(lista_espera.promover_grupos({(reserva.bloque_id, reserva.fecha): 1}), {})
+
+
+class SeriesTest(PruebaConDatos):
+    """Reservas recurrentes (ver series.py)."""
+
+    def test_crear_y_cancelar_serie(self):
+        bloque = self.datos.bloques[0]
+        inicio = self.datos.lunes + datetime.timedelta(weeks=2)
+        fin = inicio + datetime.timedelta(days=13)
+        Cierre.objects.filter(fecha__gte=inicio, fecha__lte=fin).delete()
+        fechas = [inicio, inicio + datetime.timedelta(days=2), inicio + datetime.timedelta(weeks=1, days=2)]
+        lleno, ya_mia = inicio + datetime.timedelta(weeks=1), fechas[2]
+        self.llenar(bloque, lleno)
+        Reserva.objects.create(usuario=self.datos.socio, bloque=bloque, fecha=ya_mia)
+        antes = {fecha: cupos_ocupados(bloque.id, fecha) for fecha in [*fechas, lleno]}
+
+        serie, reservadas, llenas, ya_reservadas = series.crear_serie(
+            self.datos.socio, bloque.id, ['0', '2'], inicio.isoformat(), fin.isoformat(),
+        )
+        self.assertEqual((reservadas, llenas, ya_reservadas), (fechas[:2], [lleno], [ya_mia]))
+        self.assertEqual(serie.reservas.count(), 2)
+        for fecha in fechas[:2]:
+            self.assertEqual(cupos_ocupados(bloque.id, fecha), antes[fecha] + 1)
+        self.assertEqual(cupos_ocupados(bloque.id, lleno), bloque.capacidad_maxima)
+
+        # Cancelar devuelve los cupos de la serie; la reserva que ya tenía no es de la serie y se queda
+        _, canceladas = series.cancelar_serie(self.datos.socio, serie.id)
+        self.assertEqual(canceladas, 2)
+        self.assertEqual({fecha: cupos_ocupados(bloque.id, fecha) for fecha in antes}, antes)
+        self.assertFalse(SerieReserva.objects.filter(pk=serie.pk).exists())
+        self.assertTrue(Reserva.objects.filter(usuario=self.datos.socio, bloque=bloque, fecha=ya_mia).exists())
+
+    def test_serie_sin_cupos_no_se_crea(self):
+        bloque = self.datos.bloques[0]
+        lunes = self.datos.lunes + datetime.timedelta(weeks=2)
+        Cierre.objects.filter(fecha=lunes).delete()
+        self.llenar(bloque, lunes)
+        antes = SerieReserva.objects.count()
+        with self.assertRaisesMessage(ValidationError, "Ninguna fecha de la serie tiene cupo"):
+            series.crear_serie(self.datos.socio, bloque.id, ['0'], lunes.isoformat(), lunes.isoformat())
+        self.assertEqual(SerieReserva.objects.count(), antes)
+
+    def test_cancelar_serie_a_mitad_del_dia(self):
+        bloque = self.datos.bloques[0]
+        zona = timezone.get_current_timezone()
+        for semanas, minutos, canceladas in ((1, 30, 1), (3, -30, 2)):
+            hoy = self.datos.lunes + datetime.timedelta(weeks=semanas)
+            proximo = hoy + datetime.timedelta(weeks=1)
+            Cierre.objects.filter(fecha__in=[hoy, proximo]).delete()
+            serie, reservadas, _, _ = series.crear_serie(
+                self.datos.socio, bloque.id, ['0'], hoy.isoformat(), proximo.isoformat(),
+            )
+            self.assertEqual(reservadas, [hoy, proximo])
+
+            # El bloque de hoy ya empezó (o empieza en media hora)
+            ahora = timezone.make_aware(datetime.datetime.combine(hoy, bloque.hora_inicio), zona)
+            with mock.patch.object(timezone, 'now', return_value=ahora + datetime.timedelta(minutes=minutos)):
+                self.assertEqual(series.cancelar_serie(self.datos.socio, serie.id)[1], canceladas)
+            self.assertEqual(
+                Reserva.objects.filter(usuario=self.datos.socio, bloque=bloque, fecha=hoy).exists(), canceladas == 1,
+            )
+            self.assertFalse(Reserva.objects.filter(usuario=self.datos.socio, bloque=bloque, fecha=proximo).exists())
+
+
+class HorarioTest(PruebaConDatos):
+    """Sincronización del horario (ver horario.py y crear_bloques)."""
+
+    def test_sincronizar_avisa_las_reservas_que_quedan_fuera(self):
+        bloques, cierres = horario.cargar_definicion()
+        quitado, sin_lunes, achicado = self.datos.bloques[:3]
+        del bloques[quitado.nombre]
+        bloques[sin_lunes.nombre]['dias_semana'] = '1,2,3,4'
+        bloques[achicado.nombre]['capacidad_maxima'] = 5
+        hoy = timezone.localdate()
+        futuras = Reserva.objects.filter(fecha__gte=hoy)
+        esperado = {
+            'desactivados': futuras.filter(bloque=quitado).count(),
+            'dias_quitados': futuras.filter(bloque=sin_lunes, fecha__iso_week_day=1).count(),
+            'sobre_capacidad': [
+                (achicado.nombre, o.fecha, o.ocupados, 5)
+                for o in OcupacionBloque.objects.filter(bloque=achicado, fecha__gte=hoy, ocupados__gt=5).order_by('fecha')
+            ],
+        }
+        self.assertTrue(esperado['desactivados'] and esperado['sobre_capacidad'])
+
+        self.assertEqual(horario.sincronizar(bloques, cierres, simular=True)['afectadas'], esperado)
+        # Sin --forzar no se aplica nada
+        with self.assertRaises(ValidationError):
+            horario.sincronizar(bloques, cierres)
+        self.assertTrue(BloqueHorario.objects.get(pk=quitado.pk).activo)
+        self.assertEqual(BloqueHorario.objects.get(pk=achicado.pk).capacidad_maxima, achicado.capacidad_maxima)
+
+        # Con forzar se aplica y las reservas quedan donde estaban
+        cambios = horario.sincronizar(bloques, cierres, forzar=True)
+        self.assertEqual((cambios['desactivados'], cambios['afectadas']), ([quitado.nombre], esperado))
+        self.assertFalse(BloqueHorario.objects.get(pk=quitado.pk).activo)
+        self.assertEqual(BloqueHorario.objects.get(pk=sin_lunes.pk).dias_semana, '1,2,3,4')
+        self.assertEqual(futuras.filter(bloque=quitado).count(), esperado['desactivados'])
+
+        # El mismo horario otra vez ya no cambia nada
+        cambios = horario.sincronizar(bloques, cierres)
+        self.assertEqual((cambios['actualizados'], cambios['desactivados']), ([], []))
+        self.assertFalse(any(cambios['afectadas'].values()))
+
+
+class LimitesTest(PruebaConDatos):
+    """Límites de peticiones y sala de espera (ver limites.py)."""
+
+    @override_settings(LIMITES_PETICIONES={
+        'reservas': {'vistas': ['api_reservar'], 'usuario': (2, 1), 'ip': (100, 100)},
+    })
+    def test_limite_por_usuario(self):
+        for i in range(2):
+            bloque, fecha = self.fecha_libre(i)
+            respuesta = self.client.post(reverse('api_reservar'), {'bloque_id': bloque.id, 'fecha': fecha.isoformat()})
+            self.assertEqual(respuesta.status_code, 201)
+
+        # El rechazo es rápido: solo la sesión y el usuario, sin tocar reservas
+        bloque, fecha = self.fecha_libre(2)
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.post(reverse('api_reservar'), {'bloque_id': bloque.id, 'fecha': fecha.isoformat()})
+        self.assertEqual(respuesta.status_code, 429)
+        self.assertEqual(respuesta['Retry-After'], str(respuesta.json()['reintentar_en']))
+        self.assertLessEqual(len(consultas), 2)
+        self.assertFalse(Reserva.objects.filter(usuario=self.datos.socio, bloque=bloque, fecha=fecha).exists())
+
+    @override_settings(AGENDA_SALA_ESPERA={'minutos': 10, 'por_segundo': 2})
+    def test_sala_espera_por_orden_de_llegada(self):
+        apertura = limites.apertura_semana()
+        primeros = [limites.turno_sala(usuario.pk, apertura) for usuario in self.datos.usuarios[:3]]
+        self.assertEqual(primeros, [0, 0, 1])
+        # El tercero conserva su número y entra al segundo siguiente
+        self.assertEqual(limites.turno_sala(self.datos.usuarios[2].pk, apertura), 1)
+        self.assertEqual(limites.turno_sala(self.datos.usuarios[2].pk, apertura + datetime.timedelta(seconds=1)), 0)
+        # Pasados los minutos de apertura no hay sala
+        self.assertEqual(limites.turno_sala(self.datos.socio.pk, apertura + datetime.timedelta(minutes=10)), 0)
+
+    def test_ip_detras_del_proxy(self):
+        fabrica = RequestFactory()
+        peticion = fabrica.post('/', REMOTE_ADDR='127.0.0.1', HTTP_X_FORWARDED_FOR='1.1.1.1, 200.1.2.3')
+        # Sin proxies de confianza el encabezado no se usa: lo puede mandar cualquiera
+        self.assertEqual(limites.ip_cliente(peticion), '127.0.0.1')
+        with override_settings(LIMITES_PROXIES=1):
+            # La de más a la izquierda la inventó el cliente; la última la puso nginx
+            self.assertEqual(limites.ip_cliente(peticion), '200.1.2.3')
+            self.assertEqual(limites.ip_cliente(fabrica.post('/', REMOTE_ADDR='127.0.0.1')), '127.0.0.1')
+
+    @override_settings(LIMITES_PROXIES=1, LIMITES_PETICIONES={
+        'acceso': {'vistas': ['login'], 'ip': (2, 1), 'cuenta': (100, 100)},
+    })
+    def test_limite_por_ip_detras_del_proxy(self):
+        cliente = Client()
+        datos = {'username': 'nadie', 'password': 'x'}
+        for _ in range(2):
+            self.assertEqual(cliente.post(reverse('login'), datos, HTTP_X_FORWARDED_FOR='200.1.2.3').status_code, 200)
+        self.assertEqual(cliente.post(reverse('login'), datos, HTTP_X_FORWARDED_FOR='200.1.2.3').status_code, 429)
+        # Otro cliente detrás del mismo proxy tiene su propia cubeta, aunque invente la IP del primero
+        self.assertEqual(cliente.post(reverse('login'), datos, HTTP_X_FORWARDED_FOR='200.1.2.3, 200.9.9.9').status_code, 200)
+
+    def test_limite_por_cuenta_en_el_login(self):
+        cliente = Client()
+        capacidad, _ = settings.LIMITES_PETICIONES['acceso']['cuenta']
+        for _ in range(capacidad):
+            cliente.post(reverse('login'), {'username': 'Socio', 'password': 'x'})
+        # La misma cuenta queda frenada (sin importar mayúsculas); otra no, aunque venga de la misma IP
+        self.assertEqual(cliente.post(reverse('login'), {'username': 'socio', 'password': 'x'}).status_code, 429)
+        self.assertEqual(cliente.post(reverse('login'), {'username': 'otra', 'password': 'x'}).status_code, 200)
+
+    @override_settings(LIMITES_PETICIONES={'reservas': {'vistas': ['api_reservar'], 'usuario': (1, 1)}})
+    async def test_limite_asincrono_fuera_del_event_loop(self):
+        hilos = []
+
+        class Registrado(LimitePeticionesMiddleware):
+            def revisar(self, *args):
+                hilos.append(threading.get_ident())
+                return super().revisar(*args)
+
+        async def vista(request):
+            return HttpResponse(status=201)
+
+        async def socio():
+            return self.datos.socio
+
+        middleware = Registrado(vista)
+        estados = []
+        for _ in range(2):
+            peticion = AsyncRequestFactory().post(reverse('api_reservar'))
+            peticion.auser = socio
+            estados.append((await middleware(peticion)).status_code)
+        self.assertEqual(estados, [201, 429])
+        self.assertNotIn(threading.get_ident(), hilos)
+
+
+class MetricasTest(PruebaConDatos):
+    """Métricas de /metrics y perfilador (ver metricas.py)."""
+
+    def test_metricas(self):
+        reservas_antes = metricas.reservas._valores.get((), 0)
+        bloque, fecha = self.fecha_libre(0)
+        # Las reservas se cuentan al confirmar la transacción
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('api_reservar'), {'bloque_id': bloque.id, 'fecha': fecha.isoformat()})
+        self.assertEqual(metricas.reservas._valores.get((), 0), reservas_antes + 1)
+
+        # Por defecto no hay IPs ni token: un socio no las puede leer
+        self.assertEqual(self.client.get(reverse('metricas')).status_code, 403)
+        with override_settings(METRICAS_TOKEN='secreto'):
+            respuesta = self.client.get(reverse('metricas'), HTTP_AUTHORIZATION='Bearer secreto')
+            self.assertEqual(self.client.get(reverse('metricas'), HTTP_AUTHORIZATION='Bearer otro').status_code, 403)
+        self.assertEqual(respuesta.status_code, 200)
+        texto = respuesta.content.decode()
+        self.assertIn('gimnasio_peticiones_total{vista="api_reservar",metodo="POST",estado="201"}', texto)
+        self.assertIn('gimnasio_consultas_por_peticion_bucket{vista="api_reservar",le="+Inf"}', texto)
+
+        # Las IPs se comparan con la del cliente, no con la del proxy
+        with override_settings(METRICAS_IPS=['10.0.0.5'], LIMITES_PROXIES=1):
+            self.assertEqual(self.client.get(reverse('metricas'), HTTP_X_FORWARDED_FOR='10.0.0.5').status_code, 200)
+            self.assertEqual(self.client.get(reverse('metricas'), HTTP_X_FORWARDED_FOR='200.1.2.3').status_code, 403)
+
+    def test_perfilador_guarda_las_mas_lentas(self):
+        with tempfile.TemporaryDirectory() as carpeta:
+            with override_settings(METRICAS_PERFILADOR={'muestreo': 1, 'umbral_ms': 0, 'carpeta': carpeta, 'maximo': 2}):
+                cliente = Client()
+                cliente.force_login(self.datos.socio)
+                for _ in range(3):
+                    cliente.get(reverse('vista_agendamiento'))
+            perfiles = os.listdir(carpeta)
+        self.assertEqual(len(perfiles), 2)
+        self.assertTrue(all('vista_agendamiento' in nombre for nombre in perfiles))
+
+
+class TareasTest(PruebaConDatos):
+    """Cola de tareas y correos (ver tareas.py y notificaciones.py)."""
+
+    def test_correos_por_la_cola(self):
+        User.objects.filter(pk=self.datos.socio.pk).update(email='socio@usm.cl')
+        esperando = self.datos.usuarios[1]
+        User.objects.filter(pk=esperando.pk).update(email='espera@usm.cl')
+        bloque, fecha = self.fecha_libre(0)
+        Tarea.objects.all().delete()
+
+        # La reserva solo encola: ningún correo sale durante la petición
+        respuesta = self.client.post(reverse('api_reservar'), {'bloque_id': bloque.id, 'fecha': fecha.isoformat()})
+        self.assertEqual(respuesta.status_code, 201)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(
+            sorted(Tarea.objects.values_list('nombre', flat=True)), ['confirmar_reserva', 'recordar_reserva']
+        )
+
+        call_command('runworker', una_vez=True, stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['socio@usm.cl'])
+        self.assertIn(bloque.nombre, mail.outbox[0].subject)
+        # El recordatorio espera su hora
+        recordatorio = Tarea.objects.get(nombre='recordar_reserva')
+        self.assertEqual(recordatorio.estado, Tarea.PENDIENTE)
+        self.assertGreater(recordatorio.ejecutar_desde, timezone.now())
+
+        # Al cancelar, el primero de la lista de espera recibe el cupo y su aviso;
+        # el recordatorio de la reserva cancelada ya no se envía
+        ListaEspera.objects.create(usuario=esperando, bloque=bloque, fecha=fecha)
+        self.client.post(reverse('api_cancelar', args=[respuesta.json()['reserva_id']]))
+        Tarea.objects.filter(pk=recordatorio.pk).update(ejecutar_desde=timezone.now())
+        call_command('runworker', una_vez=True, stdout=io.StringIO())
+        self.assertEqual([correo.to for correo in mail.outbox[1:]], [['espera@usm.cl']])
+        self.assertFalse(Tarea.objects.exclude(estado=Tarea.HECHA).exclude(nombre='recordar_reserva').exists())
+        # El promovido también recibe su recordatorio, aunque la reserva se creó con bulk_create
+        promovida = Reserva.objects.get(usuario=esperando, bloque=bloque, fecha=fecha)
+        self.assertTrue(Tarea.objects.filter(
+            nombre='recordar_reserva', estado=Tarea.PENDIENTE, argumentos={'reserva_id': promovida.id},
+        ).exists())
+
+        # Una serie: una sola confirmación con todas las fechas y un recordatorio por cada una
+        Tarea.objects.all().delete()
+        mail.outbox.clear()
+        inicio = self.datos.lunes + datetime.timedelta(weeks=2)
+        Cierre.objects.filter(fecha__gte=inicio, fecha__lte=inicio + datetime.timedelta(days=13)).delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            _, reservadas, _, _ = series.crear_serie(
+                self.datos.socio, bloque.id, ['0', '2'], inicio.isoformat(), (inicio + datetime.timedelta(days=13)).isoformat(),
+            )
+        self.assertEqual(len(reservadas), 4)
+        self.assertEqual(Tarea.objects.filter(nombre='confirmar_serie').count(), 1)
+        self.assertEqual(Tarea.objects.filter(nombre='recordar_reserva').count(), len(reservadas))
+        call_command('runworker', una_vez=True, stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(bloque.nombre, mail.outbox[0].subject)
+        for fecha_serie in reservadas:
+            self.assertIn(fecha_serie.strftime('%d/%m'), mail.outbox[0].body)
+
+        # Una tarea que falla se reintenta más tarde y, al agotar los intentos, queda fallida
+        rota = Tarea.objects.create(nombre='no_registrada', max_intentos=2)
+        call_command('runworker', una_vez=True, stdout=io.StringIO())
+        rota.refresh_from_db()
+        self.assertEqual((rota.estado, rota.intentos), (Tarea.PENDIENTE, 1))
+        self.assertGreater(rota.ejecutar_desde, timezone.now())
+        Tarea.objects.filter(pk=rota.pk).update(ejecutar_desde=timezone.now())
+        call_command('runworker', una_vez=True, stdout=io.StringIO())
+        rota.refresh_from_db()
+        self.assertEqual(rota.estado, Tarea.FALLIDA)
+        self.assertIn('no_registrada', rota.ultimo_error)
+
+
+class ArchivoTest(PruebaConDatos):
+    """Archivo de reservas pasadas y ResumenDiario (ver archivo.py)."""
+
+    def test_archivar_y_volver_a_correr(self):
+        hasta = archivo.horizonte(0)
+        pasadas = Reserva.objects.filter(fecha__lt=hasta).count()
+        self.assertGreater(pasadas, 0)
+        bloque, fecha = self.datos.bloques[0], hasta - datetime.timedelta(weeks=1)
+        ListaEspera.objects.create(usuario=self.datos.socio, bloque=bloque, fecha=fecha)
+
+        # Lotes chicos: varios lotes tocan el mismo día y el resumen igual queda completo
+        call_command('archivar_reservas', semanas=0, lote=7, stdout=io.StringIO())
+        self.assertFalse(Reserva.objects.filter(fecha__lt=hasta).exists())
+        self.assertTrue(Reserva.objects.filter(fecha__gte=hasta).exists())
+        self.assertEqual(ReservaArchivada.objects.count(), pasadas)
+        self.assertFalse(OcupacionBloque.objects.filter(fecha__lt=hasta).exists())
+        self.assertFalse(ListaEspera.objects.filter(fecha__lt=hasta).exists())
+
+        resumenes = ResumenDiario.objects.all()
+        self.assertEqual(sum(r.reservas for r in resumenes), pasadas)
+        self.assertEqual({r.reservas for r in resumenes}, {FabricaDatos.LLENADO})
+        resumen = ResumenDiario.objects.get(bloque=bloque, fecha=fecha)
+        self.assertEqual((resumen.bloque_nombre, resumen.capacidad), (bloque.nombre, bloque.capacidad_maxima))
+
+        # Sin nada nuevo, volver a correrlo no cambia nada
+        self.assertEqual(archivo.archivar_lote(hasta), 0)
+        call_command('archivar_reservas', semanas=0, stdout=io.StringIO())
+        self.assertEqual(ReservaArchivada.objects.count(), pasadas)
+
+        # Una reserva pasada que quedó atrás se suma al resumen de su día, sin duplicar la fila
+        Reserva.objects.bulk_create([Reserva(usuario=self.datos.socio, bloque=bloque, fecha=fecha)])
+        call_command('archivar_reservas', semanas=0, stdout=io.StringIO())
+        self.assertEqual(ReservaArchivada.objects.count(), pasadas + 1)
+        self.assertEqual(ResumenDiario.objects.get(bloque=bloque, fecha=fecha).reservas, FabricaDatos.LLENADO + 1)
+        self.assertEqual(ResumenDiario.objects.count(), len(resumenes))
+
+
+class EncuestaTest(TestCase):
+    """Importación de respuestas de la encuesta (ver encuesta.py)."""
+
+    def importar(self, carpeta, respuestas):
+        ruta = Path(carpeta) / 'encuesta.csv'
+        with open(ruta, 'w', encoding='utf-8', newline='') as salida:
+            escritor = csv.writer(salida)
+            escritor.writerow(['Marca temporal', 'Problemas [Dificil acceso al gimnasio]'])
+            escritor.writerows(respuestas)
+        with mock.patch.object(encuesta, '_huella', wraps=encuesta._huella) as huella:
+            resultado = encuesta.importar_archivo(ruta)
+        return resultado, huella.call_count
+
+    def conteos(self):
+        return dict(OpcionEncuesta.objects.filter(pregunta__texto='Dificil acceso al gimnasio').values_list('texto', 'conteo'))
+
+    def test_reimportar_solo_procesa_las_filas_nuevas(self):
+        filas = [['1', 'Si'], ['2', 'No'], ['2', 'No']]
+        with tempfile.TemporaryDirectory() as carpeta:
+            # Dos personas que respondieron igual son dos respuestas
+            self.assertEqual(self.importar(carpeta, filas), ((3, 0), 3))
+            self.assertEqual(self.conteos(), {'Si': 1, 'No': 2})
+
+            # Con filas nuevas al final, el principio se salta: solo se mira la última ya importada
+            filas += [['2', 'No'], ['3', 'Si']]
+            self.assertEqual(self.importar(carpeta, filas), ((2, 3), 3))
+            self.assertEqual(self.conteos(), {'Si': 2, 'No': 3})
+            self.assertEqual(self.importar(carpeta, filas), ((0, 5), 1))
+
+            # Si cambió la última fila importada, se revisa el archivo entero
+            filas[-1] = ['4', 'Si']
+            self.assertEqual(self.importar(carpeta, filas), ((1, 4), 6))
+            self.assertEqual(self.conteos(), {'Si': 3, 'No': 3})
+        self.assertEqual(RespuestaEncuesta.objects.count(), 6)
+
+
+class EstaticosTest(TestCase):
+    """Archivos estáticos comprimidos (ver estaticos.py)."""
+
+    def test_estaticos_comprimidos_con_cache_larga(self):
+        produccion = {**settings.STORAGES, 'staticfiles': {'BACKEND': 'agendamiento.estaticos.EstaticosComprimidos'}}
+        with tempfile.TemporaryDirectory() as carpeta, override_settings(STATIC_ROOT=carpeta, STORAGES=produccion):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            datos = staticfiles_storage.stored_name('data/encuesta_from_excel.json')
+            imagen = staticfiles_storage.stored_name('img/fondo_gimnasio.png')
+
+            respuesta = estaticos.servir(RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip, deflate'), datos)
+            self.assertEqual(respuesta['Content-Encoding'], 'gzip')
+            self.assertIn('immutable', respuesta['Cache-Control'])
+            with open(os.path.join(carpeta, datos), 'rb') as original:
+                self.assertEqual(gzip.decompress(b''.join(respuesta.streaming_content)), original.read())
+            respuesta.close()
+
+            # El PNG ya viene comprimido: va tal cual, pero también con caché larga
+            respuesta = estaticos.servir(RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip'), imagen)
+            self.assertNotIn('Content-Encoding', respuesta)
+            self.assertIn('immutable', respuesta['Cache-Control'])
+            respuesta.close()
+
+    def test_recursos_sin_manifest_usan_el_cdn(self):
+        self.addCleanup(recursos.construido.cache_clear)
+        produccion = {**settings.STORAGES, 'staticfiles': {'BACKEND': 'agendamiento.estaticos.EstaticosComprimidos'}}
+        with tempfile.TemporaryDirectory() as carpeta, override_settings(STATIC_ROOT=carpeta, STORAGES=produccion):
+            # Está en static/ pero todavía no en el manifest (falta collectstatic)
+            recursos.construido.cache_clear()
+            self.assertFalse(recursos.construido('img/fondo_gimnasio.png'))
+            self.assertIn(recursos.QR[1], Template('{% load recursos %}{% script_qr %}').render(Context()))
+
+            call_command('collectstatic', interactive=False, verbosity=0)
+            recursos.construido.cache_clear()
+            self.assertTrue(recursos.construido('img/fondo_gimnasio.png'))
+
+
+@override_settings(ASISTENCIA_ESPERA=None)
+class AsistenciaTest(TestCase):
+    """Códigos de entrada y kiosko (ver asistencia.py)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('crear_bloques', stdout=io.StringIO())
+        cls.bloque = BloqueHorario.objects.order_by('hora_inicio').first()
+        cls.fecha = timezone.localdate() - datetime.timedelta(weeks=1)
+        cls.socios = User.objects.bulk_create([User(username=f'socio{i}', password='!') for i in range(5)])
+        Reserva.objects.bulk_create([Reserva(usuario=socio, bloque=cls.bloque, fecha=cls.fecha) for socio in cls.socios])
+        recalcular_ocupacion()
+        recalcular_estadisticas()
+        cls.admin = User.objects.create_superuser('admin', password='clave-admin')
+
+    def setUp(self):
+        cache.clear()
+
+    def reserva_de_hoy(self, usuario):
+        """Reserva guardada para hoy, con un bloque que dura todo el día (solo para el código)."""
+        reserva = Reserva.objects.bulk_create([Reserva(usuario=usuario, bloque=self.bloque, fecha=timezone.localdate())])[0]
+        reserva.bloque = BloqueHorario(
+            id=self.bloque.id, nombre=self.bloque.nombre, hora_inicio=datetime.time(0), hora_fin=datetime.time(23, 59, 59),
+        )
+        return reserva
+
+    def test_entradas_por_lotes(self):
+        reservas = list(Reserva.objects.select_related('usuario', 'bloque').filter(bloque=self.bloque, fecha=self.fecha)[:3])
+        durante = timezone.make_aware(datetime.datetime.combine(self.fecha, self.bloque.hora_inicio)) + datetime.timedelta(minutes=5)
+
+        # El código se verifica solo con la firma: sin consultas
+        with CaptureQueriesContext(connection) as consultas:
+            for reserva in reservas:
+                datos = asistencia.verificar(asistencia.token_de(reserva), durante)
+                self.assertEqual(asistencia.registrar(datos, durante), 'registrada')
+            self.assertEqual(asistencia.registrar(datos, durante), 'repetida')
+        self.assertEqual(len(consultas), 0)
+        with self.assertRaises(ValidationError):
+            asistencia.verificar(asistencia.token_de(reservas[0]), durante + datetime.timedelta(days=1))
+        with self.assertRaises(ValidationError):
+            asistencia.verificar(asistencia.token_de(reservas[0])[:-1] + 'x', durante)
+
+        # Se guardan de una vez y suman a las estadísticas; el tablero muestra las inasistencias
+        self.assertEqual(asistencia.guardar_pendientes(), 3)
+        self.assertEqual(Asistencia.objects.filter(fecha=self.fecha, bloque=self.bloque).count(), 3)
+        self.assertEqual(EstadisticaDiaria.objects.get(bloque=self.bloque, fecha=self.fecha).asistencias, 3)
+        fila = calcular_tablero(self.fecha, self.fecha)['cancelaciones'][0]
+        self.assertEqual((fila['asistieron'], fila['faltaron']), (3, len(self.socios) - 3))
+
+    def test_kiosko(self):
+        reserva = self.reserva_de_hoy(self.socios[0])
+        url = reverse('api_checkin')
+
+        # Solo un navegador habilitado por el staff, y sin leer la base de datos
+        self.assertEqual(self.client.post(url, {'codigo': asistencia.token_de(reserva)}).status_code, 403)
+        self.client.force_login(self.admin)
+        self.assertEqual(self.client.get(reverse('vista_kiosko')).status_code, 200)
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.post(url, {'codigo': asistencia.token_de(reserva)})
+        self.assertEqual(len(consultas), 0)
+        self.assertEqual(respuesta.json(), {'estado': 'registrada', 'usuario': 'socio0', 'bloque': self.bloque.nombre})
+        asistencia.guardar_pendientes()
+        self.assertTrue(Asistencia.objects.filter(reserva_id=reserva.id).exists())
+
+        # Un código de otro día no sirve
+        pasada = Reserva.objects.select_related('usuario', 'bloque').filter(fecha=self.fecha).first()
+        self.assertEqual(self.client.post(url, {'codigo': asistencia.token_de(pasada)}).status_code, 400)
+
+    def test_reserva_cancelada_no_entra(self):
+        una, otra = self.reserva_de_hoy(self.socios[1]), self.reserva_de_hoy(self.socios[2])
+        # El código se guardó antes de cancelar (ej. una captura del QR)
+        codigos = [asistencia.token_de(una), asistencia.token_de(otra)]
+        with self.captureOnCommitCallbacks(execute=True):
+            Reserva.objects.get(pk=una.pk).delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            Reserva.objects.filter(pk=otra.pk).delete()
+        for codigo in codigos:
+            with self.assertRaisesMessage(ValidationError, 'fue cancelada'):
+                asistencia.verificar(codigo)
+
+    def test_pagina_del_codigo(self):
+        # Solo para las reservas propias
+        propia = self.reserva_de_hoy(self.socios[3])
+        self.client.force_login(self.socios[3])
+        self.assertContains(self.client.get(reverse('codigo_entrada', args=[propia.id])), 'token-entrada')
+        ajena = Reserva.objects.filter(fecha=self.fecha).exclude(usuario=self.socios[3]).first()
+        self.assertEqual(self.client.get(reverse('codigo_entrada', args=[ajena.id])).status_code, 404)
+
+
+@override_settings(SQLITE_SERIALIZAR_ESCRITURAS=True, SQLITE_ESPERA_ESCRITURA=0.05)
+class EscriturasTest(TransactionTestCase):
+    """
+    La fila de escrituras (ver escrituras.py). TransactionTestCase: dentro
+    del atomic() de TestCase escritura() nunca toma el turno del proceso.
+    """
+
+    def turno_libre(self):
+        """Si otro hilo puede tomar el turno ahora mismo."""
+        libre = []
+
+        def probar():
+            if escrituras._turno.acquire(blocking=False):
+                escrituras._turno.release()
+                libre.append(True)
+        hilo = threading.Thread(target=probar)
+        hilo.start()
+        hilo.join()
+        return bool(libre)
+
+    def test_sin_turno_avisa_al_usuario(self):
+        tomado, soltar = threading.Event(), threading.Event()
+
+        def ocupar():
+            with escrituras._turno:
+                tomado.set()
+                soltar.wait(5)
+        hilo = threading.Thread(target=ocupar)
+        hilo.start()
+        tomado.wait(5)
+        try:
+            with self.assertRaisesMessage(ValidationError, escrituras.MENSAJE_OCUPADO):
+                with escrituras.escritura():
+                    pass
+        finally:
+            soltar.set()
+            hilo.join()
+
+    @override_settings(SQLITE_SERIALIZAR_ESCRITURAS=True, SQLITE_ESPERA_ESCRITURA=0.1)
+    def test_salir_de_la_espera_espera_su_turno(self):
+        socio = User.objects.create_user('socio')
+        bloque = BloqueHorario.objects.create(nombre='Bloque 1-2', hora_inicio=datetime.time(8), hora_fin=datetime.time(9, 10))
+        entrada = ListaEspera.objects.create(usuario=socio, bloque=bloque, fecha=timezone.localdate() + datetime.timedelta(weeks=1))
+        tomado, soltar = threading.Event(), threading.Event()
+
+        def ocupar():
+            with escrituras._turno:
+                tomado.set()
+                soltar.wait(5)
+        hilo = threading.Thread(target=ocupar)
+        hilo.start()
+        tomado.wait(5)
+        try:
+            # Mientras otro escribe (ej. promoviendo esa fila) no se borra nada
+            with self.assertRaisesMessage(ValidationError, escrituras.MENSAJE_OCUPADO):
+                lista_espera.salir(socio, entrada.id)
+            self.assertTrue(ListaEspera.objects.filter(pk=entrada.pk).exists())
+        finally:
+            soltar.set()
+            hilo.join()
+        salida = lista_espera.salir(socio, entrada.id)
+        self.assertEqual((salida.bloque, salida.fecha), (bloque, entrada.fecha))
+        self.assertFalse(ListaEspera.objects.filter(pk=entrada.pk).exists())
+
+    def test_base_bloqueada_avisa_al_usuario(self):
+        with self.assertRaisesMessage(ValidationError, escrituras.MENSAJE_OCUPADO):
+            with escrituras.escritura():
+                raise OperationalError('database is locked')
+        # Los demás errores de la base de datos no se esconden
+        with self.assertRaises(OperationalError):
+            with escrituras.escritura():
+                raise OperationalError('no such table: x')
+        self.assertTrue(self.turno_libre())
+
+    def test_reentrante(self):
+        with escrituras.escritura():
+            with escrituras.escritura():
+                self.assertFalse(self.turno_libre())
+            self.assertFalse(self.turno_libre())
+        self.assertTrue(self.turno_libre())
+
+
+class PruebaCargaTest(TransactionTestCase):
+    """Humo de "python manage.py prueba_carga" (con la base de las pruebas, que ya es desechable)."""
+
+    def test_prueba_carga(self):
+        call_command('crear_bloques', stdout=io.StringIO())
+        with tempfile.TemporaryDirectory() as carpeta:
+            ruta = Path(carpeta) / 'carga.json'
+            salida = io.StringIO()
+            call_command('prueba_carga', usuarios=20, semanas=1, hilos=2, operaciones=300, json=ruta, stdout=salida)
+            with open(ruta) as f:
+                resultados = json.load(f)
+        self.assertEqual(resultados['operaciones'], 300)
+        estados = {}
+        for vista in resultados['vistas'].values():
+            for estado, cantidad in vista['estados'].items():
+                estados[estado] = estados.get(estado, 0) + cantidad
+        # Sin límites de peticiones durante la prueba: ningún 429 aunque todos salgan de la misma IP
+        self.assertNotIn('429', estados)
+        self.assertFalse([estado for estado in estados if estado.startswith('5')])
+        self.assertEqual(resultados['sobreventas'], [])
+        self.assertEqual(resultados['contadores_descuadrados'], 0)
+        self.assertIn('Sin cupos sobrevendidos', salida.getvalue())
 
-# Create your tests here.
@@ -1,15 +1,45 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, vistas_async
 
-urlpatterns = [
-    # Esta es la nueva página principal (el menú)
-    path('', views.vista_principal, name='vista_principal'),
+
+def rutas(agenda):
+    """
+    Rutas de la app. Reservar, cancelar y la grilla salen de `agenda`:
+    views (WSGI) o vistas_async (ASGI, con settings.AGENDA_VISTAS_ASYNC).
+    """
+    return [
+        # Esta es la nueva página principal (el menú)
+        path('', views.vista_principal, name='vista_principal'),
     
-    # Las 3 páginas de la aplicación
-    path('agendar/', views.vista_agendamiento, name='vista_agendamiento'),
-    path('consejos/', views.vista_consejos, name='vista_consejos'),
-    path('resultados/', views.vista_resultados, name='vista_resultados'),
-    path('registro/', views.vista_registro, name='registro'),
-    path('cancelar/<int:reserva_id>/', views.cancelar_reserva, name='cancelar_reserva'),
-    path('sugerencias/', views.buzon_sugerencias, name='buzon_sugerencias'),
-]
+        # Las 3 páginas de la aplicación
+        path('agendar/', agenda.vista_agendamiento, name='vista_agendamiento'),
+        path('agendar/mes/', views.vista_mes, name='vista_mes'),
+        path('consejos/', views.vista_consejos, name='vista_consejos'),
+        path('resultados/', views.vista_resultados, name='vista_resultados'),
+        path('api/encuesta/', views.api_resultados_encuesta, name='api_resultados_encuesta'),
+        path('registro/', views.vista_registro, name='registro'),
+        path('cancelar/<int:reserva_id>/', agenda.cancelar_reserva, name='cancelar_reserva'),
+        path('sugerencias/', views.buzon_sugerencias, name='buzon_sugerencias'),
+        path('series/', views.crear_serie_reservas, name='crear_serie_reservas'),
+        path('series/<int:serie_id>/cancelar/', views.cancelar_serie_reservas, name='cancelar_serie_reservas'),
+        path('lista-espera/', views.unirse_lista_espera, name='unirse_lista_espera'),
+        path('lista-espera/<int:entrada_id>/salir/', views.salir_lista_espera, name='salir_lista_espera'),
+        path('reservas/<int:reserva_id>/entrada/', views.codigo_entrada, name='codigo_entrada'),
+
+        # Kiosko de entrada del gimnasio (ver asistencia.py)
+        path('kiosko/', views.vista_kiosko, name='vista_kiosko'),
+        path('api/kiosko/checkin/', views.api_checkin, name='api_checkin'),
+
+        # API JSON de agendamiento (la usa agendar.html para actualizar la grilla sin recargar)
+        path('api/agenda/', agenda.api_agenda, name='api_agenda'),
+        path('api/agenda/eventos/', views.api_eventos_agenda, name='api_eventos_agenda'),
+        path('api/reservas/', agenda.api_reservar, name='api_reservar'),
+        path('api/reservas/<int:reserva_id>/cancelar/', agenda.api_cancelar, name='api_cancelar'),
+
+        # Métricas para Prometheus
+        path('metrics', views.vista_metricas, name='metricas'),
+    ]
+
+
+urlpatterns = rutas(vistas_async if settings.AGENDA_VISTAS_ASYNC else views)
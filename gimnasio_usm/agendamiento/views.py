@@ -1,16 +1,25 @@
 from django.shortcuts import render, redirect
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
-from .models import BloqueHorario, Reserva, Sugerencia
+from django.contrib.admin.views.decorators import staff_member_required
+from .models import BloqueHorario, Reserva, SerieReserva, Sugerencia
+from . import disponibilidad
+from . import asistencia, encuesta, eventos, limites, lista_espera, metricas, series
+from .ocupacion import crear_reserva, cupos_ocupados
 from django.contrib import messages
 from django.utils import timezone
 import datetime
 from django.core.exceptions import ValidationError
-from django.db.models import Count
 from django.conf import settings # Para rutas estáticas
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login
 from django.shortcuts import get_object_or_404
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_GET, require_POST, condition
+from django.views.decorators.cache import cache_control
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from functools import wraps
+from django.utils.crypto import constant_time_compare
 
 # -----------------------------------------------------------------
 # VISTA 1: Página Principal (NUEVA)
@@ -28,89 +37,100 @@ def vista_agendamiento(request):
     
     if request.method == "POST":
         try:
-            bloque_id = request.POST.get("bloque_id")
-            fecha_str = request.POST.get("fecha")
-            bloque = BloqueHorario.objects.get(id=bloque_id)
-            fecha = datetime.datetime.strptime(fecha_str, "%Y-%m-%d").date()
-            usuario = request.user
-
-            # Validación de tiempo
-            hora_inicio_reserva = datetime.datetime.combine(fecha, bloque.hora_inicio)
-            try:
-                current_tz = timezone.get_current_timezone()
-                hora_inicio_reserva_tz = timezone.make_aware(hora_inicio_reserva, current_tz)
-            except Exception:
-                hora_inicio_reserva_tz = timezone.make_aware(hora_inicio_reserva, timezone.utc)
-            
-            if hora_inicio_reserva_tz < timezone.now():
-                messages.error(request, "Error: No puedes reservar un bloque de horario que ya ha pasado.")
-                return redirect('vista_agendamiento')
-
-            reserva_existente = Reserva.objects.filter(usuario=usuario, bloque=bloque, fecha=fecha).exists()
-            if reserva_existente:
-                messages.error(request, f"Ya tienes una reserva para el {bloque.nombre} el {fecha}.")
-                return redirect('vista_agendamiento')
-
-            Reserva.objects.create(usuario=usuario, bloque=bloque, fecha=fecha)
-            messages.success(request, f"¡Reserva confirmada! {bloque.nombre} el {fecha}.")
-            return redirect('vista_agendamiento')
-
-        except ValidationError as e: 
-            messages.error(request, f"Error al reservar: {'. '.join(e.messages)}")
-            return redirect('vista_agendamiento')
+            reserva = crear_reserva(request.user, request.POST.get("bloque_id"), request.POST.get("fecha"))
+            messages.success(request, f"¡Reserva confirmada! {reserva.bloque.nombre} el {reserva.fecha}.")
+        except ValidationError as e:
+            messages.error(request, '. '.join(e.messages))
         except Exception as e:
             messages.error(request, f"Ocurrió un error inesperado: {e}")
-            return redirect('vista_agendamiento')
+        return _volver_a_la_semana(request.POST.get("fecha"))
 
-    # GET: Mostrar Horario
-    hoy = timezone.localdate()
-    ahora = timezone.now()
-    lunes_de_esta_semana = hoy - datetime.timedelta(days=hoy.weekday())
-    dias_de_la_semana = [lunes_de_esta_semana + datetime.timedelta(days=i) for i in range(5)]
-    bloques_horarios = BloqueHorario.objects.all().order_by('hora_inicio')
-
-    # --- CAMBIO CLAVE: Obtenemos el objeto reserva completo, no solo IDs ---
-    reservas_usuario_qs = Reserva.objects.filter(
-        usuario=request.user,
-        fecha__in=dias_de_la_semana
-    )
-    # Mapa para encontrar rápido el ID de reserva: {(bloque_id, fecha): reserva_id}
-    mapa_reservas_usuario = {(r.bloque_id, r.fecha): r.id for r in reservas_usuario_qs}
-    # ---------------------------------------------------------------------
-
-    todas_las_reservas = Reserva.objects.filter(fecha__in=dias_de_la_semana).values('bloque', 'fecha').annotate(conteo=Count('id'))
-    conteo_reservas = {(reserva['bloque'], reserva['fecha']): reserva['conteo'] for reserva in todas_las_reservas}
-
-    datos_para_plantilla = []
-    for bloque in bloques_horarios:
-        datos_de_la_fila = []
-        for dia in dias_de_la_semana:
-            reservas_count = conteo_reservas.get((bloque.id, dia), 0)
-            cupos_disponibles = bloque.capacidad_maxima - reservas_count
-            
-            # Buscamos si el usuario tiene reserva aquí
-            reserva_id = mapa_reservas_usuario.get((bloque.id, dia))
-            
-            hora_inicio_reserva = datetime.datetime.combine(dia, bloque.hora_inicio)
-            try:
-                hora_inicio_reserva_tz = timezone.make_aware(hora_inicio_reserva, timezone.get_current_timezone())
-            except:
-                hora_inicio_reserva_tz = timezone.make_aware(hora_inicio_reserva, timezone.utc)
-
-            es_pasado = hora_inicio_reserva_tz < ahora
-
-            datos_de_la_fila.append({
-                'cupos': cupos_disponibles,
-                'reserva_id': reserva_id, # Pasamos el ID (o None)
-                'fecha_str': dia.isoformat(),
-                'es_pasado': es_pasado
-            })
-        datos_para_plantilla.append((bloque, datos_de_la_fila))
-
-    return render(request, 'agendamiento/agendar.html', {
+    # GET: Mostrar Horario (?semana=AAAA-MM-DD para ver otra semana)
+    # La parte común de la grilla (bloques, cupos, horas) sale del caché;
+    # aquí solo se consultan las reservas del usuario (ver disponibilidad.py).
+    lunes = _lunes_solicitado(request)
+    dias_de_la_semana, datos_para_plantilla = disponibilidad.grilla_usuario(request.user, lunes)
+
+    series_usuario = SerieReserva.objects.filter(
+        usuario=request.user, fecha_fin__gte=timezone.localdate()
+    ).select_related('bloque').order_by('fecha_inicio')
+
+    return render(request, 'agendamiento/agendar.html', _contexto_agenda(
+        lunes, dias_de_la_semana, datos_para_plantilla, series_usuario
+    ))
+
+def _contexto_agenda(lunes, dias_de_la_semana, datos_para_plantilla, series_usuario):
+    """Contexto de agendar.html (también lo usa vistas_async.vista_agendamiento)."""
+    primera, ultima = disponibilidad.semanas_visibles()
+    una_semana = datetime.timedelta(weeks=1)
+    return {
         'dias_de_la_semana': dias_de_la_semana,
         'datos_para_plantilla': datos_para_plantilla, 
+        'series_usuario': series_usuario,
+        'nombres_dias': list(enumerate(SerieReserva.DIAS)),
+        'semana_anterior': lunes - una_semana if lunes > primera else None,
+        'semana_siguiente': lunes + una_semana if lunes < ultima else None,
+        'es_semana_actual': lunes == primera,
+    }
+
+# -----------------------------------------------------------------
+# VISTA 2b: Vista mensual
+# -----------------------------------------------------------------
+@login_required
+def vista_mes(request):
+    """
+    Calendario compacto del mes (?mes=AAAA-MM): cupos libres y reservas del
+    usuario por día. Cada día lleva a su semana en vista_agendamiento.
+    """
+    hoy = timezone.localdate()
+    primera, ultima = disponibilidad.semanas_visibles(hoy)
+    try:
+        primero = datetime.date.fromisoformat(request.GET['mes'] + '-01')
+    except (KeyError, ValueError):
+        primero = hoy.replace(day=1)
+    # Solo los meses con semanas visibles (?mes=9999-12 desbordaría las fechas de abajo)
+    primero = min(max(primero, primera.replace(day=1)), (ultima + datetime.timedelta(days=4)).replace(day=1))
+    siguiente_mes = (primero + datetime.timedelta(days=31)).replace(day=1)
+    ultimo = siguiente_mes - datetime.timedelta(days=1)
+
+    # Solo se arman las semanas que los alumnos pueden reservar
+    desde = max(disponibilidad.lunes_de(primero), primera)
+    hasta = min(ultimo, ultima + datetime.timedelta(days=4))
+    resumen = {}
+    if desde <= hasta:
+        resumen = disponibilidad.resumen_dias(disponibilidad.grilla_rango(request.user, desde, hasta))
+
+    semanas = [
+        [
+            {
+                'fecha': lunes + datetime.timedelta(days=i),
+                'del_mes': (lunes + datetime.timedelta(days=i)).month == primero.month,
+                'lunes': lunes,
+                'resumen': resumen.get(lunes + datetime.timedelta(days=i)),
+            }
+            for i in range(5)
+        ]
+        for lunes in disponibilidad.lunes_entre(primero, ultimo)
+    ]
+    mes_anterior = (primero - datetime.timedelta(days=1)).replace(day=1)
+    return render(request, 'agendamiento/mes.html', {
+        'mes': primero,
+        'semanas': semanas,
+        'nombres_dias': SerieReserva.DIAS,
+        'hoy': hoy,
+        'mes_anterior': mes_anterior if primero > primera else None,
+        'mes_siguiente': siguiente_mes if disponibilidad.lunes_de(siguiente_mes) <= ultima else None,
     })
+
+def _volver_a_la_semana(fecha):
+    """Redirige a la semana de `fecha` (date o 'AAAA-MM-DD'); si no es válida, a la actual."""
+    url = reverse('vista_agendamiento')
+    try:
+        fecha = fecha if isinstance(fecha, datetime.date) else datetime.date.fromisoformat(fecha)
+    except (TypeError, ValueError):
+        return redirect(url)
+    return redirect(f"{url}?semana={disponibilidad.lunes_de(fecha).isoformat()}")
+
 # -----------------------------------------------------------------
 # VISTA 3: Consejos
 # -----------------------------------------------------------------
@@ -125,12 +145,18 @@ def vista_consejos(request):
 @login_required
 def vista_resultados(request):
     """
-    Muestra la página de gráficos. La página se encargará
-    de cargar sus propios datos usando JavaScript.
+    Muestra la página de gráficos. Los datos llegan ya agregados
+    desde api_resultados_encuesta con una sola petición.
     """
-    # Ya no pasamos ningún dato, solo renderizamos la plantilla.
     return render(request, 'agendamiento/resultados.html')
 
+@login_required
+@require_GET
+@cache_control(private=True, max_age=300)
+def api_resultados_encuesta(request):
+    """Conteos por (sección, pregunta, opción) de la encuesta, desde el caché."""
+    return JsonResponse(encuesta.resultados())
+
 # -----------------------------------------------------------------
 # VISTA 5: Registro de Usuario
 # -----------------------------------------------------------------
@@ -172,7 +198,7 @@ def cancelar_reserva(request, reserva_id):
     Permite a un usuario cancelar una de sus propias reservas.
     """
     # Buscamos la reserva. Si no existe o no pertenece al usuario actual, da error 404.
-    reserva = get_object_or_404(Reserva, id=reserva_id, usuario=request.user)
+    reserva = get_object_or_404(Reserva.objects.select_related('bloque'), id=reserva_id, usuario=request.user)
     
     # Opcional: Validar que la reserva sea futura (para no cancelar reservas pasadas)
     # hoy = timezone.localdate()
@@ -184,10 +210,89 @@ def cancelar_reserva(request, reserva_id):
     bloque_nombre = reserva.bloque.nombre
     fecha_reserva = reserva.fecha
 
-    # Borramos la reserva
-    reserva.delete()
+    # Borramos la reserva (Reserva.delete también libera el cupo)
+    try:
+        reserva.delete()
+    except ValidationError as e:
+        messages.error(request, '. '.join(e.messages))
+        return _volver_a_la_semana(fecha_reserva)
     
     messages.success(request, f"Reserva para {bloque_nombre} el {fecha_reserva} cancelada exitosamente.")
+    return _volver_a_la_semana(fecha_reserva)
+
+# -----------------------------------------------------------------
+# RESERVAS RECURRENTES
+# -----------------------------------------------------------------
+
+@login_required
+@require_POST
+def crear_serie_reservas(request):
+    """Reserva el mismo bloque ciertos días de la semana entre dos fechas."""
+    try:
+        serie, reservadas, llenas, ya_reservadas = series.crear_serie(
+            request.user,
+            request.POST.get("bloque_id"),
+            request.POST.getlist("dias_semana"),
+            request.POST.get("fecha_inicio"),
+            request.POST.get("fecha_fin"),
+        )
+    except ValidationError as e:
+        messages.error(request, '. '.join(e.messages))
+        return redirect('vista_agendamiento')
+
+    messages.success(request, f"¡Serie creada! {len(reservadas)} reservas confirmadas para el {serie.bloque.nombre}.")
+    if ya_reservadas:
+        messages.success(request, f"Ya tenías reserva el {', '.join(str(f) for f in ya_reservadas)}.")
+    if llenas:
+        messages.error(request, f"Sin cupo (bloque lleno): {', '.join(str(f) for f in llenas)}.")
+    return redirect('vista_agendamiento')
+
+@login_required
+@require_POST
+def cancelar_serie_reservas(request, serie_id):
+    try:
+        serie, canceladas = series.cancelar_serie(request.user, serie_id)
+    except ValidationError as e:
+        messages.error(request, '. '.join(e.messages))
+        return redirect('vista_agendamiento')
+    if serie is None:
+        messages.error(request, "La serie no existe.")
+    else:
+        messages.success(request, f"Serie del {serie.bloque.nombre} cancelada: {canceladas} reservas futuras eliminadas.")
+    return redirect('vista_agendamiento')
+
+# -----------------------------------------------------------------
+# LISTA DE ESPERA
+# -----------------------------------------------------------------
+
+@login_required
+@require_POST
+def unirse_lista_espera(request):
+    """Anota al usuario en la fila de un bloque lleno."""
+    try:
+        entrada = lista_espera.unirse(request.user, request.POST.get("bloque_id"), request.POST.get("fecha"))
+        messages.success(
+            request,
+            f"Te uniste a la lista de espera del {entrada.bloque.nombre} el {entrada.fecha} "
+            f"(lugar {lista_espera.posicion(entrada)}). Si alguien cancela, el cupo será tuyo automáticamente."
+        )
+    except ValidationError as e:
+        messages.error(request, '. '.join(e.messages))
+    return _volver_a_la_semana(request.POST.get("fecha"))
+
+@login_required
+@require_POST
+def salir_lista_espera(request, entrada_id):
+    try:
+        entrada = lista_espera.salir(request.user, entrada_id)
+    except ValidationError as e:
+        messages.error(request, '. '.join(e.messages))
+        return redirect('vista_agendamiento')
+    if entrada is None:
+        messages.error(request, "No estás en esa lista de espera.")
+    else:
+        messages.success(request, f"Saliste de la lista de espera del {entrada.bloque.nombre} el {entrada.fecha}.")
+        return _volver_a_la_semana(entrada.fecha)
     return redirect('vista_agendamiento')
 
 # -----------------------------------------------------------------
@@ -224,4 +329,179 @@ def buzon_sugerencias(request):
 
     # --- LÓGICA DEL GET (CUANDO EL USUARIO SOLO VISITA LA PÁGINA) ---
     # Si no es POST, es GET, así que solo mostramos la página normalmente.
-    return render(request, 'sugerencias.html')
\ No newline at end of file
+    return render(request, 'sugerencias.html')
+
+# -----------------------------------------------------------------
+# API JSON DE AGENDAMIENTO
+# -----------------------------------------------------------------
+# Permiten que agendar.html actualice solo la celda que cambió, sin
+# recargar toda la página después de reservar o cancelar.
+
+def login_requerido_json(vista):
+    """Como login_required, pero responde 401 en JSON en vez de redirigir al login."""
+    @wraps(vista)
+    def envoltura(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Debes iniciar sesión.'}, status=401)
+        return vista(request, *args, **kwargs)
+    return envoltura
+
+
+def _lunes_solicitado(request):
+    """
+    Lunes de la semana pedida con ?semana=AAAA-MM-DD (por defecto, la actual),
+    dentro de las semanas que se pueden reservar (disponibilidad.semanas_visibles).
+    """
+    try:
+        fecha = datetime.date.fromisoformat(request.GET['semana'])
+    except (KeyError, ValueError):
+        fecha = timezone.localdate()
+    return disponibilidad.acotar_semana(disponibilidad.lunes_de(fecha))
+
+
+def _etag_agenda(request):
+    # Solo usa el caché: si el ETag coincide se responde 304 sin consultar la grilla
+    return disponibilidad.etag_semana(_lunes_solicitado(request), request.user.pk)
+
+
+def _celda_json(bloque, fecha, reserva_id):
+    return {
+        'bloque_id': bloque.id,
+        'fecha': fecha.isoformat(),
+        'cupos': bloque.capacidad_maxima - cupos_ocupados(bloque.id, fecha),
+        'reserva_id': reserva_id,
+        'cerrado': disponibilidad.motivo_cierre(bloque.id, fecha),
+    }
+
+
+@login_requerido_json
+@require_GET
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_etag_agenda)
+def api_agenda(request):
+    """Grilla semanal en JSON (bloques, días, cupos y reservas del usuario)."""
+    lunes = _lunes_solicitado(request)
+    dias, filas = disponibilidad.grilla_usuario(request.user, lunes)
+    datos = disponibilidad.grilla_json(dias, filas)
+    datos['semana'] = lunes.isoformat()
+    return JsonResponse(datos)
+
+
+@login_requerido_json
+@require_POST
+def api_reservar(request):
+    """Versión JSON del POST de vista_agendamiento."""
+    try:
+        reserva = crear_reserva(request.user, request.POST.get("bloque_id"), request.POST.get("fecha"))
+    except ValidationError as e:
+        return JsonResponse({'error': '. '.join(e.messages)}, status=409)
+
+    datos = _celda_json(reserva.bloque, reserva.fecha, reserva.id)
+    datos['mensaje'] = f"¡Reserva confirmada! {reserva.bloque.nombre} el {reserva.fecha}."
+    return JsonResponse(datos, status=201)
+
+
+@login_requerido_json
+@require_POST
+def api_cancelar(request, reserva_id):
+    """Versión JSON de cancelar_reserva."""
+    reserva = Reserva.objects.select_related('bloque').filter(id=reserva_id, usuario=request.user).first()
+    if reserva is None:
+        return JsonResponse({'error': 'La reserva no existe.'}, status=404)
+
+    try:
+        reserva.delete()
+    except ValidationError as e:
+        return JsonResponse({'error': '. '.join(e.messages)}, status=409)
+    datos = _celda_json(reserva.bloque, reserva.fecha, None)
+    datos['mensaje'] = f"Reserva para {reserva.bloque.nombre} el {reserva.fecha} cancelada exitosamente."
+    return JsonResponse(datos)
+
+
+async def api_eventos_agenda(request):
+    """
+    Flujo SSE con los cambios de cupos de la semana (?semana=AAAA-MM-DD).
+
+    Es una vista asíncrona: bajo ASGI cada conexión abierta es solo una
+    tarea esperando en su cola, no un hilo. Con WSGI (runserver) no se puede
+    mantener la conexión, así que se responde 204 y el navegador no reintenta.
+    """
+    usuario = await request.auser()
+    if not usuario.is_authenticated:
+        return HttpResponse(status=401)
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+
+    respuesta = StreamingHttpResponse(
+        eventos.flujo_semana(_lunes_solicitado(request)),
+        content_type='text/event-stream',
+    )
+    respuesta['Cache-Control'] = 'no-cache'
+    respuesta['X-Accel-Buffering'] = 'no'  # Que nginx no acumule los eventos
+    return respuesta
+
+# -----------------------------------------------------------------
+# CÓDIGO DE ENTRADA Y KIOSKO (ver asistencia.py)
+# -----------------------------------------------------------------
+# El kiosko se habilita una vez con una cuenta del staff, que deja una
+# cookie firmada en ese navegador. api_checkin solo revisa esa cookie y la
+# firma del código: no lee la sesión ni la base de datos.
+COOKIE_KIOSKO = 'kiosko'
+SAL_KIOSKO = 'agendamiento.kiosko'
+DURACION_KIOSKO = 12 * 60 * 60
+
+
+@login_required
+def codigo_entrada(request, reserva_id):
+    """QR con el código firmado de una reserva del usuario, para mostrarlo en el kiosko."""
+    reserva = get_object_or_404(Reserva.objects.select_related('bloque', 'usuario'), id=reserva_id, usuario=request.user)
+    return render(request, 'agendamiento/entrada.html', {
+        'reserva': reserva,
+        'token': asistencia.token_de(reserva),
+    })
+
+
+@staff_member_required
+@require_GET
+def vista_kiosko(request):
+    """Pantalla del kiosko: el lector de QR escribe el código en el campo y se envía a api_checkin."""
+    respuesta = render(request, 'agendamiento/kiosko.html')
+    respuesta.set_signed_cookie(
+        COOKIE_KIOSKO, request.user.username, salt=SAL_KIOSKO,
+        max_age=DURACION_KIOSKO, httponly=True, samesite='Strict',
+    )
+    return respuesta
+
+
+@require_POST
+def api_checkin(request):
+    """Registra la entrada de un código escaneado. Responde {estado, usuario, bloque} o {error}."""
+    if request.get_signed_cookie(COOKIE_KIOSKO, default=None, salt=SAL_KIOSKO, max_age=DURACION_KIOSKO) is None:
+        return JsonResponse({'error': 'Este navegador no está habilitado como kiosko.'}, status=403)
+    try:
+        datos = asistencia.verificar(request.POST.get('codigo', ''))
+    except ValidationError as e:
+        return JsonResponse({'error': '. '.join(e.messages)}, status=400)
+    return JsonResponse({
+        'estado': asistencia.registrar(datos),
+        'usuario': datos['n'],
+        'bloque': datos['nb'],
+    })
+
+# -----------------------------------------------------------------
+# MÉTRICAS (Prometheus)
+# -----------------------------------------------------------------
+
+@require_GET
+def vista_metricas(request):
+    """Métricas del proceso en formato Prometheus (ver metricas.py). Solo staff, METRICAS_TOKEN o METRICAS_IPS."""
+    token = settings.METRICAS_TOKEN
+    autorizacion = request.headers.get('Authorization', '')
+    permitido = (
+        request.user.is_staff
+        or (token and constant_time_compare(autorizacion, f'Bearer {token}'))
+        or limites.ip_cliente(request) in settings.METRICAS_IPS
+    )
+    if not permitido:
+        return HttpResponse(status=403)
+    return HttpResponse(metricas.exponer(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,153 @@
+"""
+Versiones asíncronas de las vistas de reservar, para el despliegue ASGI
+(settings.AGENDA_VISTAS_ASYNC, ver urls.py). Responden igual que las de
+views.py, pero mientras esperan a la base de datos el event loop atiende
+otras peticiones en vez de tener un hilo bloqueado por cada una.
+
+- El usuario se obtiene con `await request.auser()`: request.user consulta
+  la sesión con el ORM síncrono, que no se puede usar desde el event loop.
+- Las lecturas usan el ORM asíncrono (aget, afirst, `async for`) y el caché
+  de la grilla (ver las versiones asíncronas de disponibilidad.py).
+- Reservar y cancelar usan acreate/adelete: Reserva.save y Reserva.delete
+  son una transacción (ver escrituras.py) y corren enteras en el hilo de la
+  base de datos.
+- Las plantillas se dibujan con sync_to_async: sus context processors
+  (usuario y mensajes) leen la sesión con el ORM síncrono.
+
+Para comparar con las síncronas: python manage.py prueba_async.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import ValidationError
+from django.http import JsonResponse
+from django.shortcuts import aget_object_or_404, render
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import require_GET, require_POST
+
+from . import disponibilidad
+from .models import Reserva, SerieReserva
+from .ocupacion import acrear_reserva, acupos_ocupados
+from .views import _contexto_agenda, _lunes_solicitado, _volver_a_la_semana
+
+
+@login_required
+async def vista_agendamiento(request):
+    usuario = await request.auser()
+
+    if request.method == "POST":
+        try:
+            reserva = await acrear_reserva(usuario, request.POST.get("bloque_id"), request.POST.get("fecha"))
+            messages.success(request, f"¡Reserva confirmada! {reserva.bloque.nombre} el {reserva.fecha}.")
+        except ValidationError as e:
+            messages.error(request, '. '.join(e.messages))
+        except Exception as e:
+            messages.error(request, f"Ocurrió un error inesperado: {e}")
+        return _volver_a_la_semana(request.POST.get("fecha"))
+
+    lunes = _lunes_solicitado(request)
+    dias_de_la_semana, datos_para_plantilla = await disponibilidad.agrilla_usuario(usuario, lunes)
+    series_usuario = [
+        serie async for serie in SerieReserva.objects.filter(
+            usuario=usuario, fecha_fin__gte=timezone.localdate()
+        ).select_related('bloque').order_by('fecha_inicio')
+    ]
+    contexto = _contexto_agenda(lunes, dias_de_la_semana, datos_para_plantilla, series_usuario)
+    return await sync_to_async(render)(request, 'agendamiento/agendar.html', contexto)
+
+
+@login_required
+@require_POST
+async def cancelar_reserva(request, reserva_id):
+    usuario = await request.auser()
+    reserva = await aget_object_or_404(Reserva.objects.select_related('bloque'), id=reserva_id, usuario=usuario)
+    try:
+        await reserva.adelete()
+    except ValidationError as e:
+        messages.error(request, '. '.join(e.messages))
+        return _volver_a_la_semana(reserva.fecha)
+
+    messages.success(request, f"Reserva para {reserva.bloque.nombre} el {reserva.fecha} cancelada exitosamente.")
+    return _volver_a_la_semana(reserva.fecha)
+
+# -----------------------------------------------------------------
+# API JSON
+# -----------------------------------------------------------------
+
+def login_requerido_json(vista):
+    """Como views.login_requerido_json, con `await request.auser()`."""
+    @wraps(vista)
+    async def envoltura(request, *args, **kwargs):
+        if not (await request.auser()).is_authenticated:
+            return JsonResponse({'error': 'Debes iniciar sesión.'}, status=401)
+        return await vista(request, *args, **kwargs)
+    return envoltura
+
+
+async def _celda_json(bloque, fecha, reserva_id):
+    return {
+        'bloque_id': bloque.id,
+        'fecha': fecha.isoformat(),
+        'cupos': bloque.capacidad_maxima - await acupos_ocupados(bloque.id, fecha),
+        'reserva_id': reserva_id,
+        'cerrado': await disponibilidad.amotivo_cierre(bloque.id, fecha),
+    }
+
+
+@login_requerido_json
+@require_GET
+@cache_control(private=True, no_cache=True)
+async def api_agenda(request):
+    """
+    Como views.api_agenda. El 304 se resuelve aquí y no con @condition, que
+    llama a la función del ETag sin await.
+    """
+    usuario = await request.auser()
+    lunes = _lunes_solicitado(request)
+    etag = quote_etag(await disponibilidad.aetag_semana(lunes, usuario.pk))
+    respuesta = get_conditional_response(request, etag=etag)
+    if respuesta is not None:
+        return respuesta
+
+    dias, filas = await disponibilidad.agrilla_usuario(usuario, lunes)
+    datos = disponibilidad.grilla_json(dias, filas)
+    datos['semana'] = lunes.isoformat()
+    respuesta = JsonResponse(datos)
+    respuesta['ETag'] = etag
+    return respuesta
+
+
+@login_requerido_json
+@require_POST
+async def api_reservar(request):
+    try:
+        reserva = await acrear_reserva(await request.auser(), request.POST.get("bloque_id"), request.POST.get("fecha"))
+    except ValidationError as e:
+        return JsonResponse({'error': '. '.join(e.messages)}, status=409)
+
+    datos = await _celda_json(reserva.bloque, reserva.fecha, reserva.id)
+    datos['mensaje'] = f"¡Reserva confirmada! {reserva.bloque.nombre} el {reserva.fecha}."
+    return JsonResponse(datos, status=201)
+
+
+@login_requerido_json
+@require_POST
+async def api_cancelar(request, reserva_id):
+    reserva = await Reserva.objects.select_related('bloque').filter(
+        id=reserva_id, usuario=await request.auser()
+    ).afirst()
+    if reserva is None:
+        return JsonResponse({'error': 'La reserva no existe.'}, status=404)
+
+    try:
+        await reserva.adelete()
+    except ValidationError as e:
+        return JsonResponse({'error': '. '.join(e.messages)}, status=409)
+    datos = await _celda_json(reserva.bloque, reserva.fecha, None)
+    datos['mensaje'] = f"Reserva para {reserva.bloque.nombre} el {reserva.fecha} cancelada exitosamente."
+    return JsonResponse(datos)
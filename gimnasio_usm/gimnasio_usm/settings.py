@@ -43,11 +43,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'agendamiento.middleware.MetricasMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'agendamiento.middleware.LimitePeticionesMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -82,6 +84,52 @@ DATABASES = {
     }
 }
 
+# SQLite para producción (varios workers de gunicorn escribiendo a la vez).
+# Se activa con la variable de entorno GIMNASIO_SQLITE_PRODUCCION=1 en el
+# servicio; sin ella (runserver, check, migrate en desarrollo) la base queda
+# en el modo de journal por defecto: db.sqlite3 no pasa a WAL ni aparecen
+# los archivos -wal/-shm.
+# - WAL: las lecturas no esperan a las escrituras ni al revés. Queda grabado
+#   en el archivo: para volver atrás, "PRAGMA journal_mode=DELETE".
+# - timeout: segundos que una escritura espera el lock antes de fallar con
+#   "database is locked" (es el busy timeout de SQLite).
+# - BEGIN IMMEDIATE: la transacción pide el lock de escritura al empezar y no
+#   a mitad de camino, donde SQLite falla sin respetar el timeout.
+# - CONN_MAX_AGE: conexiones persistentes, sin reabrir el archivo ni repetir
+#   los PRAGMA en cada request.
+SQLITE_PRODUCCION = os.environ.get('GIMNASIO_SQLITE_PRODUCCION') == '1'
+SQLITE_OPCIONES_PRODUCCION = {
+    'timeout': 20,
+    'transaction_mode': 'IMMEDIATE',
+    'init_command': (
+        'PRAGMA journal_mode=WAL;'
+        'PRAGMA synchronous=NORMAL;'  # Con WAL no arriesga la base, solo la última transacción si se corta la luz
+        'PRAGMA cache_size=-20000;'  # 20 MB de caché de páginas por conexión
+        'PRAGMA temp_store=MEMORY;'
+    ),
+}
+if SQLITE_PRODUCCION:
+    DATABASES['default'].update(CONN_MAX_AGE=600, CONN_HEALTH_CHECKS=True, OPTIONS=SQLITE_OPCIONES_PRODUCCION)
+
+# Fila de escrituras dentro de cada proceso (ver agendamiento/escrituras.py),
+# solo junto con la configuración de producción
+SQLITE_SERIALIZAR_ESCRITURAS = SQLITE_PRODUCCION
+SQLITE_ESPERA_ESCRITURA = 10  # segundos
+
+
+# Caché (grilla de agendamiento, ver agendamiento/disponibilidad.py)
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# LocMemCache es por proceso: con varios workers (gunicorn) usar un caché
+# compartido (Redis o Memcached) para que las invalidaciones lleguen a todos.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'gimnasio-usm',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -130,6 +178,121 @@ STATICFILES_DIRS = [
 ]
 # ---------------------------
 
+# --- Archivos estáticos propios (ver agendamiento/estaticos.py) ---
+# "python manage.py construir_estaticos" genera el CSS y copia las librerías
+# y luego corre collectstatic hacia STATIC_ROOT. Con DEBUG, runserver sirve
+# directo desde static/ sin hash ni compresión.
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {
+        'BACKEND': (
+            'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+            else 'agendamiento.estaticos.EstaticosComprimidos'
+        ),
+    },
+}
+
+# --- Resultados de la encuesta (ver agendamiento/encuesta.py) ---
+# Exportación CSV del formulario de Google; se descarga e importa con
+# "python manage.py refrescar_encuesta --url <enlace CSV publicado>"
+ENCUESTA_EXPORTACION_CSV = BASE_DIR / 'static' / 'data' / 'encuesta_exportacion.csv'
+ENCUESTA_URL_EXPORTACION = 'https://docs.google.com/spreadsheets/d/e/2PACX-1vSwQAawOukFYJfpuQnx5_BhpR1R1QbtaEhf167hrGWImQ-BFfkAocf_QGuMcHKoFV3ObWiDxyHhtwGU/pub?output=csv'
+ENCUESTA_CACHE_TTL = 60 * 60  # segundos
+
+# --- Horario del gimnasio (ver agendamiento/horario.py) ---
+# Bloques, días en que se ofrece cada uno, capacidades y cierres (feriados,
+# mantenciones). Se aplica con "python manage.py crear_bloques".
+HORARIO_GIMNASIO = BASE_DIR / 'agendamiento' / 'horario.json'
+
+# --- Archivo de reservas (ver agendamiento/archivo.py) ---
+# Semanas pasadas que se quedan en la tabla Reserva; las anteriores las mueve
+# "python manage.py archivar_reservas" a ReservaArchivada.
+ARCHIVO_SEMANAS_PASADAS = 0
+
+# --- Semanas que se pueden ver y reservar (ver agendamiento/disponibilidad.py) ---
+# Desde la semana actual hasta esta cantidad de semanas más adelante.
+AGENDA_SEMANAS_ADELANTE = 8
+
+# --- Vistas asíncronas (ver agendamiento/vistas_async.py) ---
+# Con ASGI (uvicorn/daphne con gimnasio_usm.asgi) reservar, cancelar y la
+# grilla usan las vistas asíncronas. Con WSGI (runserver, gunicorn) dejarlo
+# en False: una vista asíncrona bajo WSGI corre con su propio event loop y es
+# más lenta que la síncrona.
+AGENDA_VISTAS_ASYNC = False
+
+# --- Límites de peticiones (ver agendamiento/limites.py) ---
+# Por grupo de vistas (nombres de URL), solo para POST. 'usuario', 'ip' y
+# 'cuenta' (el nombre de usuario que se intenta en el login) son (fichas de
+# la cubeta, fichas que se recuperan por minuto). El límite por IP es mucho
+# más alto porque en el campus muchos alumnos salen por la misma IP (NAT):
+# en el login lo que frena a quien prueba contraseñas es el de 'cuenta'.
+LIMITES_PETICIONES = {
+    'reservas': {
+        'vistas': ['vista_agendamiento', 'api_reservar', 'crear_serie_reservas', 'unirse_lista_espera'],
+        'usuario': (10, 20),
+        'ip': (200, 600),
+        'sala_espera': True,
+    },
+    'cancelaciones': {
+        'vistas': ['cancelar_reserva', 'api_cancelar', 'cancelar_serie_reservas', 'salir_lista_espera'],
+        'usuario': (10, 20),
+        'ip': (200, 600),
+    },
+    'acceso': {
+        'vistas': ['login', 'registro'],
+        'ip': (300, 300),  # la apertura de la semana, con medio campus entrando a la vez
+        'cuenta': (5, 5),
+    },
+}
+# Proxies de confianza delante de Django (nginx = 1). La IP del cliente sale
+# de X-Forwarded-For (ver limites.ip_cliente): con 0, de REMOTE_ADDR, que
+# detrás de nginx es 127.0.0.1 para todos. Solo poner > 0 si el proxy
+# siempre agrega el encabezado; si no, el cliente podría inventar su IP.
+LIMITES_PROXIES = 0
+
+# Sala de espera al abrirse la semana nueva (lunes 00:00) para los grupos con
+# 'sala_espera'. None la desactiva; por ejemplo {'minutos': 10, 'por_segundo': 20}
+# admite 20 alumnos nuevos por segundo, por orden de llegada, los primeros 10 minutos.
+AGENDA_SALA_ESPERA = None
+
+# --- Métricas en /metrics (ver agendamiento/metricas.py) ---
+# Además del staff, puede leerlas quien mande "Authorization: Bearer <token>"
+# (bearer_token en la configuración de Prometheus) o venga de estas IPs. Las
+# IPs se comparan con limites.ip_cliente: detrás de nginx sin LIMITES_PROXIES
+# todas las peticiones vienen de 127.0.0.1, por eso la lista parte vacía.
+METRICAS_TOKEN = os.environ.get('GIMNASIO_METRICAS_TOKEN')
+METRICAS_IPS = []
+# Perfilador de las peticiones lentas. None lo desactiva; por ejemplo
+# {'muestreo': 0.01, 'umbral_ms': 500, 'carpeta': BASE_DIR / 'perfiles', 'maximo': 20}
+# perfila el 1% de las peticiones y guarda las 20 más lentas de más de 500 ms.
+METRICAS_PERFILADOR = None
+
+# --- Cola de tareas y correos (ver agendamiento/tareas.py y notificaciones.py) ---
+# "python manage.py runworker" envía los correos fuera de las peticiones. En
+# desarrollo quedan como archivos en correos/; en producción, configurar SMTP
+# (EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend', EMAIL_HOST, ...).
+EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
+EMAIL_FILE_PATH = BASE_DIR / 'correos'
+DEFAULT_FROM_EMAIL = 'Gimnasio USM <gimnasio@usm.cl>'
+# Cuánto antes del bloque llega el recordatorio (segundos)
+NOTIFICACIONES_RECORDATORIO_ANTES = 2 * 60 * 60
+# Una tarea en curso por más de esto (worker caído) vuelve a la fila (segundos)
+TAREAS_TIEMPO_MAXIMO = 5 * 60
+# Días que se guardan las tareas hechas antes de borrarlas
+TAREAS_GUARDAR_DIAS = 7
+# Tareas que el worker vuelve a programar solas: {nombre: cada cuántos segundos}.
+# Ej. {'calentar_agenda': 300}, útil solo con un caché compartido (no LocMemCache).
+TAREAS_PERIODICAS = {}
+
+# --- Kiosko de entrada (ver agendamiento/asistencia.py) ---
+# Cuánto antes del inicio del bloque se acepta el código de entrada (segundos)
+ASISTENCIA_ANTES = 15 * 60
+# Las entradas se guardan de a lotes: al juntar ASISTENCIA_LOTE o a los
+# ASISTENCIA_ESPERA segundos de la primera (None: solo al llenar el lote)
+ASISTENCIA_LOTE = 20
+ASISTENCIA_ESPERA = 5
+
 # --- Configuración de Login ---
 # AÑADE ESTA LÍNEA para redirigir al usuario a la página principal después del login
 LOGIN_REDIRECT_URL = '/'
@@ -15,10 +15,11 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include 
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib.auth import views as auth_views
+from agendamiento import estaticos
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -35,3 +36,6 @@ urlpatterns = [
 # durante el desarrollo (DEBUG=True)
 if settings.DEBUG:
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATICFILES_DIRS[0])
+else:
+    # Sin DEBUG: lo que dejó collectstatic, comprimido y con caché larga (ver agendamiento/estaticos.py)
+    urlpatterns += [re_path(rf'^{settings.STATIC_URL.strip("/")}/(?P<ruta>.+)$', estaticos.servir, name='estaticos')]
@@ -0,0 +1,15 @@
+// Clases que usan las plantillas: app.css solo incluye esas (ver agendamiento/estaticos.py).
+/** @type {import('tailwindcss').Config} */
+module.exports = {
+  content: [
+    './templates/**/*.html',
+    './agendamiento/templates/**/*.html',
+  ],
+  theme: {
+    extend: {
+      fontFamily: {
+        sans: ['Inter', 'ui-sans-serif', 'system-ui', 'sans-serif'],
+      },
+    },
+  },
+};